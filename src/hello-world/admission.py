@@ -0,0 +1,246 @@
+"""
+YubiKey Admission Control - Concurrency limits and backpressure for device access.
+
+Every ykman or gpg invocation acquires a slot for its device and a global slot
+before it runs. Commands without a serial (enumeration, or a device not yet
+known) may touch any attached YubiKey, so they take the slot of every device.
+
+Callers that cannot get a slot wait in a bounded FIFO queue until a deadline.
+When the queue is full or the deadline passes, they are rejected with a
+BusyError carrying a retry-after hint instead of piling more processes onto
+the PC/SC stack and the USB bus.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+DEFAULT_GLOBAL_LIMIT = int(os.environ.get("YUBIKEY_MAX_CONCURRENT", "8"))
+DEFAULT_DEVICE_LIMIT = int(os.environ.get("YUBIKEY_MAX_CONCURRENT_PER_DEVICE", "1"))
+DEFAULT_MAX_QUEUE = int(os.environ.get("YUBIKEY_MAX_QUEUE", "16"))
+DEFAULT_MAX_WAIT = float(os.environ.get("YUBIKEY_MAX_QUEUE_WAIT", "60"))  # seconds; touch prompts hold slots for a while
+
+WAIT_SAMPLES = 256  # Recent wait times kept per gate for percentiles
+DEFAULT_DEVICE_KEY = "default"  # Commands without a known serial; they also hold every device gate
+
+
+class BusyError(Exception):
+    """Raised when a slot cannot be granted; the caller should retry after retry_after_ms."""
+
+    def __init__(self, message: str, retry_after_ms: int):
+        super().__init__(message)
+        self.retry_after_ms = retry_after_ms
+
+
+@dataclass
+class GateStats:
+    admitted: int = 0
+    rejected_full: int = 0
+    rejected_timeout: int = 0
+    max_queued: int = 0
+
+
+class _Gate:
+    """A FIFO-fair counting semaphore with a bounded wait queue."""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.in_flight = 0
+        self.stats = GateStats()
+        self.waits_ms: deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.hold_ms = 0.0  # Moving average of how long a slot is held
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after_ms(self) -> int:
+        """Estimate when a slot frees up: queue ahead of us times the average hold time per slot."""
+        hold = self.hold_ms or 100.0
+        return max(10, int(hold * (self.queued + 1) / self.limit))
+
+    async def acquire(self, deadline: float) -> None:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.stats.admitted += 1
+            self.waits_ms.append(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.stats.rejected_full += 1
+            raise BusyError(
+                f"{self.name} is busy ({self.in_flight} running, {self.queued} queued); "
+                f"retry after {self.retry_after_ms()} ms",
+                self.retry_after_ms(),
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats.max_queued = max(self.stats.max_queued, len(self._waiters))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=max(0.0, deadline - started))
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()  # Granted just as we gave up; hand it on
+            else:
+                waiter.cancel()
+            self.stats.rejected_timeout += 1
+            raise BusyError(
+                f"{self.name} is busy; no slot became free within {deadline - started:.1f}s, "
+                f"retry after {self.retry_after_ms()} ms",
+                self.retry_after_ms(),
+            ) from None
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+        self.stats.admitted += 1
+        self.waits_ms.append((time.monotonic() - started) * 1000)
+
+    def release(self, held_ms: float) -> None:
+        self.hold_ms = held_ms if not self.hold_ms else 0.8 * self.hold_ms + 0.2 * held_ms
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        # Hand the slot directly to the next live waiter so in_flight never exceeds the limit
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def snapshot(self) -> dict[str, object]:
+        waits = sorted(self.waits_ms)
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.stats.max_queued,
+            "admitted": self.stats.admitted,
+            "rejected_queue_full": self.stats.rejected_full,
+            "rejected_timeout": self.stats.rejected_timeout,
+            "wait_ms_avg": round(sum(waits) / len(waits), 1) if waits else 0.0,
+            "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+            "hold_ms_avg": round(self.hold_ms, 1),
+        }
+
+
+class Slot:
+    """Held device + global slots; release() is idempotent."""
+
+    def __init__(self, gates: list[_Gate]):
+        self._gates = gates
+        self._acquired_at = time.monotonic()
+
+    def release(self) -> None:
+        held_ms = (time.monotonic() - self._acquired_at) * 1000
+        gates, self._gates = self._gates, []
+        for gate in reversed(gates):
+            gate.release(held_ms)
+
+    async def __aenter__(self) -> "Slot":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """Global and per-device concurrency limits with bounded, deadline-aware queues.
+
+    Must be used from a single event loop. Device gates are created on first use.
+
+    Args:
+        attached_serials: Returns the serials currently attached, so a serial-less
+                          command also blocks devices that have not been used yet
+    """
+
+    def __init__(
+        self,
+        global_limit: int = DEFAULT_GLOBAL_LIMIT,
+        device_limit: int = DEFAULT_DEVICE_LIMIT,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        max_wait: float = DEFAULT_MAX_WAIT,
+        attached_serials: Callable[[], Iterable[int]] | None = None
+    ):
+        self.device_limit = device_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.attached_serials = attached_serials
+        self._global = _Gate("The server", global_limit, max_queue)
+        self._devices: dict[int | str, _Gate] = {}
+
+    @property
+    def global_limit(self) -> int:
+        return self._global.limit
+
+    def _device_gate(self, serial: int | None) -> _Gate:
+        key = serial if serial is not None else DEFAULT_DEVICE_KEY
+        gate = self._devices.get(key)
+        if gate is None:
+            name = f"YubiKey {serial}" if serial is not None else "The YubiKey"
+            gate = self._devices[key] = _Gate(name, self.device_limit, self.max_queue)
+        return gate
+
+    def _gates_for(self, serial: int | None) -> list[_Gate]:
+        if serial is not None:
+            return [self._device_gate(serial)]
+        # Serial-less: the default gate first, then every device gate in a fixed
+        # order. Per-device calls hold a single gate, so this cannot deadlock.
+        serials = {key for key in self._devices if key != DEFAULT_DEVICE_KEY}
+        if self.attached_serials is not None:
+            serials.update(self.attached_serials())
+        return [self._device_gate(None)] + [self._device_gate(s) for s in sorted(serials)]
+
+    async def acquire(self, serial: int | None, max_wait: float | None = None, global_slot: bool = True) -> Slot:
+        """Wait for a slot on the device and a global slot.
+
+        The device slot is taken first, so a call waiting on a busy device does
+        not hold a global slot that other devices could use. A call without a
+        serial waits for a slot on every device, since ykman may pick any of
+        them. Work that runs no process (e.g. in-process HID calls) can pass
+        global_slot=False.
+
+        Raises:
+            BusyError: If a queue is full or no slot frees up before the deadline
+        """
+        deadline = time.monotonic() + (self.max_wait if max_wait is None else max_wait)
+        gates = self._gates_for(serial)
+        if global_slot:
+            gates.append(self._global)
+        held: list[_Gate] = []
+        try:
+            for gate in gates:
+                await gate.acquire(deadline)
+                held.append(gate)
+        except BaseException:
+            for gate in reversed(held):
+                gate._release_slot()  # Held for no work, so keep it out of the hold time average
+            raise
+        return Slot(held)
+
+    def status(self) -> dict[str, object]:
+        return {
+            "limits": {
+                "global": self._global.limit,
+                "per_device": self.device_limit,
+                "max_queue": self.max_queue,
+                "max_wait_seconds": self.max_wait,
+            },
+            "global": self._global.snapshot(),
+            "devices": {str(key): gate.snapshot() for key, gate in self._devices.items()},
+        }
@@ -0,0 +1,260 @@
+"""
+YubiKey Aggregator - Routes ykman commands to device agents on other hosts.
+
+When the MCP server is started with YUBIKEY_AGENTS=host:port,..., every ykman
+command goes through an Aggregator instead of the local ykman:
+
+- `list` / `list --serials` fan out to every agent and merge the results
+  (device lines are prefixed with the agent name, e.g. "[bench-a] YubiKey 5 ...")
+- commands with `--device SERIAL` are routed to the agent that owns the serial
+- commands without a serial are routed to the only device in the fleet, or
+  fail with ykman's "multiple YubiKeys" error so the usual device selection
+  prompt kicks in
+
+Fleet operations that already run one command per serial in parallel
+(attestation, batch provisioning) therefore fan out across hosts.
+
+Connections use TLS when YUBIKEY_AGENT_TLS_CA names the CA that signed the
+agents' certificates. Without it the client only talks to agents on loopback
+addresses, since requests carry the token and PINs.
+"""
+
+import json
+import os
+import queue
+import socket
+import ssl
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from device_agent import DEFAULT_PORT, MAX_MESSAGE_BYTES, encode_message, is_loopback
+
+DEFAULT_TIMEOUT = float(os.environ.get("YUBIKEY_AGENT_TIMEOUT", "300"))  # Touch and key generation can be slow
+MULTIPLE_DEVICES_ERROR = "Error: Multiple YubiKeys detected. Use --device SERIAL to specify which one to use."
+
+
+class AgentError(Exception):
+    """Raised when an agent is unreachable or rejects a request."""
+
+
+def client_ssl_context(
+    ca_file: str | None = None,
+    cert_file: str | None = None,
+    key_file: str | None = None
+) -> ssl.SSLContext:
+    """TLS context verifying agents against ca_file, optionally presenting a client certificate."""
+    context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=ca_file)
+    if cert_file:
+        context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+class AgentClient:
+    """Blocking client for one device agent, with a small pool of persistent connections."""
+
+    def __init__(
+        self,
+        address: str,
+        token: str | None = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        ssl_context: ssl.SSLContext | None = None
+    ):
+        host, separator, port = address.rpartition(":")
+        self.host = host if separator else address
+        self.port = int(port) if separator else DEFAULT_PORT
+        self.address = f"{self.host}:{self.port}"
+        self.token = token
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.name = self.address
+        self._connections: queue.LifoQueue = queue.LifoQueue()
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+
+    def _connect(self) -> tuple[socket.socket, Any]:
+        if self.ssl_context is None and not is_loopback(self.host, self.port):
+            raise AgentError(
+                f"Agent {self.address} is not on a loopback address; set YUBIKEY_AGENT_TLS_CA "
+                "to connect over TLS instead of sending the token and PINs in cleartext"
+            )
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if self.ssl_context is not None:
+            try:
+                sock = self.ssl_context.wrap_socket(sock, server_hostname=self.host)
+            except OSError:
+                sock.close()
+                raise
+        stream = sock.makefile("rb")
+        connection = (sock, stream)
+        hello = self._exchange(connection, "hello", {"token": self.token})
+        self.name = hello.get("name", self.address)
+        return connection
+
+    def _exchange(self, connection: tuple[socket.socket, Any], method: str, params: dict[str, Any]) -> Any:
+        sock, stream = connection
+        with self._id_lock:
+            self._next_id += 1
+            request_id = self._next_id
+        sock.sendall(encode_message({"id": request_id, "method": method, "params": params}))
+        line = stream.readline(MAX_MESSAGE_BYTES)
+        if not line:
+            raise ConnectionError(f"Agent {self.address} closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise AgentError(f"Agent {self.name}: {response['error']}")
+        return response["result"]
+
+    def call(self, method: str, **params: Any) -> Any:
+        """Send one request, reconnecting once if a pooled connection went stale."""
+        for attempt in range(2):
+            try:
+                connection = self._connections.get_nowait()
+                reused = True
+            except queue.Empty:
+                try:
+                    connection = self._connect()
+                except OSError as e:
+                    raise AgentError(f"Agent {self.address} is unreachable: {e}") from e
+                reused = False
+
+            try:
+                result = self._exchange(connection, method, params)
+            except (OSError, ConnectionError, json.JSONDecodeError) as e:
+                connection[0].close()
+                if reused and attempt == 0:
+                    continue
+                raise AgentError(f"Agent {self.address} failed: {e}") from e
+            except AgentError:
+                connection[0].close()
+                raise
+
+            self._connections.put(connection)
+            return result
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._connections.get_nowait()[0].close()
+            except queue.Empty:
+                break
+
+
+class Aggregator:
+    """Merges device inventories across agents and routes commands by serial."""
+
+    def __init__(self, clients: list[AgentClient]):
+        self.clients = clients
+        self._routes: dict[int, AgentClient] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(4, len(clients)), thread_name_prefix="agent")
+
+    @classmethod
+    def from_env(cls) -> "Aggregator | None":
+        """Build an aggregator from YUBIKEY_AGENTS (with YUBIKEY_AGENT_TOKEN and YUBIKEY_AGENT_TLS_*), or None if unset."""
+        addresses = [a.strip() for a in os.environ.get("YUBIKEY_AGENTS", "").split(",") if a.strip()]
+        if not addresses:
+            return None
+        token = os.environ.get("YUBIKEY_AGENT_TOKEN")
+        ca_file = os.environ.get("YUBIKEY_AGENT_TLS_CA")
+        ssl_context = client_ssl_context(
+            ca_file, os.environ.get("YUBIKEY_AGENT_TLS_CERT"), os.environ.get("YUBIKEY_AGENT_TLS_KEY")
+        ) if ca_file else None
+        return cls([AgentClient(address, token, ssl_context=ssl_context) for address in addresses])
+
+    def inventory(self) -> dict[AgentClient, list[str] | str]:
+        """Fan `list` out to every agent; failures are reported per agent instead of raised."""
+        def list_agent(client: AgentClient) -> list[str] | str:
+            try:
+                return client.call("list")
+            except AgentError as e:
+                return str(e)
+
+        results = dict(zip(self.clients, self._executor.map(list_agent, self.clients)))
+
+        routes = {}
+        for client, lines in results.items():
+            if isinstance(lines, list):
+                for line in lines:
+                    if "Serial: " in line:
+                        try:
+                            routes[int(line.split("Serial: ")[-1].strip())] = client
+                        except ValueError:
+                            continue
+        with self._lock:
+            self._routes = routes
+        return results
+
+    def route(self, serial: int) -> AgentClient | None:
+        with self._lock:
+            client = self._routes.get(serial)
+        if client is None:
+            self.inventory()  # Device may have been plugged in since the last refresh
+            with self._lock:
+                client = self._routes.get(serial)
+        return client
+
+    def run(self, args: list[str]) -> subprocess.CompletedProcess:
+        """Execute a ykman command on whichever host owns the target device.
+
+        Mirrors subprocess.run(["ykman", *args], capture_output=True, text=True, check=True).
+
+        Raises:
+            subprocess.CalledProcessError: If the command fails, the serial is unknown,
+                                           or the owning agent is unreachable
+        """
+        cmd = ["ykman"] + args
+
+        if args in (["list"], ["list", "--serials"]):
+            lines = []
+            for client, result in self.inventory().items():
+                if isinstance(result, list):
+                    if args == ["list"]:
+                        lines.extend(f"[{client.name}] {line}" for line in result)
+                    else:
+                        lines.extend(line.split("Serial: ")[-1].strip() for line in result if "Serial: " in line)
+            return subprocess.CompletedProcess(cmd, 0, "".join(f"{line}\n" for line in lines), "")
+
+        if args[:1] == ["--device"] and len(args) > 1:
+            serial = int(args[1])
+        else:
+            self.inventory()
+            with self._lock:
+                serials = list(self._routes)
+            if not serials:
+                raise subprocess.CalledProcessError(1, cmd, output="", stderr="Error: No YubiKey detected on any agent")
+            if len(serials) > 1:
+                raise subprocess.CalledProcessError(1, cmd, output="", stderr=MULTIPLE_DEVICES_ERROR)
+            serial = serials[0]
+            args = ["--device", str(serial)] + args
+
+        client = self.route(serial)
+        if client is None:
+            raise subprocess.CalledProcessError(
+                1, cmd, output="", stderr=f"Error: No agent has a YubiKey with serial {serial}"
+            )
+
+        try:
+            result = client.call("run", args=args)
+        except AgentError as e:
+            raise subprocess.CalledProcessError(1, cmd, output="", stderr=str(e)) from e
+
+        if result["returncode"] != 0:
+            raise subprocess.CalledProcessError(
+                result["returncode"], cmd, output=result["stdout"], stderr=result["stderr"]
+            )
+        return subprocess.CompletedProcess(cmd, 0, result["stdout"], result["stderr"])
+
+    def status(self) -> list[dict[str, Any]]:
+        """Per-agent reachability and device count."""
+        return [
+            {
+                "agent": client.name,
+                "address": client.address,
+                "reachable": isinstance(result, list),
+                "devices": result if isinstance(result, list) else [],
+                "error": None if isinstance(result, list) else result,
+            }
+            for client, result in self.inventory().items()
+        ]
@@ -0,0 +1,514 @@
+"""
+YubiKey Attestation - Fleet attestation collection and verification.
+
+Collects PIV and OpenPGP attestation certificates from connected YubiKeys and
+verifies each chain (attestation cert -> device attestation CA -> Yubico CAs)
+against a preloaded set of trusted CA certificates. Signature verification is
+fanned out across a process pool so hundreds of keys can be checked at once.
+
+The pool spawns fresh interpreters (never forks the running server) and its
+workers import only this module, not the server's __main__.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import types
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from multiprocessing.context import SpawnContext, SpawnProcess
+from pathlib import Path
+from typing import Any, AsyncContextManager, Awaitable, Callable, Literal
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+Application = Literal["piv", "openpgp"]
+
+# Default location of trusted Yubico root/intermediate CA certificates.
+# Download them from https://developers.yubico.com/PKI/ and drop the PEM/DER
+# files here, or point YUBIKEY_ATTESTATION_CA_DIR at another directory.
+DEFAULT_CA_DIRECTORY = Path(__file__).parent / "attestation_ca"
+
+# Yubico attestation extension OIDs (see developers.yubico.com/PIV/Introduction/PIV_attestation.html)
+PIV_SERIAL_OID = x509.ObjectIdentifier("1.3.6.1.4.1.41482.3.7")
+PIV_FIRMWARE_OID = x509.ObjectIdentifier("1.3.6.1.4.1.41482.3.3")
+OPENPGP_SERIAL_OID = x509.ObjectIdentifier("1.3.6.1.4.1.41482.5.7")
+OPENPGP_FIRMWARE_OID = x509.ObjectIdentifier("1.3.6.1.4.1.41482.5.3")
+
+# Device attestation CA slot for each application
+DEVICE_CA_SLOT: dict[Application, str] = {"piv": "f9", "openpgp": "att"}
+
+# Below this many chains, verifying in-process beats process pool start-up
+PARALLEL_THRESHOLD = 8
+
+# Guards against CA loops in a misconfigured trust store
+MAX_CHAIN_DEPTH = 5
+
+
+# ============================================================================
+# Data Structures
+# ============================================================================
+
+@dataclass
+class AttestationRecord:
+    """Attestation material collected from one key slot of one YubiKey.
+
+    Attributes:
+        serial: Serial number of the YubiKey the material was read from
+        application: "piv" or "openpgp"
+        slot: Key slot that was attested (e.g., "9a", "sig")
+        leaf_der: DER attestation certificate for the slot (None if collection failed)
+        device_ca_der: DER device attestation CA certificate (None if collection failed)
+        error: Collection error message, if any
+        present: False if the slot holds no key (nothing to attest)
+    """
+    serial: int
+    application: Application
+    slot: str
+    leaf_der: bytes | None = None
+    device_ca_der: bytes | None = None
+    error: str | None = None
+    present: bool = True
+
+
+@dataclass
+class AttestationResult:
+    """Outcome of verifying one AttestationRecord.
+
+    Attributes:
+        serial: Serial number the record was collected from
+        application: "piv" or "openpgp"
+        slot: Key slot that was attested
+        verified: True if the chain terminates in a trusted root and the attested serial matches
+        reason: Human-readable explanation of the outcome
+        attested_serial: Serial number embedded in the attestation certificate
+        firmware_version: Firmware version embedded in the attestation certificate
+        chain: Subjects of the verified chain, leaf first
+        present: False if the slot holds no key; such results are neither verified nor failed
+    """
+    serial: int
+    application: Application
+    slot: str
+    verified: bool
+    reason: str
+    attested_serial: int | None = None
+    firmware_version: str | None = None
+    chain: list[str] = field(default_factory=list)
+    present: bool = True
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "application": self.application,
+            "slot": self.slot,
+            "verified": self.verified,
+            "reason": self.reason,
+            "attested_serial": self.attested_serial,
+            "firmware_version": self.firmware_version,
+            "chain": self.chain,
+        }
+
+
+class TrustStore:
+    """Trusted CA certificates indexed by subject for fast issuer lookup.
+
+    Self-signed certificates are treated as roots; everything else is an
+    intermediate that must itself chain to a root.
+    """
+
+    def __init__(self, certificates: list[x509.Certificate]):
+        self.certificates = certificates
+        self._by_subject: dict[bytes, list[x509.Certificate]] = {}
+        for cert in certificates:
+            self._by_subject.setdefault(cert.subject.public_bytes(), []).append(cert)
+
+    @classmethod
+    def from_pem_bytes(cls, *blobs: bytes) -> "TrustStore":
+        """Build a trust store from PEM bundles and/or single DER certificates."""
+        certificates: list[x509.Certificate] = []
+        for blob in blobs:
+            if b"-----BEGIN CERTIFICATE-----" in blob:
+                certificates.extend(x509.load_pem_x509_certificates(blob))
+            else:
+                certificates.append(x509.load_der_x509_certificate(blob))
+        return cls(certificates)
+
+    @classmethod
+    def from_directory(cls, directory: str | Path) -> "TrustStore":
+        """Load every .pem, .crt, .cer and .der file in a directory."""
+        path = Path(directory)
+        if not path.is_dir():
+            raise FileNotFoundError(f"Attestation CA directory not found: {path}")
+
+        blobs = [
+            file.read_bytes()
+            for file in sorted(path.iterdir())
+            if file.suffix.lower() in {".pem", ".crt", ".cer", ".der"}
+        ]
+        store = cls.from_pem_bytes(*blobs)
+        if not store.certificates:
+            raise FileNotFoundError(f"No CA certificates found in {path}")
+        return store
+
+    def issuers_of(self, cert: x509.Certificate) -> list[x509.Certificate]:
+        return self._by_subject.get(cert.issuer.public_bytes(), [])
+
+    def to_der(self) -> tuple[bytes, ...]:
+        """Serialize for handing to process pool workers."""
+        return tuple(cert.public_bytes(serialization.Encoding.DER) for cert in self.certificates)
+
+
+@lru_cache(maxsize=4)
+def load_trust_store(directory: str | None = None) -> TrustStore:
+    """Load (and cache) the trust store for a CA directory.
+
+    Args:
+        directory: CA directory. Defaults to $YUBIKEY_ATTESTATION_CA_DIR, then DEFAULT_CA_DIRECTORY.
+
+    Raises:
+        FileNotFoundError: If the directory is missing or contains no certificates
+    """
+    directory = directory or os.environ.get("YUBIKEY_ATTESTATION_CA_DIR") or str(DEFAULT_CA_DIRECTORY)
+    return TrustStore.from_directory(directory)
+
+
+# ============================================================================
+# Chain Verification
+# ============================================================================
+
+def _decode_der_integer(raw: bytes) -> int | None:
+    """Decode a DER INTEGER (tag 0x02, short-form length)."""
+    if len(raw) < 3 or raw[0] != 0x02 or raw[1] != len(raw) - 2:
+        return None
+    return int.from_bytes(raw[2:], "big")
+
+
+def _extension_bytes(cert: x509.Certificate, oid: x509.ObjectIdentifier) -> bytes | None:
+    try:
+        return cert.extensions.get_extension_for_oid(oid).value.value
+    except x509.ExtensionNotFound:
+        return None
+
+
+def _issued_by(cert: x509.Certificate, issuer: x509.Certificate) -> bool:
+    try:
+        cert.verify_directly_issued_by(issuer)
+        return True
+    except Exception:
+        # InvalidSignature, ValueError (name mismatch) or TypeError (unsupported key type)
+        return False
+
+
+def _chain_to_root(
+    device_ca: x509.Certificate,
+    store: TrustStore
+) -> list[x509.Certificate] | None:
+    """Walk from a device attestation CA up to a trusted self-signed root.
+
+    Returns:
+        The CA certificates above device_ca (nearest first), or None if no path exists
+    """
+    def walk(cert: x509.Certificate, depth: int) -> list[x509.Certificate] | None:
+        if depth > MAX_CHAIN_DEPTH:
+            return None
+        for issuer in store.issuers_of(cert):
+            if not _issued_by(cert, issuer):
+                continue
+            if issuer.subject == issuer.issuer:
+                return [issuer] if _issued_by(issuer, issuer) else None
+            path = walk(issuer, depth + 1)
+            if path is not None:
+                return [issuer] + path
+        return None
+
+    return walk(device_ca, 0)
+
+
+def verify_record(record: AttestationRecord, store: TrustStore) -> AttestationResult:
+    """Verify one attestation record against a trust store.
+
+    Checks that the attestation certificate was signed by the device attestation
+    CA, that the device CA chains to a trusted root, and that the serial number
+    embedded in the attestation matches the device it was read from.
+    """
+    result = AttestationResult(
+        serial=record.serial,
+        application=record.application,
+        slot=record.slot,
+        verified=False,
+        reason="",
+        present=record.present,
+    )
+
+    if not record.present:
+        result.reason = "No key in this slot"
+        return result
+
+    if record.error or record.leaf_der is None or record.device_ca_der is None:
+        result.reason = record.error or "Attestation material was not collected"
+        return result
+
+    try:
+        leaf = x509.load_der_x509_certificate(record.leaf_der)
+        device_ca = x509.load_der_x509_certificate(record.device_ca_der)
+    except ValueError as e:
+        result.reason = f"Malformed certificate: {e}"
+        return result
+
+    serial_oid, firmware_oid = (
+        (PIV_SERIAL_OID, PIV_FIRMWARE_OID) if record.application == "piv"
+        else (OPENPGP_SERIAL_OID, OPENPGP_FIRMWARE_OID)
+    )
+    serial_raw = _extension_bytes(leaf, serial_oid)
+    if serial_raw is not None:
+        result.attested_serial = _decode_der_integer(serial_raw)
+    firmware_raw = _extension_bytes(leaf, firmware_oid)
+    if firmware_raw is not None and len(firmware_raw) == 3:
+        result.firmware_version = ".".join(str(b) for b in firmware_raw)
+
+    if not _issued_by(leaf, device_ca):
+        result.reason = "Attestation certificate is not signed by the device attestation CA"
+        return result
+
+    path = _chain_to_root(device_ca, store)
+    if path is None:
+        result.reason = f"Device attestation CA does not chain to a trusted root (issuer: {device_ca.issuer.rfc4514_string()})"
+        return result
+
+    result.chain = [cert.subject.rfc4514_string() for cert in [leaf, device_ca] + path]
+
+    if result.attested_serial is None:
+        result.reason = "Attestation certificate has no serial number extension; cannot bind it to the device"
+        return result
+    if result.attested_serial != record.serial:
+        result.reason = f"Attested serial {result.attested_serial} does not match device serial {record.serial}"
+        return result
+
+    result.verified = True
+    result.reason = "Key was generated on-device; chain verified to a trusted root"
+    return result
+
+
+# Per-process trust store, preloaded once by the pool initializer
+_worker_store: TrustStore | None = None
+
+
+def _init_worker(ca_ders: tuple[bytes, ...]) -> None:
+    global _worker_store
+    _worker_store = TrustStore.from_pem_bytes(*ca_ders)
+
+
+def _verify_in_worker(record: AttestationRecord) -> AttestationResult:
+    assert _worker_store is not None, "worker trust store not initialised"
+    return verify_record(record, _worker_store)
+
+
+class _WorkerProcess(SpawnProcess):
+    """Spawned pool worker that starts from this module alone.
+
+    spawn normally re-runs the parent's __main__ in each child (for the MCP
+    server that is server.py, with all of its start-up work). Presenting an
+    empty __main__ while the child is launched keeps the worker down to this
+    module's imports; the pool only pickles functions defined here.
+    """
+
+    def start(self) -> None:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            super().start()
+        finally:
+            sys.modules["__main__"] = main
+
+
+class _WorkerContext(SpawnContext):
+    Process = _WorkerProcess
+
+
+class AttestationVerifier:
+    """Verifies attestation records against a trust store using a process pool.
+
+    The pool is created on first use and each worker preloads the trust store
+    once, so only the per-key certificates cross the process boundary. Workers
+    are spawned, not forked, so they inherit none of the server's threads,
+    sockets or open databases.
+    """
+
+    def __init__(self, store: TrustStore, max_workers: int | None = None):
+        self.store = store
+        self.max_workers = max_workers
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=_WorkerContext(),
+                initializer=_init_worker,
+                initargs=(self.store.to_der(),),
+            )
+        return self._executor
+
+    async def verify(self, records: list[AttestationRecord]) -> list[AttestationResult]:
+        """Verify records, in parallel when there are enough of them to pay off."""
+        if len(records) < PARALLEL_THRESHOLD:
+            return [verify_record(record, self.store) for record in records]
+
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        return list(await asyncio.gather(
+            *(loop.run_in_executor(executor, _verify_in_worker, record) for record in records)
+        ))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_verifiers: dict[str | None, AttestationVerifier] = {}
+
+
+def get_verifier(directory: str | None = None) -> AttestationVerifier:
+    """Return the shared verifier (and warm process pool) for a CA directory."""
+    verifier = _verifiers.get(directory)
+    if verifier is None:
+        verifier = _verifiers[directory] = AttestationVerifier(load_trust_store(directory))
+    return verifier
+
+
+def shutdown_verifiers() -> None:
+    """Stop the process pools of every shared verifier (server shutdown)."""
+    while _verifiers:
+        _, verifier = _verifiers.popitem()
+        verifier.shutdown()
+
+
+# ============================================================================
+# Collection
+# ============================================================================
+
+def _load_any_certificate(data: bytes) -> bytes:
+    """Return DER bytes for a PEM or DER encoded certificate."""
+    if b"-----BEGIN CERTIFICATE-----" in data:
+        return x509.load_pem_x509_certificate(data).public_bytes(serialization.Encoding.DER)
+    return x509.load_der_x509_certificate(data).public_bytes(serialization.Encoding.DER)
+
+
+def collect_device_attestations(
+    run_command: Callable[[list[str]], subprocess.CompletedProcess],
+    serial: int,
+    targets: list[tuple[Application, str]],
+    openpgp_pin: str | None = None
+) -> list[AttestationRecord]:
+    """Collect attestation certificates for the given slots of one YubiKey.
+
+    The device attestation CA for each application is read once and shared by
+    every slot of that application.
+
+    Args:
+        run_command: Function executing ykman with the given arguments (e.g. run_ykman_command)
+        serial: Serial number of the YubiKey
+        targets: (application, slot) pairs to attest, e.g. [("piv", "9a"), ("openpgp", "sig")]
+        openpgp_pin: User PIN, required by ykman to attest OpenPGP keys
+    """
+    device = ["--device", str(serial)]
+    device_cas: dict[Application, bytes | str] = {}
+    records = []
+
+    for application, slot in targets:
+        record = AttestationRecord(serial=serial, application=application, slot=slot)
+        records.append(record)
+
+        if application not in device_cas:
+            ca_args = device + [application, "certificates", "export", DEVICE_CA_SLOT[application], "-"]
+            try:
+                device_cas[application] = _load_any_certificate(
+                    run_command(ca_args).stdout.encode()
+                )
+            except subprocess.CalledProcessError as e:
+                device_cas[application] = f"Could not read device attestation CA: {(e.stderr or str(e)).strip()}"
+            except ValueError as e:
+                device_cas[application] = f"Malformed device attestation CA: {e}"
+
+        device_ca = device_cas[application]
+        if isinstance(device_ca, str):
+            record.error = device_ca
+            continue
+        record.device_ca_der = device_ca
+
+        attest_args = device + [application, "keys", "attest", slot, "-"]
+        if application == "openpgp" and openpgp_pin:
+            attest_args.extend(["--pin", openpgp_pin])
+        try:
+            record.leaf_der = _load_any_certificate(run_command(attest_args).stdout.encode())
+        except subprocess.CalledProcessError as e:
+            if application == "piv" and not _piv_key_present(run_command, device, slot):
+                record.present = False
+                continue
+            record.error = f"Attestation failed: {(e.stderr or str(e)).strip()}"
+        except ValueError as e:
+            record.error = f"Malformed attestation certificate: {e}"
+
+    return records
+
+
+def _piv_key_present(
+    run_command: Callable[[list[str]], subprocess.CompletedProcess],
+    device: list[str],
+    slot: str
+) -> bool:
+    """False only if ykman reports the PIV slot as empty (`piv keys attest` fails the same way for both)."""
+    try:
+        run_command(device + ["piv", "keys", "info", slot])
+    except subprocess.CalledProcessError as e:
+        return "No key stored" not in (e.stderr or "")
+    return True
+
+
+async def collect_fleet_attestations(
+    run_command: Callable[[list[str]], subprocess.CompletedProcess],
+    serials: list[int],
+    targets: list[tuple[Application, str]],
+    openpgp_pin: str | None = None,
+    admit: Callable[[int], Awaitable[AsyncContextManager[Any]]] | None = None,
+    max_parallel: int = 8
+) -> list[AttestationRecord]:
+    """Collect attestation material from many YubiKeys concurrently.
+
+    Each device is read sequentially (a YubiKey handles one session at a time)
+    but different devices are read in parallel threads, at most max_parallel
+    at once. If given, admit(serial) is entered around each device's reads
+    (e.g. AdmissionController.acquire).
+    """
+    semaphore = asyncio.Semaphore(max(1, max_parallel))
+
+    async def collect(serial: int) -> list[AttestationRecord]:
+        async with semaphore:
+            if admit is None:
+                return await asyncio.to_thread(collect_device_attestations, run_command, serial, targets, openpgp_pin)
+            async with await admit(serial):
+                return await asyncio.to_thread(collect_device_attestations, run_command, serial, targets, openpgp_pin)
+
+    per_device = await asyncio.gather(*(collect(serial) for serial in serials))
+    return [record for records in per_device for record in records]
+
+
+def build_report(results: list[AttestationResult]) -> dict[int, dict[str, Any]]:
+    """Group verification results into a per-serial report.
+
+    Empty slots are listed under "not_present" and do not affect "verified",
+    which is True if every key present verified, False if any failed, and
+    None if the device has no key in any of the requested slots.
+    """
+    report: dict[int, dict[str, Any]] = {}
+    for result in results:
+        entry = report.setdefault(result.serial, {"verified": None, "keys": [], "not_present": []})
+        if not result.present:
+            entry["not_present"].append(f"{result.application}:{result.slot}")
+            continue
+        entry["keys"].append(result.to_dict())
+        entry["verified"] = result.verified if entry["verified"] is None else entry["verified"] and result.verified
+    return report
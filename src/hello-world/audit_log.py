@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+YubiKey Audit Log - Hash-chained, append-only record of state-changing tool calls.
+
+Tool calls only enqueue an event (no I/O on the calling path). A background
+writer drains the queue in batches, appends each batch to the current segment
+file and fsyncs once per batch (group commit), so events that arrive while an
+fsync is in progress share the next one.
+
+Every record carries a sequence number, the hash of the previous record and
+its own hash, chained across segment files (audit-000001.jsonl,
+audit-000002.jsonl, ...). With a key (YUBIKEY_AUDIT_KEY) the hashes are
+HMAC-SHA256, so the chain cannot be recomputed after editing a record;
+without one they are plain SHA-256. After each batch the head of the chain
+(sequence number and hash, MACed when keyed) is written to audit-anchor.json,
+so records dropped from the end are detected too. Segments are rotated by
+size and never rewritten; verify() walks the chain and reports the first
+record that was altered, removed or reordered.
+
+Secret arguments (PINs, keys, passwords) are masked before they are queued.
+Events still in the queue when the process dies are lost; everything up to
+the last group commit is durable.
+
+Usage:
+    python audit_log.py verify DIRECTORY    # uses YUBIKEY_AUDIT_KEY if set
+    python audit_log.py bench [--events 10000]
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SEGMENT_BYTES = 10 * 1024 * 1024
+MAX_BATCH_EVENTS = 1000
+GENESIS_HASH = "0" * 64
+ANCHOR_FILE = "audit-anchor.json"
+SECRET_ARGUMENTS = {"pin", "admin_pin", "new_pin", "reset_code", "management_key", "password"}
+
+_STOP = object()
+
+
+def mask_arguments(arguments: dict[str, Any]) -> dict[str, Any]:
+    return {key: "****" if key in SECRET_ARGUMENTS and value is not None else value for key, value in arguments.items()}
+
+
+def _record_hash(record: dict[str, Any], key: bytes | None = None) -> str:
+    """SHA-256 (HMAC-SHA256 with a key) over the canonical JSON of a record without its own hash (it includes "prev")."""
+    body = json.dumps({k: v for k, v in record.items() if k != "hash"}, sort_keys=True, separators=(",", ":")).encode()
+    if key is not None:
+        return hmac.new(key, body, hashlib.sha256).hexdigest()
+    return hashlib.sha256(body).hexdigest()
+
+
+def _anchor_mac(seq: int, head: str, key: bytes) -> str:
+    return hmac.new(key, f"anchor:{seq}:{head}".encode(), hashlib.sha256).hexdigest()
+
+
+def _read_anchor(directory: Path) -> dict[str, Any] | None:
+    try:
+        return json.loads((directory / ANCHOR_FILE).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def _segments(directory: Path) -> list[Path]:
+    return sorted(directory.glob("audit-*.jsonl"))
+
+
+def _last_record(path: Path) -> tuple[dict[str, Any] | None, bool]:
+    """Last complete record of a segment, and whether the segment ends in a torn (partial) line."""
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 64 * 1024))
+        tail = f.read()
+    torn = bool(tail) and not tail.endswith(b"\n")
+    lines = tail.split(b"\n")
+    complete = lines[:-1]  # The last element is b"" (or a torn line)
+    for line in reversed(complete):
+        if line.strip():
+            return json.loads(line), torn
+    return None, torn
+
+
+# ============================================================================
+# Writer
+# ============================================================================
+
+class AuditLog:
+    """Queue-backed audit writer with group-commit fsync and size-based segment rotation.
+
+    record() is thread-safe and never blocks on I/O. The key, if any, must stay
+    the same for the lifetime of a directory.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES,
+        key: bytes | None = None
+    ):
+        self.directory = Path(directory)
+        self.max_segment_bytes = max_segment_bytes
+        self.key = key or None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        anchor = _read_anchor(self.directory)
+        if anchor is not None and anchor.get("keyed") != (self.key is not None):
+            logger.warning("Audit log in %s was written %s a key; verify() will report the change",
+                           self.directory, "with" if anchor.get("keyed") else "without")
+
+        self._seq = 0
+        self._prev = GENESIS_HASH
+        segments = _segments(self.directory)
+        self._segment_index = 1
+        if segments:
+            # Resume the chain from the last complete record; never append after a partial line
+            self._segment_index = int(segments[-1].stem.split("-")[1])
+            if _last_record(segments[-1])[1]:
+                self._segment_index += 1
+            for segment in reversed(segments):
+                last, _ = _last_record(segment)
+                if last is not None:
+                    self._seq, self._prev = last["seq"], last["hash"]
+                    break
+        self._file = self._open_segment()
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._done = threading.Condition()
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.write_errors = 0
+        self.fsync_ms_total = 0.0
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def _open_segment(self):
+        path = self.directory / f"audit-{self._segment_index:06d}.jsonl"
+        return path.open("ab")
+
+    def record(
+        self,
+        tool: str,
+        status: str,
+        arguments: dict[str, Any],
+        serial_number: int | None = None,
+        message: str | None = None,
+        duration_ms: float | None = None
+    ) -> None:
+        """Enqueue an event; secret arguments are masked here."""
+        with self._done:
+            self.enqueued += 1
+        self._queue.put({
+            "at": time.time(),
+            "tool": tool,
+            "serial_number": serial_number,
+            "status": status,
+            "arguments": mask_arguments(arguments),
+            "message": message,
+            "duration_ms": round(duration_ms, 1) if duration_ms is not None else None,
+        })
+
+    def _run(self) -> None:
+        # The writer owns the segment file and closes it when it exits, even if close() stopped waiting
+        try:
+            self._drain()
+        finally:
+            self._file.close()
+
+    def _drain(self) -> None:
+        retry: list[dict[str, Any]] = []
+        while True:
+            batch = retry or [self._queue.get()]
+            retry = []
+            while len(batch) < MAX_BATCH_EVENTS:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(event is _STOP for event in batch)
+            events = [event for event in batch if event is not _STOP]
+            if events:
+                try:
+                    self._write_batch(events)
+                except OSError as e:
+                    # Keep the events (e.g. disk full) and retry; the chain only advances on success
+                    self.write_errors += 1
+                    logger.warning("Audit log write failed, retrying: %s", e)
+                    retry = events
+                    if not stop:
+                        time.sleep(1.0)
+                        continue
+            if stop:
+                return
+
+    def _write_batch(self, events: list[dict[str, Any]]) -> None:
+        seq, prev = self._seq, self._prev
+        lines = []
+        for event in events:
+            seq += 1
+            record = {"seq": seq, **event, "prev": prev}
+            record["hash"] = prev = _record_hash(record, self.key)
+            lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+        data = "".join(lines).encode()
+
+        if self._file.tell() > 0 and self._file.tell() + len(data) > self.max_segment_bytes:
+            self._file.close()
+            self._segment_index += 1
+            self._file = self._open_segment()
+
+        offset = self._file.tell()
+        try:
+            self._file.write(data)
+            self._file.flush()
+            started = time.perf_counter()
+            os.fsync(self._file.fileno())
+        except OSError:
+            # Drop whatever part of the batch reached the file; the retry rewrites it with the same sequence numbers
+            try:
+                self._file.truncate(offset)
+            except OSError:
+                self._file.close()
+                self._segment_index += 1
+                self._file = self._open_segment()
+            raise
+        self.fsync_ms_total += (time.perf_counter() - started) * 1000
+
+        self._seq, self._prev = seq, prev
+        self._write_anchor()
+        with self._done:
+            self.written += len(events)
+            self.batches += 1
+            self.max_batch = max(self.max_batch, len(events))
+            self._done.notify_all()
+
+    def _write_anchor(self) -> None:
+        """Record the head of the chain, after the records it names are durable."""
+        anchor: dict[str, Any] = {"seq": self._seq, "hash": self._prev, "keyed": self.key is not None}
+        if self.key is not None:
+            anchor["mac"] = _anchor_mac(self._seq, self._prev, self.key)
+        path = self.directory / ANCHOR_FILE
+        temporary = path.with_suffix(".tmp")
+        try:
+            with temporary.open("w") as f:
+                f.write(json.dumps(anchor))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+        except OSError as e:
+            # The records are already durable; a lagging anchor only narrows truncation detection
+            self.write_errors += 1
+            logger.warning("Could not update the audit log anchor: %s", e)
+
+    def flush(self, timeout: float | None = 5.0) -> bool:
+        """Wait until every event enqueued so far is durable; returns False on timeout."""
+        with self._done:
+            target = self.enqueued
+            return self._done.wait_for(lambda: self.written >= target, timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write out queued events and stop the writer, which closes the segment file on exit."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Audit log writer still busy after %.1fs; it will close the log when done", timeout)
+
+    def status(self) -> dict[str, object]:
+        with self._done:
+            return {
+                "directory": str(self.directory),
+                "segment": self._file.name,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "pending": self.enqueued - self.written,
+                "batches": self.batches,
+                "max_batch": self.max_batch,
+                "avg_batch": round(self.written / self.batches, 1) if self.batches else 0.0,
+                "avg_fsync_ms": round(self.fsync_ms_total / self.batches, 2) if self.batches else 0.0,
+                "write_errors": self.write_errors,
+            }
+
+
+# ============================================================================
+# Verification
+# ============================================================================
+
+def verify(directory: str | Path, key: bytes | None = None) -> dict[str, Any]:
+    """Check every record's hash, the chain linking them, sequence continuity and the anchor.
+
+    A partial last line in a segment (a crash mid-write, before its fsync) is
+    counted as torn rather than as tampering, as long as the chain continues
+    from the last complete record. The anchor may lag behind the log after a
+    crash, but the record it names must exist and match.
+
+    Returns:
+        {"valid", "records", "segments", "torn_records", "last_seq", "last_hash", "anchored_seq", "error"}
+    """
+    directory = Path(directory)
+    key = key or None
+    segments = _segments(directory)
+    expected_seq, prev = 1, GENESIS_HASH
+    records = torn = 0
+    error = None
+    anchored_hash = None
+
+    try:
+        anchor = _read_anchor(directory)
+    except ValueError:
+        anchor = None
+        error = {"segment": ANCHOR_FILE, "line": 1, "reason": "Unparseable anchor"}
+    if anchor is not None:
+        if anchor.get("keyed") and key is None:
+            error = {"segment": ANCHOR_FILE, "line": 1, "reason": "The log is keyed; verifying it needs the audit key"}
+        elif key is not None and not hmac.compare_digest(
+            str(anchor.get("mac", "")), _anchor_mac(anchor.get("seq", 0), anchor.get("hash", ""), key)
+        ):
+            error = {"segment": ANCHOR_FILE, "line": 1, "reason": "Anchor MAC mismatch (anchor modified or wrong key)"}
+
+    for segment in segments if error is None else []:
+        with segment.open("rb") as f:
+            data = f.read()
+        lines = data.split(b"\n")
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            is_tail = number == len(lines)  # No trailing newline: written partially
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if is_tail:
+                    torn += 1
+                    continue
+                error = {"segment": segment.name, "line": number, "reason": "Unparseable record"}
+                break
+            if record.get("seq") != expected_seq:
+                error = {"segment": segment.name, "line": number,
+                         "reason": f"Expected sequence {expected_seq}, found {record.get('seq')} (records removed or reordered)"}
+                break
+            if record.get("prev") != prev:
+                error = {"segment": segment.name, "line": number, "reason": "Previous-hash link broken"}
+                break
+            if not hmac.compare_digest(str(record.get("hash", "")), _record_hash(record, key)):
+                error = {"segment": segment.name, "line": number, "reason": "Record hash mismatch (record modified)"}
+                break
+            if anchor is not None and record["seq"] == anchor.get("seq"):
+                anchored_hash = record["hash"]
+            expected_seq, prev = expected_seq + 1, record["hash"]
+            records += 1
+        if error:
+            break
+
+    if error is None:
+        if anchor is None and records:
+            error = {"segment": ANCHOR_FILE, "line": 1, "reason": "Anchor missing (log truncated or anchor deleted)"}
+        elif anchor is not None and anchor.get("seq", 0) > records:
+            error = {"segment": ANCHOR_FILE, "line": 1,
+                     "reason": f"Log ends at sequence {records} but the anchor records {anchor.get('seq')} (records removed)"}
+        elif anchor is not None and anchor.get("seq", 0) > 0 and anchored_hash != anchor.get("hash"):
+            error = {"segment": ANCHOR_FILE, "line": 1,
+                     "reason": f"Record {anchor.get('seq')} does not match the anchored hash (log rewritten)"}
+
+    return {
+        "valid": error is None,
+        "records": records,
+        "segments": len(segments),
+        "torn_records": torn,
+        "last_seq": expected_seq - 1,
+        "last_hash": prev,
+        "anchored_seq": anchor.get("seq") if anchor else None,
+        "error": error,
+    }
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def bench(events: int, max_segment_bytes: int) -> dict[str, Any]:
+    """Measure the calling-path cost of record() and the writer's group-commit throughput."""
+    with tempfile.TemporaryDirectory() as directory:
+        log = AuditLog(directory, max_segment_bytes=max_segment_bytes)
+        arguments = {"key_slot": "sig", "policy": "on", "admin_pin": "12345678", "serial_number": 16021303}
+        costs = []
+        started = time.perf_counter()
+        for _ in range(events):
+            call = time.perf_counter()
+            log.record("set_openpgp_touch_policy", "success", arguments, 16021303, "Touch policy set", 120.0)
+            costs.append(time.perf_counter() - call)
+        enqueue_s = time.perf_counter() - started
+        log.flush(timeout=None)
+        durable_s = time.perf_counter() - started
+        status = log.status()
+        log.close()
+        result = verify(directory)
+
+    costs.sort()
+    return {
+        "events": events,
+        "record_us_p50": round(costs[len(costs) // 2] * 1e6, 2),
+        "record_us_p99": round(costs[min(len(costs) - 1, int(len(costs) * 0.99))] * 1e6, 2),
+        "enqueue_events_per_s": round(events / enqueue_s),
+        "durable_events_per_s": round(events / durable_s),
+        "batches": status["batches"],
+        "avg_batch": status["avg_batch"],
+        "avg_fsync_ms": status["avg_fsync_ms"],
+        "segments": result["segments"],
+        "verified": result["valid"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify or benchmark the YubiKey MCP audit log")
+    subcommands = parser.add_subparsers(dest="action", required=True)
+    verify_parser = subcommands.add_parser("verify", help="Check the hash chain of an audit directory")
+    verify_parser.add_argument("directory")
+    bench_parser = subcommands.add_parser("bench", help="Measure logging overhead in a temporary directory")
+    bench_parser.add_argument("--events", type=int, default=10000)
+    bench_parser.add_argument("--max-segment-bytes", type=int, default=DEFAULT_MAX_SEGMENT_BYTES)
+    args = parser.parse_args()
+
+    if args.action == "verify":
+        key = os.environ.get("YUBIKEY_AUDIT_KEY")
+        result = verify(args.directory, key.encode() if key else None)
+        print(json.dumps(result, indent=2))
+        raise SystemExit(0 if result["valid"] else 1)
+    print(json.dumps(bench(args.events, args.max_segment_bytes), indent=2))
+
+
+if __name__ == "__main__":
+    main()
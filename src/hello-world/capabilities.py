@@ -0,0 +1,302 @@
+"""
+YubiKey Capabilities - Precomputed feature matrix and request prechecks.
+
+Derives what a device can do from its cached `ykman info` output (model,
+firmware version, form factor and the applications table) so tools can
+reject unsupported requests before spawning ykman, with the same reason
+ykman/yubikit would eventually report.
+
+Firmware gates mirror the checks in yubikit (require_version calls).
+"""
+
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Annotated, Any, Literal
+
+from pydantic import BeforeValidator
+
+Transport = Literal["usb", "nfc"]
+ApplicationName = Literal["OTP", "U2F", "FIDO2", "OATH", "PIV", "OPENPGP", "HSMAUTH"]
+TouchSlot = Literal["sig", "enc", "aut", "att"]
+TouchPolicy = Literal["on", "off", "fixed", "cached", "cached-fixed"]
+
+TRANSPORTS: tuple[Transport, ...] = ("usb", "nfc")
+APPLICATIONS: tuple[ApplicationName, ...] = ("OTP", "U2F", "FIDO2", "OATH", "PIV", "OPENPGP", "HSMAUTH")
+TOUCH_SLOTS: tuple[TouchSlot, ...] = ("sig", "enc", "aut", "att")
+TOUCH_POLICIES: tuple[TouchPolicy, ...] = ("on", "off", "fixed", "cached", "cached-fixed")
+
+
+def _lower(value: Any) -> Any:
+    return value.lower() if isinstance(value, str) else value
+
+
+def _upper(value: Any) -> Any:
+    return value.upper() if isinstance(value, str) else value
+
+
+# Tool and manifest argument types: the options stay in the schema, any case is accepted
+TransportInput = Annotated[Transport, BeforeValidator(_lower)]
+ApplicationInput = Annotated[ApplicationName, BeforeValidator(_upper)]
+TouchSlotInput = Annotated[TouchSlot, BeforeValidator(_lower)]
+TouchPolicyInput = Annotated[TouchPolicy, BeforeValidator(_lower)]
+
+# Names used in the `ykman info` applications table
+APPLICATION_DISPLAY_NAMES: dict[ApplicationName, str] = {
+    "OTP": "Yubico OTP",
+    "U2F": "FIDO U2F",
+    "FIDO2": "FIDO2",
+    "OATH": "OATH",
+    "PIV": "PIV",
+    "OPENPGP": "OpenPGP",
+    "HSMAUTH": "YubiHSM Auth",
+}
+_APPLICATIONS_BY_DISPLAY_NAME = {display: name for name, display in APPLICATION_DISPLAY_NAMES.items()}
+
+Version = tuple[int, int, int]
+
+# Minimum firmware per feature: (version, reason shown when the device is older)
+FIRMWARE_REQUIREMENTS: dict[str, tuple[Version, str]] = {
+    "config": ((5, 0, 0), "Enabling/disabling applications per transport requires YubiKey 5.0.0 or later"),
+    "openpgp_touch": ((4, 2, 0), "OpenPGP touch policies require YubiKey 4.2.0 or later"),
+    "openpgp_touch_cached": ((5, 2, 1), "Cached touch policies require YubiKey 5.2.1 or later"),
+    "openpgp_attestation": ((5, 2, 1), "The OpenPGP attestation key (att) requires YubiKey 5.2.1 or later"),
+    "openpgp_pin_retries": ((4, 3, 1), "Setting OpenPGP PIN retries requires YubiKey 4.3.1 or later"),
+    "app_FIDO2": ((5, 0, 0), "FIDO2 requires YubiKey 5.0.0 or later"),
+    "app_HSMAUTH": ((5, 4, 3), "YubiHSM Auth requires YubiKey 5.4.3 or later"),
+}
+
+# Applications table rows are "name<pad>\tstatus<pad>\tstatus"; older output is space-aligned
+_COLUMN_SEPARATOR = re.compile(r"\t+|\s{2,}")
+
+
+def parse_version(text: str) -> Version | None:
+    """Parse "5.4.3" (or "5.7.1 (pre-release)") into a tuple, None if not a version."""
+    match = re.match(r"\s*(\d+)\.(\d+)\.(\d+)", text)
+    return tuple(int(part) for part in match.groups()) if match else None
+
+
+def parse_application_table(info_text: str) -> dict[str, dict[str, str]]:
+    """Parse the applications table from `ykman info` output.
+
+    Handles both the USB+NFC table and the single-column table printed for
+    USB-only devices, and multi-word statuses such as "Not available".
+
+    Returns:
+        {"usb": {app_name: status}, "nfc": {app_name: status}}
+    """
+    applications: dict[str, dict[str, str]] = {"usb": {}, "nfc": {}}
+    columns: list[str] | None = None
+
+    for line in info_text.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith("Applications"):
+            columns = [c.lower() for c in _COLUMN_SEPARATOR.split(stripped)[1:]] or ["usb"]
+            continue
+        if not stripped:
+            columns = None
+            continue
+        if columns is None:
+            continue
+
+        cells = _COLUMN_SEPARATOR.split(stripped)
+        if len(cells) != len(columns) + 1:
+            continue
+        for transport, status in zip(columns, cells[1:]):
+            if transport in applications:
+                applications[transport][cells[0]] = status
+
+    return applications
+
+
+# ============================================================================
+# Device Profiles
+# ============================================================================
+
+@dataclass(frozen=True)
+class DeviceProfile:
+    """Identity fields from `ykman info` that determine capabilities.
+
+    Attributes:
+        model: Device type, e.g. "YubiKey 5 NFC"
+        firmware: Firmware version, or None if ykman could not determine it
+        form_factor: e.g. "Keychain (USB-A)"
+        nfc: Whether the device has an NFC interface
+        available: Applications present on the device per transport (hardware, not enablement)
+    """
+    model: str
+    firmware: Version | None
+    form_factor: str
+    nfc: bool
+    available: tuple[tuple[Transport, frozenset[ApplicationName]], ...]
+
+
+def parse_device_profile(info_text: str) -> DeviceProfile:
+    fields = {}
+    for line in info_text.split('\n'):
+        key, separator, value = line.partition(":")
+        if separator:
+            fields.setdefault(key.strip(), value.strip())
+
+    table = parse_application_table(info_text)
+    nfc = "NFC transport is" in info_text or bool(table["nfc"])
+
+    available = []
+    for transport in TRANSPORTS:
+        if transport == "nfc" and not nfc:
+            available.append((transport, frozenset()))
+            continue
+        rows = table[transport] or (table["usb"] if transport == "nfc" else {})
+        available.append((transport, frozenset(
+            _APPLICATIONS_BY_DISPLAY_NAME[name]
+            for name, status in rows.items()
+            if name in _APPLICATIONS_BY_DISPLAY_NAME and status != "Not available"
+        )))
+
+    return DeviceProfile(
+        model=fields.get("Device type", "Unknown"),
+        firmware=parse_version(fields.get("Firmware version", "")),
+        form_factor=fields.get("Form factor", "Unknown"),
+        nfc=nfc,
+        available=tuple(available),
+    )
+
+
+# ============================================================================
+# Capability Matrix
+# ============================================================================
+
+@dataclass(frozen=True)
+class Capabilities:
+    """What a device supports, with the reason for everything it does not.
+
+    Attributes:
+        profile: The device profile this was computed from
+        applications: Configurable applications per transport
+        touch_slots: OpenPGP key slots whose touch policy can be set
+        touch_policies: OpenPGP touch policies the firmware accepts
+        unsupported: Feature -> reason, for features the device lacks
+    """
+    profile: DeviceProfile
+    applications: dict[Transport, tuple[ApplicationName, ...]]
+    touch_slots: tuple[TouchSlot, ...]
+    touch_policies: tuple[TouchPolicy, ...]
+    unsupported: dict[str, str]
+
+    def to_dict(self) -> dict[str, object]:
+        profile = self.profile
+        return {
+            "model": profile.model,
+            "firmware": ".".join(map(str, profile.firmware)) if profile.firmware else None,
+            "form_factor": profile.form_factor,
+            "nfc": profile.nfc,
+            "applications": {t: list(apps) for t, apps in self.applications.items()},
+            "openpgp_touch_slots": list(self.touch_slots),
+            "openpgp_touch_policies": list(self.touch_policies),
+            "unsupported": dict(self.unsupported),
+        }
+
+
+def _meets(firmware: Version | None, feature: str, unsupported: dict[str, str]) -> bool:
+    """Firmware gate; an unknown firmware version passes and is left to ykman."""
+    minimum, reason = FIRMWARE_REQUIREMENTS[feature]
+    if firmware is None or firmware >= minimum:
+        return True
+    unsupported[feature] = f"{reason} (device has {'.'.join(map(str, firmware))})"
+    return False
+
+
+@lru_cache(maxsize=256)
+def capabilities_for(profile: DeviceProfile) -> Capabilities:
+    """Compute (once per model/firmware/form factor/app set) what a device supports."""
+    unsupported: dict[str, str] = {}
+    firmware = profile.firmware
+
+    applications: dict[Transport, tuple[ApplicationName, ...]] = {}
+    config_ok = _meets(firmware, "config", unsupported)
+    for transport, available in profile.available:
+        if not config_ok:
+            applications[transport] = ()
+            continue
+        if transport == "nfc" and not profile.nfc:
+            unsupported["nfc"] = f"{profile.model} ({profile.form_factor}) has no NFC interface"
+            applications[transport] = ()
+            continue
+        applications[transport] = tuple(
+            app for app in APPLICATIONS
+            if (app in available or not available)  # No table: only firmware gates apply
+            and (f"app_{app}" not in FIRMWARE_REQUIREMENTS or _meets(firmware, f"app_{app}", unsupported))
+        )
+
+    touch_slots: tuple[TouchSlot, ...] = ()
+    touch_policies: tuple[TouchPolicy, ...] = ()
+    usb_apps = dict(profile.available).get("usb", frozenset())
+    if usb_apps and "OPENPGP" not in usb_apps and "OPENPGP" not in dict(profile.available).get("nfc", frozenset()):
+        unsupported["openpgp"] = f"{profile.model} does not have the OpenPGP application"
+    elif _meets(firmware, "openpgp_touch", unsupported):
+        touch_slots = ("sig", "enc", "aut")
+        touch_policies = ("on", "off", "fixed")
+        if _meets(firmware, "openpgp_attestation", unsupported):
+            touch_slots += ("att",)
+        if _meets(firmware, "openpgp_touch_cached", unsupported):
+            touch_policies += ("cached", "cached-fixed")
+    if "openpgp" not in unsupported:
+        _meets(firmware, "openpgp_pin_retries", unsupported)
+
+    return Capabilities(profile, applications, touch_slots, touch_policies, unsupported)
+
+
+@lru_cache(maxsize=256)
+def capabilities_from_info(info_text: str) -> Capabilities:
+    """Capabilities for cached `ykman info` output (memoized on the text itself)."""
+    return capabilities_for(parse_device_profile(info_text))
+
+
+# ============================================================================
+# Prechecks
+# ============================================================================
+
+def check_configure(
+    capabilities: Capabilities,
+    transport: str,
+    applications: list[str]
+) -> str | None:
+    """Return why `ykman config <transport>` would fail for these applications, or None."""
+    transport = transport.lower()
+    if transport == "nfc" and "nfc" in capabilities.unsupported:
+        return capabilities.unsupported["nfc"]
+    if "config" in capabilities.unsupported:
+        return capabilities.unsupported["config"]
+
+    valid = capabilities.applications.get(transport, ())
+    for app in applications:
+        app = app.upper()
+        if app in valid:
+            continue
+        reason = capabilities.unsupported.get(f"app_{app}")
+        if reason is None:
+            reason = f"{app} is not available over {transport.upper()} on {capabilities.profile.model}"
+        return f"{reason}. Valid applications: {', '.join(valid) or 'none'}"
+    return None
+
+
+def check_touch_policy(capabilities: Capabilities, key_slot: str, policy: str) -> str | None:
+    """Return why setting this OpenPGP touch policy would fail, or None."""
+    for feature in ("openpgp", "openpgp_touch"):
+        if feature in capabilities.unsupported:
+            return capabilities.unsupported[feature]
+    if key_slot.lower() not in capabilities.touch_slots:
+        return (f"{capabilities.unsupported.get('openpgp_attestation', f'Slot {key_slot} is not supported')}. "
+                f"Valid slots: {', '.join(capabilities.touch_slots)}")
+    if policy.lower() not in capabilities.touch_policies:
+        return (f"{capabilities.unsupported.get('openpgp_touch_cached', f'Policy {policy} is not supported')}. "
+                f"Valid policies: {', '.join(capabilities.touch_policies)}")
+    return None
+
+
+def check_pin_retries(capabilities: Capabilities) -> str | None:
+    """Return why setting OpenPGP PIN retries would fail, or None."""
+    for feature in ("openpgp", "openpgp_pin_retries"):
+        if feature in capabilities.unsupported:
+            return capabilities.unsupported[feature]
+    return None
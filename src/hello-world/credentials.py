@@ -0,0 +1,158 @@
+"""
+YubiKey Credentials - Session-scoped in-memory PIN cache.
+
+Caches PINs obtained through elicitation so multi-step and batch workflows
+don't have to prompt the user (or pass PINs through the agent's context) for
+every call. Entries are keyed by serial number and PIN type, expire after a
+TTL or a number of uses, and are zeroized when evicted. Expired entries are
+purged on every lookup, so secrets don't outlive their TTL in memory just
+because nothing asked for them again.
+
+Note: values are held in bytearrays that are overwritten on eviction, but the
+short-lived str copies handed to ykman/GPG cannot be wiped by Python.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Literal
+
+PinType = Literal["openpgp_pin", "openpgp_admin_pin", "piv_pin", "piv_management_key", "fido2_pin"]
+
+PIN_TYPE_LABELS: dict[PinType, str] = {
+    "openpgp_pin": "OpenPGP User PIN",
+    "openpgp_admin_pin": "OpenPGP Admin PIN",
+    "piv_pin": "PIV PIN",
+    "piv_management_key": "PIV management key",
+    "fido2_pin": "FIDO2 PIN",
+}
+
+DEFAULT_TTL = float(os.environ.get("YUBIKEY_PIN_CACHE_TTL", "300"))  # seconds; 0 disables caching
+DEFAULT_MAX_USES = int(os.environ.get("YUBIKEY_PIN_CACHE_MAX_USES", "50"))
+
+# Serial key for a credential that applies to every device (e.g. factory PINs in a batch)
+ANY_DEVICE = 0
+
+
+@dataclass
+class _CachedCredential:
+    secret: bytearray
+    expires_at: float
+    uses_left: int
+    rejected_by: set[int] = field(default_factory=set)  # Devices that refused a shared (ANY_DEVICE) PIN
+
+    def zeroize(self) -> None:
+        for i in range(len(self.secret)):
+            self.secret[i] = 0
+        self.uses_left = 0
+
+
+class CredentialCache:
+    """Thread-safe PIN cache keyed by (serial, pin_type).
+
+    A device-specific entry takes precedence over an ANY_DEVICE entry. A
+    device that rejects the shared entry stops using it without taking it
+    away from the other devices.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_uses: int = DEFAULT_MAX_USES):
+        self.ttl = ttl
+        self.max_uses = max_uses
+        self._entries: dict[tuple[int, PinType], _CachedCredential] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_uses > 0
+
+    def put(
+        self,
+        serial: int | None,
+        pin_type: PinType,
+        value: str,
+        ttl: float | None = None,
+        max_uses: int | None = None
+    ) -> None:
+        """Cache a credential; serial None stores it for every device."""
+        if not self.enabled:
+            return
+        key = (ANY_DEVICE if serial is None else serial, pin_type)
+        entry = _CachedCredential(
+            secret=bytearray(value.encode()),
+            expires_at=time.monotonic() + (self.ttl if ttl is None else ttl),
+            uses_left=self.max_uses if max_uses is None else max_uses,
+        )
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                previous.zeroize()
+            self._entries[key] = entry
+
+    def get(self, serial: int | None, pin_type: PinType) -> str | None:
+        """Return a cached credential and consume one use, or None if absent/expired."""
+        keys = [(serial, pin_type), (ANY_DEVICE, pin_type)] if serial is not None else [(ANY_DEVICE, pin_type)]
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or serial in entry.rejected_by:
+                    continue
+                entry.uses_left -= 1
+                value = entry.secret.decode()
+                if entry.uses_left == 0:
+                    self._entries.pop(key).zeroize()
+                return value
+        return None
+
+    def discard(self, serial: int | None, pin_type: PinType) -> None:
+        """Stop offering the credential get() would return for a device, e.g. after the device rejected it.
+
+        A device-specific entry is dropped. A shared entry is only dropped when
+        serial is None; otherwise it stays available to other devices.
+        """
+        with self._lock:
+            if serial is not None:
+                entry = self._entries.pop((serial, pin_type), None)
+                if entry is not None:
+                    entry.zeroize()
+                    return
+                shared = self._entries.get((ANY_DEVICE, pin_type))
+                if shared is not None:
+                    shared.rejected_by.add(serial)
+                return
+            entry = self._entries.pop((ANY_DEVICE, pin_type), None)
+            if entry is not None:
+                entry.zeroize()
+
+    def purge(self, serial: int | None = None) -> int:
+        """Zeroize and remove all credentials for a device (or every credential if serial is None).
+
+        Returns:
+            Number of credentials removed
+        """
+        with self._lock:
+            keys = [key for key in self._entries if serial is None or key[0] == serial]
+            for key in keys:
+                self._entries.pop(key).zeroize()
+        return len(keys)
+
+    def _purge_expired(self, now: float) -> None:
+        # Caller holds the lock
+        for key in [key for key, entry in self._entries.items() if entry.expires_at <= now or entry.uses_left <= 0]:
+            self._entries.pop(key).zeroize()
+
+    def summary(self) -> list[dict[str, object]]:
+        """Describe cached entries without revealing secrets."""
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            return [
+                {
+                    "serial_number": None if serial == ANY_DEVICE else serial,
+                    "pin_type": pin_type,
+                    "expires_in_seconds": max(0, round(entry.expires_at - now)),
+                    "uses_left": entry.uses_left,
+                }
+                for (serial, pin_type), entry in self._entries.items()
+            ]
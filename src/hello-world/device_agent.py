@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+YubiKey Device Agent - Exposes one host's YubiKeys over a compact RPC.
+
+Run one agent per provisioning host; an MCP server started with
+YUBIKEY_AGENTS=host:port,... aggregates them (see aggregator.py).
+
+Protocol: newline-delimited JSON over TCP, wrapped in TLS when the agent is
+given a certificate (required on non-loopback addresses, since requests carry
+the token and PINs). The first request on a connection must be
+{"method": "hello", "params": {"token": ...}}.
+Requests: {"id": N, "method": "hello" | "list" | "run" | "ping", "params": {...}}
+Responses: {"id": N, "result": ...} or {"id": N, "error": "..."}
+"""
+
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import ssl
+import subprocess
+from typing import Any, Callable
+
+import ykman_workers
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 7391
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+PROTOCOL_VERSION = 1
+
+
+def encode_message(message: dict[str, Any]) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def is_loopback(host: str | None, port: int = DEFAULT_PORT) -> bool:
+    """True if every address host resolves to is a loopback address ("" / None means all interfaces)."""
+    if not host:
+        return False
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+    except socket.gaierror:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses)
+
+
+def server_ssl_context(cert_file: str, key_file: str | None = None, client_ca_file: str | None = None) -> ssl.SSLContext:
+    """TLS context for an agent; with client_ca_file, aggregators must present a certificate signed by it."""
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_file, key_file)
+    if client_ca_file:
+        context.load_verify_locations(client_ca_file)
+        context.verify_mode = ssl.CERT_REQUIRED
+    return context
+
+
+# ============================================================================
+# Backends
+# ============================================================================
+
+def run_local_ykman(args: list[str]) -> subprocess.CompletedProcess:
+    """Execute ykman on this host (warm worker pool if enabled, else a subprocess)."""
+    pool = ykman_workers.get_pool()
+    if pool is not None:
+        return pool.run(args)
+    return subprocess.run(["ykman"] + args, capture_output=True, text=True, check=True)
+
+
+class SimulatedYkman:
+    """Minimal stand-in for ykman backed by simulated devices.
+
+    Answers list, info, openpgp info and accepts config / openpgp write
+    commands, so several agents can be run on localhost without hardware.
+    """
+
+    def __init__(self, serials: list[int], model: str = "YubiKey 5 NFC", firmware: str = "5.4.3"):
+        self.model = model
+        self.firmware = firmware
+        self.devices = {
+            serial: {"usb": {"Yubico OTP": "Enabled", "FIDO U2F": "Enabled", "FIDO2": "Enabled",
+                             "OATH": "Enabled", "PIV": "Enabled", "OpenPGP": "Enabled", "YubiHSM Auth": "Enabled"},
+                     "nfc": {"Yubico OTP": "Enabled", "FIDO U2F": "Enabled", "FIDO2": "Enabled",
+                             "OATH": "Enabled", "PIV": "Enabled", "OpenPGP": "Enabled", "YubiHSM Auth": "Enabled"},
+                     "touch": {"sig": "Off", "enc": "Off", "aut": "Off", "att": "Off"},
+                     "retries": (3, 0, 3)}
+            for serial in serials
+        }
+
+    def _fail(self, args: list[str], message: str) -> subprocess.CalledProcessError:
+        return subprocess.CalledProcessError(1, ["ykman"] + args, output="", stderr=f"Error: {message}\n")
+
+    def __call__(self, args: list[str]) -> subprocess.CompletedProcess:
+        full_args, args = list(args), list(args)
+        serial = None
+        if args[:1] == ["--device"]:
+            serial = int(args[1])
+            args = args[2:]
+
+        def done(stdout: str = "") -> subprocess.CompletedProcess:
+            return subprocess.CompletedProcess(["ykman"] + full_args, 0, stdout, "")
+
+        if args == ["list"]:
+            return done("".join(
+                f"{self.model} ({self.firmware}) [OTP+FIDO+CCID] Serial: {s}\n" for s in self.devices
+            ))
+        if args == ["list", "--serials"]:
+            return done("".join(f"{s}\n" for s in self.devices))
+
+        if serial is None:
+            if len(self.devices) != 1:
+                raise self._fail(full_args, "Multiple YubiKeys detected. Use --device SERIAL to specify which one to use.")
+            serial = next(iter(self.devices))
+        device = self.devices.get(serial)
+        if device is None:
+            raise self._fail(full_args, f"Failed connecting to a YubiKey with serial: {serial}.")
+
+        if args == ["info"]:
+            rows = "".join(
+                f"{app:<16}\t{device['usb'][app]:<16}\t{device['nfc'][app]}\n" for app in device["usb"]
+            )
+            return done(
+                f"Device type: {self.model}\nSerial number: {serial}\nFirmware version: {self.firmware}\n"
+                f"Form factor: Keychain (USB-A)\nEnabled USB interfaces: OTP, FIDO, CCID\nNFC transport is enabled\n\n"
+                f"Applications\tUSB\tNFC\n{rows}"
+            )
+        if args[:2] == ["openpgp", "info"]:
+            pin, reset, admin = device["retries"]
+            touch = "".join(f"  {slot.upper()} key touch policy: {policy}\n" for slot, policy in device["touch"].items())
+            return done(f"OpenPGP version: 3.4\nApplication version: {self.firmware}\n"
+                        f"PIN tries remaining: {pin}\nReset code tries remaining: {reset}\n"
+                        f"Admin PIN tries remaining: {admin}\n{touch}")
+        if args[:1] == ["config"] and len(args) >= 2:
+            transport = args[1]
+            names = {"OTP": "Yubico OTP", "U2F": "FIDO U2F", "FIDO2": "FIDO2", "OATH": "OATH",
+                     "PIV": "PIV", "OPENPGP": "OpenPGP", "HSMAUTH": "YubiHSM Auth"}
+            for flag, app in zip(args, args[1:]):
+                if flag in ("--enable", "--disable") and app in names:
+                    device[transport][names[app]] = "Enabled" if flag == "--enable" else "Disabled"
+            return done()
+        if args[:3] == ["openpgp", "keys", "set-touch"]:
+            device["touch"][args[3]] = args[4].capitalize()
+            return done()
+        if args[:3] == ["openpgp", "access", "set-retries"]:
+            device["retries"] = (int(args[3]), int(args[4]), int(args[5]))
+            return done()
+
+        raise self._fail(full_args, f"Command not supported by simulated device: {' '.join(args)}")
+
+
+# ============================================================================
+# Agent Server
+# ============================================================================
+
+class DeviceAgent:
+    """Serves a local ykman backend to aggregating MCP servers."""
+
+    def __init__(
+        self,
+        run_command: Callable[[list[str]], subprocess.CompletedProcess] = run_local_ykman,
+        token: str | None = None,
+        name: str | None = None
+    ):
+        self.run_command = run_command
+        self.token = token or None  # An empty token would accept an empty hello
+        self.name = name or socket.gethostname()
+
+    async def _dispatch(self, method: str, params: dict[str, Any]) -> Any:
+        if method == "ping":
+            return "pong"
+        if method == "list":
+            result = await asyncio.to_thread(self.run_command, ["list"])
+            return [line for line in result.stdout.strip().split('\n') if line]
+        if method == "run":
+            try:
+                result = await asyncio.to_thread(self.run_command, list(params["args"]))
+                return {"returncode": 0, "stdout": result.stdout, "stderr": result.stderr or ""}
+            except subprocess.CalledProcessError as e:
+                return {"returncode": e.returncode, "stdout": e.output or "", "stderr": e.stderr or ""}
+        raise ValueError(f"Unknown method: {method}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        authenticated = False
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                request_id = request.get("id")
+                method = request.get("method")
+                params = request.get("params") or {}
+
+                if method == "hello":
+                    # Compare bytes: compare_digest rejects non-ASCII str with a TypeError
+                    authenticated = self.token is None or hmac.compare_digest(
+                        str(params.get("token", "")).encode(), self.token.encode()
+                    )
+                    response = (
+                        {"id": request_id, "result": {"name": self.name, "protocol": PROTOCOL_VERSION}}
+                        if authenticated else {"id": request_id, "error": "Authentication failed"}
+                    )
+                elif not authenticated:
+                    response = {"id": request_id, "error": "Not authenticated; send hello first"}
+                else:
+                    try:
+                        response = {"id": request_id, "result": await self._dispatch(method, params)}
+                    except (ValueError, KeyError, FileNotFoundError) as e:
+                        response = {"id": request_id, "error": str(e)}
+
+                writer.write(encode_message(response))
+                await writer.drain()
+                if not authenticated:
+                    break
+        except (ConnectionError, json.JSONDecodeError, asyncio.LimitOverrunError) as e:
+            logger.debug("Agent connection closed: %s", e)
+        finally:
+            writer.close()
+
+    async def serve(
+        self,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+        ssl_context: ssl.SSLContext | None = None
+    ) -> None:
+        """Listen for aggregators until cancelled.
+
+        Raises:
+            ValueError: If host is not a loopback address and no token or no TLS context is set
+        """
+        if not is_loopback(host, port):
+            if not self.token:
+                raise ValueError(f"A token is required to listen on the non-loopback address {host or '*'}")
+            if ssl_context is None:
+                raise ValueError(f"TLS is required to listen on the non-loopback address {host or '*'}")
+        server = await asyncio.start_server(
+            self.handle_connection, host, port, limit=MAX_MESSAGE_BYTES, ssl=ssl_context
+        )
+        logger.info("YubiKey device agent '%s' listening on %s:%d%s", self.name, host, port,
+                    " (TLS)" if ssl_context is not None else "")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    """Run a device agent for this host."""
+    parser = argparse.ArgumentParser(description="YubiKey device agent")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--name", help="Name reported to the aggregator (default: hostname)")
+    parser.add_argument(
+        "--simulate", metavar="SERIALS",
+        help="Serve simulated devices instead of real hardware, e.g. --simulate 1001,1002"
+    )
+    parser.add_argument("--tls-cert", help="PEM certificate (chain) to serve TLS with; required off loopback")
+    parser.add_argument("--tls-key", help="PEM private key of --tls-cert (default: read from --tls-cert)")
+    parser.add_argument("--tls-client-ca", help="Require aggregators to present a certificate signed by this CA")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    token = os.environ.get("YUBIKEY_AGENT_TOKEN") or None
+    if not is_loopback(args.host, args.port):
+        if token is None:
+            parser.error("YUBIKEY_AGENT_TOKEN must be set when listening on a non-loopback address")
+        if not args.tls_cert:
+            parser.error("--tls-cert is required when listening on a non-loopback address")
+    if (args.tls_key or args.tls_client_ca) and not args.tls_cert:
+        parser.error("--tls-key and --tls-client-ca need --tls-cert")
+    ssl_context = server_ssl_context(args.tls_cert, args.tls_key, args.tls_client_ca) if args.tls_cert else None
+
+    run_command = run_local_ykman
+    if args.simulate:
+        run_command = SimulatedYkman([int(serial) for serial in args.simulate.split(",")])
+
+    asyncio.run(DeviceAgent(run_command, token, args.name).serve(args.host, args.port, ssl_context))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+YubiKey Device State - Cached device state, change events and hot-plug watching.
+
+Keeps the last-known inventory and per-device information (ykman info,
+application status, OpenPGP status) so MCP resources can be served without
+spawning ykman, and emits change events when devices are plugged in, removed,
+or modified by a write tool.
+"""
+
+import asyncio
+import logging
+import subprocess
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, AsyncContextManager, Awaitable, Callable, Literal
+
+from pydantic import AnyUrl
+
+from admission import BusyError
+from state_store import StateStore
+
+try:
+    from ykman.device import scan_devices
+except ImportError:  # ykman (or pyscard) not importable - fall back to polling the CLI
+    scan_devices = None
+
+logger = logging.getLogger(__name__)
+
+StateKind = Literal["info", "applications", "openpgp"]
+STATE_KINDS: tuple[StateKind, ...] = ("info", "applications", "openpgp")
+
+DEVICES_URI = "yubikey://devices"
+
+
+def device_uri(serial: int, kind: StateKind) -> str:
+    """Resource URI for one kind of per-device state, e.g. yubikey://16021303/info."""
+    return f"yubikey://{serial}/{kind}"
+
+
+def parse_device_list(lines: list[str]) -> dict[int, str]:
+    """Map serial -> description for `ykman list` output lines that include a serial."""
+    # Format: "YubiKey 5 NFC (5.2.7) [OTP+FIDO+CCID] Serial: 16021303"
+    devices = {}
+    for line in lines:
+        if "Serial: " in line:
+            try:
+                devices[int(line.split("Serial: ")[-1].strip())] = line
+            except ValueError:
+                continue
+    return devices
+
+
+# ============================================================================
+# State Cache
+# ============================================================================
+
+@dataclass
+class CachedValue:
+    """One cached piece of device state.
+
+    Attributes:
+        value: Cached content (text or parsed structure)
+        updated_at: Unix timestamp of the last refresh
+        stale: True once a write or re-enumeration may have changed the device
+        restored: True if loaded from the state store and not re-read since
+    """
+    value: Any
+    updated_at: float = field(default_factory=time.time)
+    stale: bool = False
+    restored: bool = False
+
+
+@dataclass
+class StateChange:
+    """Describes what changed in the cache.
+
+    Attributes:
+        uris: Resource URIs whose content changed
+        added: Serials that appeared in the inventory
+        removed: Serials that disappeared from the inventory
+    """
+    uris: list[str] = field(default_factory=list)
+    added: set[int] = field(default_factory=set)
+    removed: set[int] = field(default_factory=set)
+
+
+class DeviceStateCache:
+    """Last-known device inventory and per-device state.
+
+    Listeners registered with add_listener() are called synchronously with a
+    StateChange whenever cached content changes, entries go stale, or devices
+    are added/removed. With a StateStore attached, every update is also
+    written through to disk.
+    """
+
+    def __init__(self):
+        self.inventory: dict[int, str] = {}
+        self.inventory_lines: list[str] = []
+        self.inventory_updated_at: float | None = None
+        self.store: StateStore | None = None
+        self._entries: dict[int, dict[StateKind, CachedValue]] = {}
+        self._listeners: list[Callable[[StateChange], None]] = []
+
+    def restore(self, store: StateStore) -> int:
+        """Load persisted state as stale entries and write through to the store from now on.
+
+        Returns:
+            Number of per-device entries restored
+        """
+        stored = store.load()
+        self.inventory = parse_device_list(stored.inventory_lines)
+        self.inventory_lines = stored.inventory_lines
+        self.inventory_updated_at = stored.inventory_updated_at
+        restored = 0
+        for serial, kinds in stored.entries.items():
+            for kind, (value, updated_at) in kinds.items():
+                if kind in STATE_KINDS and kind not in self._entries.get(serial, {}):
+                    self._entries.setdefault(serial, {})[kind] = CachedValue(value, updated_at, stale=True, restored=True)
+                    restored += 1
+        self.store = store
+        return restored
+
+    def add_listener(self, listener: Callable[[StateChange], None]) -> None:
+        self._listeners.append(listener)
+
+    def _emit(self, change: StateChange) -> None:
+        if not (change.uris or change.added or change.removed):
+            return
+        for listener in self._listeners:
+            try:
+                listener(change)
+            except Exception:
+                logger.exception("Device state listener failed")
+
+    def update_inventory(self, lines: list[str]) -> StateChange:
+        """Replace the inventory with fresh `ykman list` output."""
+        devices = parse_device_list(lines)
+        change = StateChange(
+            added=set(devices) - set(self.inventory),
+            removed=set(self.inventory) - set(devices),
+        )
+
+        if lines != self.inventory_lines:
+            change.uris.append(DEVICES_URI)
+        for serial in change.removed:
+            change.uris.extend(device_uri(serial, kind) for kind in self._entries.pop(serial, {}))
+
+        self.inventory = devices
+        self.inventory_lines = list(lines)
+        self.inventory_updated_at = time.time()
+        if self.store is not None and (change.added or change.removed or DEVICES_URI in change.uris):
+            self.store.save_inventory(self.inventory_lines, devices, self.inventory_updated_at)
+        self._emit(change)
+        return change
+
+    def get(self, serial: int, kind: StateKind) -> CachedValue | None:
+        return self._entries.get(serial, {}).get(kind)
+
+    def set(self, serial: int, kind: StateKind, value: Any) -> None:
+        """Store freshly read state for a device.
+
+        Subscribers are only notified if the content changed and the previous
+        value was not already announced as stale.
+        """
+        previous = self.get(serial, kind)
+        cached = CachedValue(value)
+        self._entries.setdefault(serial, {})[kind] = cached
+        if self.store is not None:
+            self.store.save_state(serial, kind, value, cached.updated_at)
+        if previous is not None and not previous.stale and previous.value != value:
+            self._emit(StateChange(uris=[device_uri(serial, kind)]))
+
+    def invalidate(self, serial: int, kinds: tuple[StateKind, ...] = STATE_KINDS) -> None:
+        """Mark cached state stale after a write, notifying subscribers once."""
+        uris = []
+        for kind in kinds:
+            cached = self.get(serial, kind)
+            if cached is not None:
+                cached.restored = False  # Must be re-read before serving, even if restored from disk
+            if cached is not None and not cached.stale:
+                cached.stale = True
+                uris.append(device_uri(serial, kind))
+        self._emit(StateChange(uris=uris))
+
+    def mark_all_stale(self) -> None:
+        """Mark every entry stale without notifying."""
+        for entries in self._entries.values():
+            for cached in entries.values():
+                cached.stale = True
+
+
+# ============================================================================
+# Resource Subscriptions
+# ============================================================================
+
+class SubscriptionRegistry:
+    """Tracks which client sessions subscribed to which resource URIs.
+
+    Sessions are held weakly so disconnected clients drop out automatically.
+    """
+
+    def __init__(self):
+        self._subscribers: dict[str, weakref.WeakSet] = {}
+
+    def subscribe(self, uri: str, session: Any) -> None:
+        self._subscribers.setdefault(uri, weakref.WeakSet()).add(session)
+
+    def unsubscribe(self, uri: str, session: Any) -> None:
+        sessions = self._subscribers.get(uri)
+        if sessions is not None:
+            sessions.discard(session)
+
+    async def notify(self, change: StateChange) -> None:
+        """Send notifications/resources/updated (and list_changed on hot-plug)."""
+        for uri in change.uris:
+            for session in list(self._subscribers.get(uri, ())):
+                try:
+                    await session.send_resource_updated(AnyUrl(uri))
+                except Exception:
+                    # Session closed mid-send
+                    self.unsubscribe(uri, session)
+
+        if change.added or change.removed:
+            # Per-device resources appeared or disappeared
+            sessions = {session for subscribers in self._subscribers.values() for session in subscribers}
+            for session in sessions:
+                try:
+                    await session.send_resource_list_changed()
+                except Exception:
+                    continue
+
+
+# ============================================================================
+# Hot-plug Watcher
+# ============================================================================
+
+class HotplugWatcher:
+    """Polls for YubiKey insertion/removal and refreshes the cached inventory.
+
+    Uses ykman's scan_devices() fingerprint, which enumerates USB without
+    opening any connection, and only runs `ykman list` when the fingerprint
+    changes. Without the ykman library (or when devices are remote, use_scan=False)
+    it falls back to polling `ykman list` at a slower interval. If given,
+    admit(None) is entered around each `ykman list`, so the watcher queues
+    behind device commands like any other enumeration; a poll that is not
+    admitted is skipped and retried at the next interval.
+
+    confirmed is True while the cached inventory reflects the last successful
+    poll; it is False before the first poll (the inventory may be restored from
+    disk), after a failed one, and once the watcher has stopped. When it stops,
+    every cached entry is marked stale, since nothing notices a device being
+    swapped any more.
+    """
+
+    def __init__(
+        self,
+        cache: DeviceStateCache,
+        run_command: Callable[[list[str]], subprocess.CompletedProcess],
+        interval: float = 1.0,
+        cli_interval: float = 5.0,
+        use_scan: bool = True,
+        admit: Callable[[int | None], Awaitable[AsyncContextManager[Any]]] | None = None
+    ):
+        self.cache = cache
+        self.run_command = run_command
+        self.admit = admit
+        self.use_scan = use_scan and scan_devices is not None
+        self.interval = interval if self.use_scan else cli_interval
+        self._fingerprint: int | None = None
+        self._task: asyncio.Task | None = None
+        self.confirmed = False
+
+    async def refresh_inventory(self) -> StateChange:
+        if self.admit is None:
+            result = await asyncio.to_thread(self.run_command, ["list"])
+        else:
+            async with await self.admit(None):
+                result = await asyncio.to_thread(self.run_command, ["list"])
+        lines = [line for line in result.stdout.strip().split('\n') if line]
+        return self.cache.update_inventory(lines)
+
+    async def poll_once(self) -> None:
+        if self.use_scan:
+            _, fingerprint = await asyncio.to_thread(scan_devices)
+            if fingerprint == self._fingerprint:
+                return
+            self._fingerprint = fingerprint
+        await self.refresh_inventory()
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                try:
+                    await self.poll_once()
+                    self.confirmed = True
+                except (subprocess.CalledProcessError, FileNotFoundError, OSError, BusyError) as e:
+                    self.confirmed = False
+                    logger.debug("Hot-plug poll failed: %s", e)
+                except Exception:
+                    # Keep watching; one bad poll (e.g. unexpected ykman output) must not end hot-plug detection
+                    self.confirmed = False
+                    logger.exception("Hot-plug poll failed")
+                await asyncio.sleep(self.interval)
+        finally:
+            self.confirmed = False
+            self.cache.mark_all_stale()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self.confirmed = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,360 @@
+"""
+YubiKey FIDO2 Credentials - Paginated listing of discoverable (resident) credentials.
+
+Enumerating discoverable credentials walks every relying party and every
+credential over CTAP2 credential management, one round trip per item. This
+module keeps one enumeration per serial and hands it out in pages:
+
+- With the fido2/ykman libraries available locally, a CtapCredentialSource holds
+  a FIDO connection and a PIN/UV token with the credential management permission
+  and advances the CTAP2 enumeration only as far as the requested page.
+- Otherwise (e.g. devices behind device agents) a CliCredentialSource runs
+  `ykman fido credentials list --csv` once and pages through the result.
+
+Listings are cached per serial for a TTL; deleting a credential updates the
+cached listing instead of forcing a rescan.
+"""
+
+import base64
+import csv
+import io
+import logging
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterator, Protocol
+
+try:
+    from fido2.ctap import CtapError
+    from fido2.ctap2 import ClientPin, Ctap2, CredentialManagement
+    from fido2.webauthn import PublicKeyCredentialDescriptor, PublicKeyCredentialType
+    from ykman.device import list_all_devices
+    from yubikit.core.fido import FidoConnection
+except ImportError:  # Libraries (or pyscard) not importable - use the ykman CLI
+    list_all_devices = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class CredentialListingError(Exception):
+    """Raised when credentials cannot be enumerated or deleted."""
+
+
+@dataclass(frozen=True)
+class ResidentCredential:
+    credential_id: str  # hex
+    rp_id: str
+    user_name: str
+    user_display_name: str
+    user_id: str  # hex
+
+    def to_dict(self) -> dict[str, str]:
+        return asdict(self)
+
+
+class CredentialSource(Protocol):
+    """Where a listing's credentials come from."""
+
+    @property
+    def total(self) -> int | None:
+        """Number of credentials on the device, once known."""
+
+    def fetch(self, count: int) -> list[ResidentCredential]:
+        """Return up to count more credentials; an empty list means the enumeration is complete."""
+
+    def delete(self, credential_id: str) -> None:
+        """Delete a credential by its full hex ID."""
+
+    def close(self) -> None:
+        """Release the connection and token, if any."""
+
+
+# ============================================================================
+# Sources
+# ============================================================================
+
+class CtapCredentialSource:
+    """Lazy CTAP2 enumeration over a FIDO connection held open between pages.
+
+    The enumeration is resumable: if another client interrupts the
+    begin/next sequence or invalidates the PIN token, the walk restarts with
+    a fresh token and skips credentials that were already returned.
+    """
+
+    def __init__(self, serial: int, pin: str):
+        if list_all_devices is None:
+            raise CredentialListingError("The fido2/ykman libraries are not available")
+        self.serial = serial
+        self._pin = pin
+        self._connection = None
+        self._credman = None
+        self._walk: Iterator[ResidentCredential] | None = None
+        self._seen: set[str] = set()
+        self._total: int | None = None
+        self._restarts = 0
+
+    @property
+    def total(self) -> int | None:
+        return self._total
+
+    def _open(self) -> None:
+        self.close()
+        for device, info in list_all_devices([FidoConnection]):
+            if info.serial == self.serial:
+                self._connection = device.open_connection(FidoConnection)
+                break
+        else:
+            raise CredentialListingError(f"No YubiKey with serial {self.serial} is attached")
+
+        ctap2 = Ctap2(self._connection)
+        if not CredentialManagement.is_supported(ctap2.info):
+            raise CredentialListingError("This YubiKey does not support FIDO2 credential management")
+        client_pin = ClientPin(ctap2)
+        try:
+            token = client_pin.get_pin_token(self._pin, ClientPin.PERMISSION.CREDENTIAL_MGMT)
+        except CtapError as e:
+            raise CredentialListingError(f"PIN error: {e.code.name}") from e
+        self._credman = CredentialManagement(ctap2, client_pin.protocol, token)
+
+    def _enumerate(self) -> Iterator[ResidentCredential]:
+        result = CredentialManagement.RESULT
+        credman = self._credman
+        metadata = credman.get_metadata()
+        if metadata.get(result.EXISTING_CRED_COUNT) == 0:
+            self._total = 0
+            return
+
+        # Collect RPs first: the RP walk must not be interleaved with credential walks
+        rps = [credman.enumerate_rps_begin()]
+        rps += [credman.enumerate_rps_next() for _ in range(rps[0][result.TOTAL_RPS] - 1)]
+
+        total = 0
+        for rp in rps:
+            first = credman.enumerate_creds_begin(rp[result.RP_ID_HASH])
+            count = first[result.TOTAL_CREDENTIALS]
+            total += count
+            for i in range(count):
+                cred = first if i == 0 else credman.enumerate_creds_next()
+                user = cred[result.USER]
+                yield ResidentCredential(
+                    credential_id=cred[result.CREDENTIAL_ID]["id"].hex(),
+                    rp_id=rp[result.RP]["id"],
+                    user_name=user.get("name", ""),
+                    user_display_name=user.get("displayName", ""),
+                    user_id=user["id"].hex(),
+                )
+        self._total = total
+
+    def fetch(self, count: int) -> list[ResidentCredential]:
+        batch: list[ResidentCredential] = []
+        while len(batch) < count:
+            try:
+                if self._walk is None:
+                    self._open()
+                    self._walk = self._enumerate()
+                credential = next(self._walk, None)
+            except (CtapError, OSError) as e:
+                # Sequence interrupted (another client used the key) or token expired: start over
+                self._walk = None
+                self._restarts += 1
+                if self._restarts > 3:
+                    raise CredentialListingError(f"Credential enumeration failed: {e}") from e
+                logger.debug("Restarting FIDO2 credential enumeration for %s: %s", self.serial, e)
+                continue
+            if credential is None:
+                self.close()
+                break
+            if credential.credential_id not in self._seen:
+                self._seen.add(credential.credential_id)
+                batch.append(credential)
+        return batch
+
+    def delete(self, credential_id: str) -> None:
+        # Any other command ends a begin/next sequence; the next fetch resumes by skipping seen credentials
+        self._walk = None
+        for attempt in range(2):
+            try:
+                if self._credman is None or attempt:
+                    self._open()
+                self._credman.delete_cred(PublicKeyCredentialDescriptor(
+                    type=PublicKeyCredentialType.PUBLIC_KEY, id=bytes.fromhex(credential_id)
+                ))
+                return
+            except CtapError as e:
+                if e.code == CtapError.ERR.NO_CREDENTIALS or attempt:
+                    raise CredentialListingError(f"Failed to delete credential: {e.code.name}") from e
+
+    def close(self) -> None:
+        self._credman = None
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except OSError:
+                pass
+            self._connection = None
+
+
+class CliCredentialSource:
+    """Full listing through `ykman fido credentials list --csv`, fetched once and paged locally."""
+
+    def __init__(self, run_command: Callable[[list[str]], subprocess.CompletedProcess], serial: int, pin: str):
+        self.run_command = run_command
+        self.serial = serial
+        self._pin = pin
+        self._credentials: list[ResidentCredential] | None = None
+        self._position = 0
+
+    @property
+    def total(self) -> int | None:
+        return len(self._credentials) if self._credentials is not None else None
+
+    def _args(self, *args: str) -> list[str]:
+        return ["--device", str(self.serial), "fido", "credentials", *args, "--pin", self._pin]
+
+    def _run(self, args: list[str]) -> subprocess.CompletedProcess:
+        try:
+            return self.run_command(args)
+        except subprocess.CalledProcessError as e:
+            # Report ykman's error only: the command line contains the PIN
+            raise CredentialListingError((e.stderr or "").strip() or f"ykman exited with {e.returncode}") from None
+
+    def fetch(self, count: int) -> list[ResidentCredential]:
+        if self._credentials is None:
+            result = self._run(self._args("list", "--csv"))
+            rows = csv.DictReader(io.StringIO(result.stdout.strip()))
+            self._credentials = [
+                ResidentCredential(
+                    credential_id=row["credential_id"],
+                    rp_id=row["rp_id"],
+                    user_name=row["user_name"],
+                    user_display_name=row["user_display_name"],
+                    user_id=row["user_id"],
+                )
+                for row in rows
+            ]
+        batch = self._credentials[self._position:self._position + count]
+        self._position += len(batch)
+        return batch
+
+    def delete(self, credential_id: str) -> None:
+        self._run(self._args("delete", credential_id, "--force"))
+
+    def close(self) -> None:
+        pass
+
+
+# ============================================================================
+# Listings
+# ============================================================================
+
+def encode_cursor(offset: int, last_credential_id: str | None) -> str:
+    return base64.urlsafe_b64encode(f"{offset}:{last_credential_id or ''}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[int, str | None]:
+    try:
+        offset, _, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition(":")
+        return int(offset), last_id or None
+    except (ValueError, UnicodeDecodeError) as e:
+        raise CredentialListingError(f"Invalid cursor: {cursor}") from e
+
+
+@dataclass
+class CredentialPage:
+    credentials: list[ResidentCredential]
+    next_cursor: str | None
+    total: int | None
+    complete: bool
+
+
+class CredentialListing:
+    """One device's credentials, enumerated incrementally and cached."""
+
+    def __init__(self, source: CredentialSource, ttl: float):
+        self.source = source
+        self.items: list[ResidentCredential] = []
+        self.complete = False
+        self.expires_at = time.monotonic() + ttl
+        self.lock = threading.Lock()
+
+    def _start_index(self, cursor: str | None) -> int:
+        if cursor is None:
+            return 0
+        offset, last_id = decode_cursor(cursor)
+        if last_id is not None:
+            for index, credential in enumerate(self.items):
+                if credential.credential_id == last_id:
+                    return index + 1
+            # The last credential of the previous page was deleted; everything before it shifted by one
+            return max(0, min(offset - 1, len(self.items)))
+        return min(offset, len(self.items))
+
+    def page(self, cursor: str | None, page_size: int) -> CredentialPage:
+        """Return the page after cursor, enumerating more credentials only if needed (blocking)."""
+        with self.lock:
+            # Enumerate past the cursor's offset first: the cursor may come from a listing that has since expired
+            wanted = (decode_cursor(cursor)[0] if cursor is not None else 0) + page_size + 1  # +1 to know if more exist
+            if not self.complete and len(self.items) < wanted:
+                fetched = self.source.fetch(wanted - len(self.items))
+                self.items.extend(fetched)
+                if not fetched or len(self.items) < wanted:
+                    self.complete = True
+            start = self._start_index(cursor)
+
+            credentials = self.items[start:start + page_size]
+            end = start + len(credentials)
+            has_more = end < len(self.items) or not self.complete
+            return CredentialPage(
+                credentials=credentials,
+                next_cursor=encode_cursor(end, credentials[-1].credential_id) if has_more and credentials else None,
+                total=len(self.items) if self.complete else self.source.total,
+                complete=self.complete,
+            )
+
+    def find(self, credential_id: str) -> list[ResidentCredential]:
+        """Cached credentials whose ID starts with credential_id."""
+        prefix = credential_id.rstrip(".").lower()
+        with self.lock:
+            return [c for c in self.items if c.credential_id.startswith(prefix)]
+
+    def delete(self, credential_id: str) -> None:
+        """Delete through the source and drop the credential from the cached listing (blocking)."""
+        with self.lock:
+            self.source.delete(credential_id)
+            self.items = [c for c in self.items if c.credential_id != credential_id]
+
+
+class FidoCredentialCache:
+    """Per-serial credential listings, evicted after a TTL or when the device is removed."""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._listings: dict[int, CredentialListing] = {}
+        self._lock = threading.Lock()
+
+    def get(self, serial: int) -> CredentialListing | None:
+        with self._lock:
+            listing = self._listings.get(serial)
+            if listing is not None and listing.expires_at <= time.monotonic():
+                self._listings.pop(serial).source.close()
+                listing = None
+            return listing
+
+    def put(self, serial: int, source: CredentialSource) -> CredentialListing:
+        listing = CredentialListing(source, self.ttl)
+        with self._lock:
+            previous = self._listings.pop(serial, None)
+            self._listings[serial] = listing
+        if previous is not None:
+            previous.source.close()
+        return listing
+
+    def drop(self, serial: int) -> None:
+        with self._lock:
+            listing = self._listings.pop(serial, None)
+        if listing is not None:
+            listing.source.close()
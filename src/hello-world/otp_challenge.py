@@ -0,0 +1,298 @@
+"""
+YubiKey OTP Challenge-Response - Batched HMAC-SHA1 over persistent OTP connections.
+
+`ykman otp calculate` starts a process, enumerates devices and opens the OTP
+interface for every challenge. This module keeps one worker thread per device
+that holds the OTP (HID) connection open between calls, so a batch of
+challenges is queued to the device at once and answered back to back.
+
+The OTP protocol answers one challenge at a time, so a device's challenges
+run in order on its worker; different devices run in parallel. A slot
+configured to require touch blocks only its own device's worker while it
+waits for the button, so challenges on other keys keep flowing.
+
+Without the ykman/yubikit libraries (e.g. devices behind device agents) the
+workers fall back to one `ykman otp calculate` per challenge.
+"""
+
+import asyncio
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Protocol
+
+try:
+    from ykman.device import list_all_devices
+    from yubikit.core import TimeoutError as CommandTimeoutError
+    from yubikit.core.otp import STATUS_UPNEEDED, OtpConnection
+    from yubikit.yubiotp import SLOT, YubiOtpSession
+except ImportError:  # Libraries not importable - use the ykman CLI
+    list_all_devices = None
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 256
+MAX_CHALLENGE_BYTES = 64  # HMAC-SHA1 challenges are padded to 64 bytes by the key
+DEFAULT_TOUCH_TIMEOUT = 15.0
+
+
+class ChallengeResponseError(Exception):
+    """Raised when a device cannot be opened for challenge-response."""
+
+
+class ChallengeTimeoutError(ChallengeResponseError):
+    """Raised when the key does not answer in time (usually: no touch)."""
+
+
+@dataclass
+class ChallengeResult:
+    challenge: str  # hex
+    response: str | None  # hex HMAC-SHA1, None on error
+    latency_ms: float  # From batch submission to this item's response (includes waiting behind earlier items)
+    device_ms: float  # Time the key took for this item (including any touch wait)
+    touched: bool
+    error: str | None = None
+
+    def to_dict(self) -> dict[str, object]:
+        return asdict(self)
+
+
+def parse_challenges(challenges: list[str]) -> list[bytes]:
+    """Decode hex challenges.
+
+    Raises:
+        ValueError: If the batch is empty or too large, or a challenge is not valid hex of 1-64 bytes
+    """
+    if not challenges:
+        raise ValueError("At least one challenge is required")
+    if len(challenges) > MAX_BATCH_SIZE:
+        raise ValueError(f"At most {MAX_BATCH_SIZE} challenges per batch, got {len(challenges)}")
+
+    decoded = []
+    for challenge in challenges:
+        try:
+            value = bytes.fromhex(challenge)
+        except ValueError:
+            raise ValueError(f"Challenge is not valid hex: {challenge}") from None
+        if not 1 <= len(value) <= MAX_CHALLENGE_BYTES:
+            raise ValueError(f"Challenges must be 1-{MAX_CHALLENGE_BYTES} bytes, got {len(value)}: {challenge}")
+        decoded.append(value)
+    return decoded
+
+
+class ChallengeBackend(Protocol):
+    """How a worker talks to its device."""
+
+    def calculate(self, slot: int, challenge: bytes, touch_timeout: float, on_touch: Callable[[], None]) -> bytes:
+        """Return the HMAC-SHA1 response; on_touch is called if the key waits for a touch."""
+
+    def close(self) -> None:
+        """Release the connection, if any."""
+
+
+# ============================================================================
+# Backends
+# ============================================================================
+
+class HidChallengeBackend:
+    """Challenge-response over an OTP (HID) connection kept open between challenges."""
+
+    def __init__(self, serial: int):
+        if list_all_devices is None:
+            raise ChallengeResponseError("The ykman/yubikit libraries are not available")
+        self.serial = serial
+        self._connection = None
+        self._session = None
+
+    def _open(self) -> None:
+        self.close()
+        for device, info in list_all_devices([OtpConnection]):
+            if info.serial == self.serial:
+                self._connection = device.open_connection(OtpConnection)
+                break
+        else:
+            raise ChallengeResponseError(f"No YubiKey with serial {self.serial} and the OTP interface enabled is attached")
+        self._session = YubiOtpSession(self._connection)
+
+    def calculate(self, slot: int, challenge: bytes, touch_timeout: float, on_touch: Callable[[], None]) -> bytes:
+        cancel = threading.Event()
+        timer: threading.Timer | None = None
+
+        def on_keepalive(status: int) -> None:
+            nonlocal timer
+            if status == STATUS_UPNEEDED and timer is None:
+                on_touch()
+                timer = threading.Timer(touch_timeout, cancel.set)
+                timer.daemon = True
+                timer.start()
+
+        for attempt in range(2):
+            if self._session is None:
+                self._open()
+            try:
+                return self._session.calculate_hmac_sha1(SLOT(slot), challenge, cancel, on_keepalive)
+            except CommandTimeoutError as e:
+                # yubikit's TimeoutError (a CommandError), raised once the touch timer sets cancel
+                raise ChallengeTimeoutError(str(e)) from e
+            except OSError:
+                # Device re-enumerated (e.g. after a config change) or was replugged; reopen once
+                self.close()
+                if attempt:
+                    raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    def close(self) -> None:
+        self._session = None
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except OSError:
+                pass
+            self._connection = None
+
+
+class CliChallengeBackend:
+    """One `ykman otp calculate` per challenge."""
+
+    def __init__(self, run_command: Callable[[list[str]], subprocess.CompletedProcess], serial: int):
+        self.run_command = run_command
+        self.serial = serial
+
+    def calculate(self, slot: int, challenge: bytes, touch_timeout: float, on_touch: Callable[[], None]) -> bytes:
+        try:
+            result = self.run_command(["--device", str(self.serial), "otp", "calculate", str(slot), challenge.hex()])
+        except subprocess.CalledProcessError as e:
+            detail = (e.stderr or "").strip() or f"ykman exited with {e.returncode}"
+            if "timed out" in detail.lower() or "did not finish" in detail.lower():
+                raise ChallengeTimeoutError(detail) from None
+            raise ChallengeResponseError(detail) from None
+        return bytes.fromhex(result.stdout.strip())
+
+    def close(self) -> None:
+        pass
+
+
+# ============================================================================
+# Workers
+# ============================================================================
+
+class DeviceChallengeWorker:
+    """A single thread owning one device's backend; challenges run in submission order."""
+
+    def __init__(self, serial: int, backend: ChallengeBackend):
+        self.serial = serial
+        self.backend = backend
+        self.last_used = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"otp-challenge-{serial}")
+
+    def submit(
+        self,
+        slot: int,
+        challenge: bytes,
+        submitted_at: float,
+        touch_timeout: float,
+        on_touch: Callable[[], None]
+    ) -> Future:
+        self.last_used = time.monotonic()
+        return self._executor.submit(self._calculate, slot, challenge, submitted_at, touch_timeout, on_touch)
+
+    def _calculate(
+        self,
+        slot: int,
+        challenge: bytes,
+        submitted_at: float,
+        touch_timeout: float,
+        on_touch: Callable[[], None]
+    ) -> ChallengeResult:
+        touched = False
+
+        def touch_needed() -> None:
+            nonlocal touched
+            touched = True
+            on_touch()
+
+        started = time.perf_counter()
+        response, error = None, None
+        try:
+            response = self.backend.calculate(slot, challenge, touch_timeout, touch_needed).hex()
+        except ChallengeTimeoutError:
+            error = f"No touch within {touch_timeout:.0f}s" if touched else "Timed out"
+        except Exception as e:  # Reported per item; one failing challenge doesn't fail the batch
+            error = str(e) or type(e).__name__
+            logger.debug("Challenge on YubiKey %s slot %s failed: %r", self.serial, slot, e)
+        finished = time.perf_counter()
+        self.last_used = time.monotonic()
+        return ChallengeResult(
+            challenge=challenge.hex(),
+            response=response,
+            latency_ms=round((finished - submitted_at) * 1000, 2),
+            device_ms=round((finished - started) * 1000, 2),
+            touched=touched,
+            error=error,
+        )
+
+    def close(self) -> None:
+        # Close on the worker thread, after anything already queued
+        self._executor.submit(self.backend.close)
+        self._executor.shutdown(wait=False)
+
+
+class ChallengeResponsePool:
+    """Per-serial challenge workers, closed after idle_timeout seconds without use or when the device is removed."""
+
+    def __init__(self, backend_factory: Callable[[int], ChallengeBackend], idle_timeout: float = 60.0):
+        self.backend_factory = backend_factory
+        self.idle_timeout = idle_timeout
+        self._workers: dict[int, DeviceChallengeWorker] = {}
+        self._lock = threading.Lock()
+
+    def _worker(self, serial: int) -> DeviceChallengeWorker:
+        now = time.monotonic()
+        idle = []
+        with self._lock:
+            for other, worker in list(self._workers.items()):
+                if other != serial and now - worker.last_used > self.idle_timeout:
+                    idle.append(self._workers.pop(other))
+            worker = self._workers.get(serial)
+            if worker is None:
+                worker = self._workers[serial] = DeviceChallengeWorker(serial, self.backend_factory(serial))
+        for stale in idle:
+            stale.close()
+        return worker
+
+    async def calculate(
+        self,
+        serial: int,
+        slot: int,
+        challenges: list[bytes],
+        touch_timeout: float = DEFAULT_TOUCH_TIMEOUT,
+        on_touch: Callable[[], None] | None = None
+    ) -> list[ChallengeResult]:
+        """Queue every challenge to the device's worker at once and wait for all responses.
+
+        on_touch is called (from the worker thread) each time the key waits for a touch.
+        """
+        worker = self._worker(serial)
+        submitted_at = time.perf_counter()
+        futures = [
+            worker.submit(slot, challenge, submitted_at, touch_timeout, on_touch or (lambda: None))
+            for challenge in challenges
+        ]
+        return list(await asyncio.gather(*(asyncio.wrap_future(future) for future in futures)))
+
+    def drop(self, serial: int) -> None:
+        with self._lock:
+            worker = self._workers.pop(serial, None)
+        if worker is not None:
+            worker.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            workers, self._workers = list(self._workers.values()), {}
+        for worker in workers:
+            worker.close()
@@ -0,0 +1,251 @@
+"""
+YubiKey Profiling - On-demand sampling profiler for tool calls.
+
+When enabled for a tool, each invocation is sampled by a background thread
+that periodically captures the Python stack of every thread (the event loop,
+asyncio.to_thread workers running ykman, pexpect waits, ...). Samples are
+written in the folded-stack format ("frame;frame;frame count"), which
+flamegraph.pl, speedscope and inferno render directly.
+
+Sampling is process-wide: if other tool calls run concurrently, their stacks
+appear in the same profile under their own thread names.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_MS = 5.0
+MAX_STACK_DEPTH = 128
+MAX_RECENT_PROFILES = 20
+
+# Stop unwinding at these frames; everything above them is event loop / thread plumbing
+_ROOT_FUNCTIONS = {"_run_once", "_bootstrap_inner"}
+
+# Tool names come from the client (with "*" even unknown ones), so only these characters reach a filename
+_UNSAFE_FILENAME_CHARACTERS = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{frame.f_lineno})".replace(";", ":")
+
+
+# ============================================================================
+# Sampler
+# ============================================================================
+
+class StackSampler:
+    """Background thread sampling every thread's stack into the active recordings."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._recordings: set[int] = set()
+        self._counters: dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._next_id = 0
+
+    def begin(self) -> int:
+        """Start a recording (and the sampling thread if idle); returns a recording id."""
+        with self._lock:
+            self._next_id += 1
+            recording = self._next_id
+            self._recordings.add(recording)
+            self._counters[recording] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="tool-profiler", daemon=True)
+                self._thread.start()
+        return recording
+
+    def end(self, recording: int) -> Counter:
+        """Stop a recording and return its folded-stack sample counts."""
+        with self._lock:
+            self._recordings.discard(recording)
+            return self._counters.pop(recording, Counter())
+
+    def _sample(self) -> Counter:
+        own_ident = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks: Counter = Counter()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                if frame.f_code.co_name in _ROOT_FUNCTIONS:
+                    break
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(labels))] += 1
+        return stacks
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._recordings:
+                    self._thread = None
+                    return
+                interval = self.interval
+            stacks = self._sample()
+            with self._lock:
+                for recording in self._recordings:
+                    self._counters[recording].update(stacks)
+            time.sleep(interval)
+
+
+# ============================================================================
+# Tool Profiler
+# ============================================================================
+
+@dataclass
+class _PendingProfile:
+    stacks: Counter = field(default_factory=Counter)
+    calls: int = 0
+    elapsed: float = 0.0
+
+
+class ToolProfiler:
+    """Profiles selected tool calls and writes one folded-stack file per N calls.
+
+    Disabled by default; when no tool is selected the per-call overhead is a set lookup.
+
+    Attributes:
+        tools: Tool names to profile, or {"*"} for every tool
+        calls_per_file: Aggregate this many calls of a tool into each output file
+        output_dir: Directory where .folded files are written
+    """
+
+    def __init__(
+        self,
+        output_dir: str | Path,
+        tools: set[str] | None = None,
+        calls_per_file: int = 1,
+        interval_ms: float = DEFAULT_INTERVAL_MS
+    ):
+        self.output_dir = Path(output_dir)
+        self.tools: set[str] = set(tools or ())
+        self.calls_per_file = max(1, calls_per_file)
+        self.sampler = StackSampler(interval_ms / 1000)
+        self.recent_files: list[str] = []
+        self._pending: dict[str, _PendingProfile] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, default_dir: str | Path) -> "ToolProfiler":
+        """Configure from YUBIKEY_PROFILE_TOOLS ("*" or comma-separated names) and related variables."""
+        tools = {t.strip() for t in os.environ.get("YUBIKEY_PROFILE_TOOLS", "").split(",") if t.strip()}
+        return cls(
+            output_dir=os.environ.get("YUBIKEY_PROFILE_DIR", default_dir),
+            tools=tools,
+            calls_per_file=int(os.environ.get("YUBIKEY_PROFILE_CALLS_PER_FILE", "1")),
+            interval_ms=float(os.environ.get("YUBIKEY_PROFILE_INTERVAL_MS", str(DEFAULT_INTERVAL_MS))),
+        )
+
+    @property
+    def interval_ms(self) -> float:
+        return self.sampler.interval * 1000
+
+    def configure(
+        self,
+        tools: list[str] | None = None,
+        calls_per_file: int | None = None,
+        interval_ms: float | None = None
+    ) -> None:
+        """Change settings at runtime; an empty tools list disables profiling and flushes partial files."""
+        if tools is not None:
+            self.tools = set(tools)
+            if not self.tools:
+                self.flush()
+        if calls_per_file is not None:
+            self.calls_per_file = max(1, calls_per_file)
+        if interval_ms is not None:
+            if interval_ms <= 0:
+                raise ValueError(f"interval_ms must be positive, got {interval_ms}")
+            self.sampler.interval = interval_ms / 1000
+
+    def is_enabled(self, tool: str) -> bool:
+        return bool(self.tools) and ("*" in self.tools or tool in self.tools)
+
+    @asynccontextmanager
+    async def profile(self, tool: str) -> AsyncIterator[None]:
+        """Sample the wrapped tool call if profiling is enabled for it."""
+        if not self.is_enabled(tool):
+            yield
+            return
+
+        recording = self.sampler.begin()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stacks = self.sampler.end(recording)
+            complete = self._record(tool, stacks, time.perf_counter() - started)
+            if complete is not None:
+                await asyncio.to_thread(self._write, tool, complete)  # Keep file I/O off the event loop
+
+    def _record(self, tool: str, stacks: Counter, elapsed: float) -> _PendingProfile | None:
+        """Add a call's samples; returns the aggregated profile once it has calls_per_file calls."""
+        with self._lock:
+            pending = self._pending.setdefault(tool, _PendingProfile())
+            pending.stacks.update(stacks)
+            pending.calls += 1
+            pending.elapsed += elapsed
+            if pending.calls < self.calls_per_file:
+                return None
+            del self._pending[tool]
+        return pending
+
+    def flush(self) -> list[str]:
+        """Write out partially aggregated profiles."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [path for tool, profile in pending.items() if (path := self._write(tool, profile))]
+
+    def _write(self, tool: str, profile: _PendingProfile) -> str | None:
+        if not profile.stacks:
+            return None
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        name = _UNSAFE_FILENAME_CHARACTERS.sub("_", tool)
+        path = self.output_dir / f"{name}-{timestamp}-{time.time_ns() % 1_000_000:06d}-{profile.calls}calls.folded"
+        if path.resolve().parent != self.output_dir.resolve():
+            logger.warning("Not writing profile for %r: path escapes %s", tool, self.output_dir)
+            return None
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            path.write_text("".join(f"{stack} {count}\n" for stack, count in sorted(profile.stacks.items())))
+        except OSError as e:
+            logger.warning("Could not write profile for %s: %s", tool, e)
+            return None
+
+        logger.info("Profiled %d call(s) of %s in %.3fs -> %s", profile.calls, tool, profile.elapsed, path)
+        with self._lock:
+            self.recent_files = ([str(path)] + self.recent_files)[:MAX_RECENT_PROFILES]
+        return str(path)
+
+    def status(self) -> dict[str, object]:
+        with self._lock:
+            pending = {tool: profile.calls for tool, profile in self._pending.items()}
+            recent = list(self.recent_files)
+        return {
+            "enabled": bool(self.tools),
+            "tools": sorted(self.tools),
+            "calls_per_file": self.calls_per_file,
+            "interval_ms": self.interval_ms,
+            "output_dir": str(self.output_dir),
+            "pending_calls": pending,
+            "recent_files": recent,
+        }
@@ -0,0 +1,333 @@
+"""
+YubiKey Provisioning - Manifest-driven bulk provisioning with checkpoint/resume.
+
+A manifest (CSV or JSONL) maps YubiKey serial numbers to their desired
+configuration. The pipeline streams the manifest, runs each device's stages
+concurrently with other attached devices, and records a checkpoint after
+every stage so an interrupted batch resumes where it left off.
+"""
+
+import asyncio
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterator
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+import capabilities
+
+# Directory for local server state (checkpoints, caches)
+STATE_DIRECTORY = Path(os.environ.get("YUBIKEY_MCP_STATE_DIR", Path.home() / ".yubikey-mcp"))
+DEFAULT_CHECKPOINT_PATH = STATE_DIRECTORY / "provisioning.db"
+
+
+# ============================================================================
+# Manifest
+# ============================================================================
+
+class ManifestEntry(BaseModel):
+    """Desired configuration for one YubiKey in a provisioning manifest.
+
+    CSV manifests use one column per field; list fields are separated by ";"
+    (e.g. "OATH;PIV") and touch policies use touch_sig/touch_enc/touch_aut/touch_att
+    columns. JSONL manifests use the field names directly.
+    """
+    serial: int
+    usb_enable: list[capabilities.ApplicationInput] = Field(default_factory=list)
+    usb_disable: list[capabilities.ApplicationInput] = Field(default_factory=list)
+    nfc_enable: list[capabilities.ApplicationInput] = Field(default_factory=list)
+    nfc_disable: list[capabilities.ApplicationInput] = Field(default_factory=list)
+    openpgp_name: str | None = None
+    openpgp_email: str | None = None
+    openpgp_comment: str | None = None
+    openpgp_key_type: str = "rsa2048"
+    openpgp_expiry_days: int = 0
+    touch_policies: dict[capabilities.TouchSlotInput, capabilities.TouchPolicyInput] = Field(default_factory=dict)
+    pin_retries: int | None = None
+    reset_code_retries: int | None = None
+    admin_pin_retries: int | None = None
+    admin_pin: str | None = None
+    pin: str | None = None
+
+    model_config = {"extra": "forbid"}
+
+    @field_validator("usb_enable", "usb_disable", "nfc_enable", "nfc_disable", mode="before")
+    @classmethod
+    def _split_list(cls, value: Any) -> Any:
+        if isinstance(value, str):
+            return [item.strip() for item in value.replace(",", ";").split(";") if item.strip()]
+        return value
+
+    @model_validator(mode="after")
+    def _check_retries(self) -> "ManifestEntry":
+        retries = (self.pin_retries, self.reset_code_retries, self.admin_pin_retries)
+        if any(r is not None for r in retries) and any(r is None for r in retries):
+            raise ValueError("pin_retries, reset_code_retries and admin_pin_retries must be set together")
+        return self
+
+
+def _from_csv_row(row: dict[str, str]) -> ManifestEntry:
+    fields: dict[str, Any] = {}
+    touch: dict[str, str] = {}
+    for key, value in row.items():
+        if key is None or value is None or not value.strip():
+            continue
+        key, value = key.strip(), value.strip()
+        if key.startswith("touch_"):
+            touch[key.removeprefix("touch_")] = value
+        else:
+            fields[key] = value
+    if touch:
+        fields["touch_policies"] = touch
+    return ManifestEntry.model_validate(fields)
+
+
+def read_manifest(path: str | Path) -> Iterator[ManifestEntry]:
+    """Stream entries from a CSV (.csv) or JSON Lines (.jsonl/.ndjson) manifest.
+
+    Entries are parsed lazily so arbitrarily large manifests are never held in
+    memory. Blank lines and lines starting with "#" are skipped in JSONL files.
+
+    Raises:
+        FileNotFoundError: If the manifest does not exist
+        ValueError: If the format is unsupported or an entry is invalid (includes the line number)
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+
+    with path.open(newline="", encoding="utf-8") as f:
+        if suffix == ".csv":
+            for line_number, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    yield _from_csv_row(row)
+                except ValueError as e:
+                    raise ValueError(f"{path.name} line {line_number}: {e}") from e
+        elif suffix in (".jsonl", ".ndjson"):
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    yield ManifestEntry.model_validate(json.loads(line))
+                except ValueError as e:
+                    raise ValueError(f"{path.name} line {line_number}: {e}") from e
+        else:
+            raise ValueError(f"Unsupported manifest format: {path.suffix}. Use .csv or .jsonl")
+
+
+# ============================================================================
+# Checkpoints
+# ============================================================================
+
+class CheckpointStore:
+    """SQLite-backed record of which stages have completed for each device.
+
+    Stage status is one of "done" or "failed". Only "done" stages are skipped
+    on resume; failed stages are retried.
+    """
+
+    def __init__(self, path: str | Path = DEFAULT_CHECKPOINT_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS checkpoints (
+                batch_id TEXT NOT NULL,
+                serial INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL,
+                detail TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (batch_id, serial, stage)
+            )"""
+        )
+        self._conn.commit()
+
+    def completed_stages(self, batch_id: str, serial: int) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage FROM checkpoints WHERE batch_id = ? AND serial = ? AND status = 'done'",
+                (batch_id, serial),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def record(self, batch_id: str, serial: int, stage: str, status: str, detail: str | None = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                (batch_id, serial, stage, status, detail, time.time()),
+            )
+            self._conn.commit()
+
+    def batch_status(self, batch_id: str) -> dict[int, dict[str, str]]:
+        """Return {serial: {stage: status}} for every checkpoint in a batch."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT serial, stage, status FROM checkpoints WHERE batch_id = ?",
+                (batch_id,),
+            ).fetchall()
+        status: dict[int, dict[str, str]] = {}
+        for serial, stage, stage_status in rows:
+            status.setdefault(serial, {})[stage] = stage_status
+        return status
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# ============================================================================
+# Pipeline
+# ============================================================================
+
+class StageError(Exception):
+    """Raised by a stage runner when a provisioning step fails."""
+
+
+@dataclass
+class Stage:
+    """One provisioning step.
+
+    Attributes:
+        name: Checkpoint name of the stage
+        applies: Returns True if the manifest entry asks for this stage
+        run: Performs the stage; raises StageError on failure, may return a detail string
+        exclusive: Run at most one instance at a time across all devices
+                   (e.g. GPG card-edit, which cannot target a card by serial)
+    """
+    name: str
+    applies: Callable[[ManifestEntry], bool]
+    run: Callable[[ManifestEntry], Awaitable[str | None]]
+    exclusive: bool = False
+
+
+@dataclass
+class BatchSummary:
+    """Outcome of one provisioning run."""
+    batch_id: str
+    completed: list[int] = field(default_factory=list)
+    failed: dict[int, str] = field(default_factory=dict)
+    not_attached: list[int] = field(default_factory=list)
+    already_done: list[int] = field(default_factory=list)
+    duplicates: list[int] = field(default_factory=list)
+    elapsed_seconds: float = 0.0
+
+    @property
+    def keys_per_hour(self) -> float:
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return len(self.completed) * 3600 / self.elapsed_seconds
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "batch_id": self.batch_id,
+            "completed": self.completed,
+            "failed": self.failed,
+            "not_attached": self.not_attached,
+            "already_done": self.already_done,
+            "duplicates": self.duplicates,
+            "elapsed_seconds": round(self.elapsed_seconds, 2),
+            "keys_per_hour": round(self.keys_per_hour, 1),
+        }
+
+
+class ProvisioningPipeline:
+    """Runs manifest entries through a list of stages with checkpointing.
+
+    Devices are provisioned concurrently by concurrency workers; stages for a
+    single device always run in order.
+    """
+
+    def __init__(self, stages: list[Stage], checkpoints: CheckpointStore, concurrency: int = 4):
+        self.stages = stages
+        self.checkpoints = checkpoints
+        self.concurrency = max(1, concurrency)
+        self._exclusive_lock = asyncio.Lock()
+
+    async def _provision_device(self, batch_id: str, entry: ManifestEntry, summary: BatchSummary) -> None:
+        done = self.checkpoints.completed_stages(batch_id, entry.serial)
+        pending = [stage for stage in self.stages if stage.applies(entry) and stage.name not in done]
+
+        if not pending:
+            summary.already_done.append(entry.serial)
+            return
+
+        for stage in pending:
+            try:
+                if stage.exclusive:
+                    async with self._exclusive_lock:
+                        detail = await stage.run(entry)
+                else:
+                    detail = await stage.run(entry)
+            except Exception as e:
+                # StageError, but also BusyError, CalledProcessError, ...: fail this device, not the batch
+                message = str(e) or type(e).__name__
+                self.checkpoints.record(batch_id, entry.serial, stage.name, "failed", message)
+                summary.failed[entry.serial] = f"{stage.name}: {message}"
+                return
+            self.checkpoints.record(batch_id, entry.serial, stage.name, "done", detail)
+
+        summary.completed.append(entry.serial)
+
+    async def run(
+        self,
+        batch_id: str,
+        entries: Iterator[ManifestEntry],
+        attached_serials: set[int]
+    ) -> BatchSummary:
+        """Provision every attached device listed in the manifest.
+
+        A fixed number of workers (concurrency) pull entries from the manifest
+        iterator, so only the entries being provisioned are held in memory.
+        Entries whose serial is not attached are reported in not_attached and
+        can be picked up by re-running the same batch once they are plugged in.
+
+        Raises:
+            ValueError: If the manifest is invalid (after in-flight devices finish and checkpoint)
+        """
+        summary = BatchSummary(batch_id=batch_id)
+        start = time.monotonic()
+        seen: set[int] = set()
+        manifest_errors: list[Exception] = []
+
+        def next_entry() -> ManifestEntry | None:
+            for entry in entries:
+                if entry.serial in seen:
+                    summary.duplicates.append(entry.serial)
+                    continue
+                seen.add(entry.serial)
+                if entry.serial not in attached_serials:
+                    summary.not_attached.append(entry.serial)
+                    continue
+                return entry
+            return None
+
+        async def worker() -> None:
+            while not manifest_errors:
+                try:
+                    entry = next_entry()
+                except ValueError as e:
+                    # Stop pulling new entries, but let already-started devices finish (and checkpoint)
+                    manifest_errors.append(e)
+                    return
+                if entry is None:
+                    return
+                await self._provision_device(batch_id, entry, summary)
+
+        results = await asyncio.gather(*(worker() for _ in range(self.concurrency)), return_exceptions=True)
+        summary.elapsed_seconds = time.monotonic() - start
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        if manifest_errors:
+            raise manifest_errors[0]
+        return summary
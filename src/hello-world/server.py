@@ -4,18 +4,85 @@ YubiKey MCP Server - Hello World
 A basic MCP server that lists connected YubiKeys.
 """
 
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import sqlite3
 import subprocess
-from typing import Any, Literal
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Literal
 
 import pexpect
-from pydantic import BaseModel, Field
+from pydantic import AnyUrl, BaseModel, Field
 from mcp.server.fastmcp import FastMCP, Context
+from mcp.server.fastmcp.exceptions import ToolError
+
+import admission
+import aggregator
+import attestation
+import audit_log
+import capabilities
+import credentials
+import device_agent
+import device_state
+import fido_credentials
+import otp_challenge
+import profiling
+import provisioning
+import session_trace
+import state_store
+import ykman_workers
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def server_lifespan(server: FastMCP) -> AsyncIterator[None]:
+    """Restore persisted device state, then watch for hot-plug events for as long as the server runs."""
+    global audit_trail, session_recorder, session_replay, hotplug_watcher
+    # Opened here rather than at import, so importing server.py never truncates a trace
+    session_recorder, session_replay = open_session_trace()
+    audit_trail = open_audit_log()
+    store = open_state_store()
+    if store is not None:
+        device_state_cache.restore(store)
+
+    hotplug_watcher = device_state.HotplugWatcher(
+        device_state_cache,
+        run_ykman_command,
+        use_scan=agent_aggregator is None and session_replay is None,
+        admit=admission_control.acquire
+    )
+    hotplug_watcher.start()
+    try:
+        yield
+    finally:
+        await hotplug_watcher.stop()
+        hotplug_watcher = None
+        otp_challenge_pool.close_all()
+        attestation.shutdown_verifiers()
+        if store is not None:
+            device_state_cache.store = None
+            store.close()
+        if session_recorder is not None:
+            session_recorder.close()
+        session_recorder = session_replay = None
+        if audit_trail is not None:
+            audit_trail.close()  # Writes out queued events
+            audit_trail = None
+
 
 # Initialize FastMCP server
-mcp = FastMCP("yubikey-hello-world")
+mcp = FastMCP("yubikey-hello-world", lifespan=server_lifespan)
 
 # Type aliases for response structures
-ResponseStatus = Literal["success", "error", "no_devices"]
+ResponseStatus = Literal["success", "error", "no_devices", "busy"]
 
 
 # ============================================================================
@@ -26,7 +93,8 @@ class YubiKeyResponse(BaseModel):
     """Standardized response structure for YubiKey operations.
 
     Attributes:
-        status: Response status code ("success", "error", or "no_devices")
+        status: Response status code ("success", "error", "no_devices", or "busy" -
+                retry after data.retry_after_ms)
         message: Human-readable status message
         command_executed: The ykman command that was executed (if applicable)
         serial_number: Serial number of the YubiKey that was operated on (if applicable)
@@ -51,10 +119,50 @@ class DeviceSelectionSchema(BaseModel):
     )
 
 
+class PinSchema(BaseModel):
+    """Schema for eliciting a PIN from user."""
+    pin: str = Field(
+        description="The PIN (it is cached in memory for this session only)"
+    )
+    remember_for_all_devices: bool = Field(
+        default=False,
+        description="Reuse this PIN for every YubiKey this session (e.g. factory-default PINs during batch provisioning)"
+    )
+
+
 # ============================================================================
 # Helper Functions
 # ============================================================================
 
+# Aggregator mode: route commands to device agents on other hosts (YUBIKEY_AGENTS=host:port,...)
+agent_aggregator = aggregator.Aggregator.from_env()
+
+
+# Concurrency limits for ykman/gpg processes (YUBIKEY_MAX_CONCURRENT, YUBIKEY_MAX_CONCURRENT_PER_DEVICE);
+# serial-less commands (e.g. `ykman list`) hold every attached device's slot
+admission_control = admission.AdmissionController(attached_serials=lambda: device_state_cache.inventory)
+
+
+def open_session_trace() -> tuple[session_trace.SessionRecorder | None, session_trace.SessionReplay | None]:
+    """Set up session recording (YUBIKEY_TRACE_RECORD) or replay (YUBIKEY_TRACE_REPLAY, YUBIKEY_TRACE_SPEED)."""
+    replay_path = os.environ.get("YUBIKEY_TRACE_REPLAY")
+    if replay_path:
+        replay = session_trace.SessionReplay(replay_path, speed=float(os.environ.get("YUBIKEY_TRACE_SPEED", "1.0")))
+        logger.info("Replaying %d recorded backend interactions from %s", len(replay.events), replay_path)
+        return None, replay
+    record_path = os.environ.get("YUBIKEY_TRACE_RECORD")
+    if record_path:
+        logger.info("Recording backend interactions to %s", record_path)
+        return session_trace.SessionRecorder(record_path), None
+    return None, None
+
+
+# Offline validation: record a real session's backend interactions, or replay one instead of hardware
+# (opened by server_lifespan)
+session_recorder: session_trace.SessionRecorder | None = None
+session_replay: session_trace.SessionReplay | None = None
+
+
 def run_ykman_command(args: list[str]) -> subprocess.CompletedProcess:
     """Execute a ykman command and return the result.
 
@@ -64,10 +172,30 @@ def run_ykman_command(args: list[str]) -> subprocess.CompletedProcess:
     Returns:
         CompletedProcess instance with stdout/stderr
 
+    In aggregator mode the command is routed to the device agent owning the
+    target serial. Otherwise, when YKMAN_WORKER_POOL_SIZE is set, it runs in
+    a warm ykman worker process instead of a freshly spawned `ykman`. With
+    YUBIKEY_TRACE_REPLAY set, it is answered from a recorded session instead.
+
     Raises:
         FileNotFoundError: If ykman is not installed
         subprocess.CalledProcessError: If command fails
     """
+    if session_replay is not None:
+        return session_replay.run(args)
+    if session_recorder is not None:
+        return session_recorder.run(_run_ykman_backend, args)
+    return _run_ykman_backend(args)
+
+
+def _run_ykman_backend(args: list[str]) -> subprocess.CompletedProcess:
+    if agent_aggregator is not None:
+        return agent_aggregator.run(args)
+
+    pool = ykman_workers.get_pool()
+    if pool is not None:
+        return pool.run(args)
+
     cmd = ["ykman"] + args
     return subprocess.run(
         cmd,
@@ -77,6 +205,15 @@ def run_ykman_command(args: list[str]) -> subprocess.CompletedProcess:
     )
 
 
+def spawn_gpg(command: str, **kwargs: Any) -> Any:
+    """Start an interactive gpg session (pexpect.spawn), recorded or replayed like ykman commands."""
+    if session_replay is not None:
+        return session_replay.spawn(command, **kwargs)
+    if session_recorder is not None:
+        return session_recorder.spawn(command, **kwargs)
+    return pexpect.spawn(command, **kwargs)
+
+
 def build_response(
     status: ResponseStatus,
     message: str,
@@ -108,6 +245,39 @@ def build_response(
     )
 
 
+# State-changing tools recorded in the audit log (filled by @audited)
+AUDITED_TOOLS: set[str] = set()
+
+
+def audited(tool: Callable[..., Awaitable[YubiKeyResponse]]) -> Callable[..., Awaitable[YubiKeyResponse]]:
+    """Record every call of a state-changing tool in the audit log.
+
+    Applied below @mcp.tool(), so calls made by other tools (e.g. the
+    provision_batch stages) are audited like calls from the client.
+    """
+    signature = inspect.signature(tool)
+    context_parameters = {name for name, parameter in signature.parameters.items() if parameter.annotation is Context}
+    AUDITED_TOOLS.add(tool.__name__)
+
+    @functools.wraps(tool)
+    async def wrapper(*args: Any, **kwargs: Any) -> YubiKeyResponse:
+        bound = signature.bind(*args, **kwargs)
+        arguments = {name: value for name, value in bound.arguments.items() if name not in context_parameters}
+        started = time.perf_counter()
+        try:
+            response = await tool(*args, **kwargs)
+        except admission.BusyError as e:
+            audit_tool_call(tool.__name__, arguments, "busy", None, str(e), started)
+            raise
+        except Exception as e:
+            audit_tool_call(tool.__name__, arguments, "error", None, str(e) or type(e).__name__, started)
+            raise
+        audit_tool_call(tool.__name__, arguments, response.status, response.serial_number, response.message, started)
+        return response
+
+    return wrapper
+
+
 async def prompt_for_device_selection(ctx: Context) -> int | None:
     """Prompt the user to select a YubiKey from a numbered list.
 
@@ -119,7 +289,8 @@ async def prompt_for_device_selection(ctx: Context) -> int | None:
     """
     try:
         # Get list of connected devices
-        result = run_ykman_command(["list"])
+        async with await admission_control.acquire(None):
+            result = await asyncio.to_thread(run_ykman_command, ["list"])
         devices = [line for line in result.stdout.strip().split('\n') if line]
 
         if not devices:
@@ -183,6 +354,7 @@ async def run_ykman_with_device_selection(
         subprocess.CalledProcessError: If command fails (includes full command in error)
         ValueError: If user cancels device selection or no device selected
         FileNotFoundError: If ykman is not installed
+        admission.BusyError: If the device or server is at its concurrency limit and the wait queue is full
     """
     # Build command with serial if provided
     full_args = []
@@ -199,11 +371,26 @@ async def run_ykman_with_device_selection(
             return f'"{arg}"'
         return arg
 
-    full_command = "ykman " + " ".join(quote_arg(arg) for arg in full_args)
+    # Never echo PINs/keys back to the agent: mask the value following a secret option
+    secret_options = {"--pin", "--admin-pin", "--new-pin", "--management-key", "--password"}
+    display_args = [
+        "****" if i > 0 and full_args[i - 1] in secret_options else arg
+        for i, arg in enumerate(full_args)
+    ]
 
+    full_command = "ykman " + " ".join(quote_arg(arg) for arg in display_args)
+
+    started = time.perf_counter()
     try:
         await ctx.info(f"Executing: {full_command}")
-        result = run_ykman_command(full_args)
+        # Run off the event loop so concurrent tool calls (and batch pipelines) don't serialize on ykman,
+        # but no more at once than the device and the PC/SC stack can handle
+        slot = await admission_control.acquire(resolve_cached_serial(serial_number))
+        try:
+            result = await asyncio.to_thread(run_ykman_command, full_args)
+        finally:
+            slot.release()
+        record_operation(actual_serial, full_command, "success", started=started)
         return result, full_command, actual_serial
 
     except subprocess.CalledProcessError as e:
@@ -222,19 +409,201 @@ async def run_ykman_with_device_selection(
                 ctx, args, selected_serial, retry_on_multiple=False
             )
 
+        record_operation(actual_serial, full_command, "error", error_msg, started)
+
         # Enhance error message with full command
         enhanced_error = f"Command failed: {full_command}\nError: {error_msg}"
 
         # Create a new exception with enhanced message
         new_error = subprocess.CalledProcessError(
             e.returncode,
-            ["ykman"] + full_args,
+            ["ykman"] + display_args,
             output=e.output,
             stderr=enhanced_error
         )
         raise new_error
 
 
+def parse_applications(info_text: str) -> dict[str, dict[str, str]]:
+    """Parse the applications table from `ykman info` output.
+
+    The info output contains a table like:
+        Applications    USB             NFC
+        Yubico OTP      Enabled         Enabled
+        FIDO U2F        Enabled         Not available
+        ...
+
+    Returns:
+        {"usb": {app_name: status}, "nfc": {app_name: status}}
+    """
+    return capabilities.parse_application_table(info_text)
+
+
+# ============================================================================
+# Device State
+# ============================================================================
+
+# Last-known inventory and per-device state, shared by tools and resources
+device_state_cache = device_state.DeviceStateCache()
+
+# Set by server_lifespan; resolve_cached_serial() trusts the inventory only once it has polled
+hotplug_watcher: device_state.HotplugWatcher | None = None
+
+resource_subscriptions = device_state.SubscriptionRegistry()
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _publish_state_change(change: device_state.StateChange) -> None:
+    """Push resource notifications to subscribers without blocking the caller."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(resource_subscriptions.notify(change))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+device_state_cache.add_listener(_publish_state_change)
+
+
+def open_state_store() -> state_store.StateStore | None:
+    """Open the persistent state store (YUBIKEY_STATE_DB, empty to disable)."""
+    path = os.environ.get("YUBIKEY_STATE_DB", str(provisioning.STATE_DIRECTORY / "state.db"))
+    if not path:
+        return None
+    try:
+        return state_store.StateStore(path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("State store unavailable (%s), starting without persisted state", e)
+        return None
+
+
+def record_operation(
+    serial_number: int | None,
+    command: str,
+    status: str,
+    detail: str | None = None,
+    started: float | None = None
+) -> None:
+    """Append a ykman operation to the persistent history (command must already be masked)."""
+    store = device_state_cache.store
+    if store is None:
+        return
+    duration_ms = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+    store.record_operation(resolve_cached_serial(serial_number), command, status, detail, duration_ms)
+
+
+def resolve_cached_serial(serial_number: int | None) -> int | None:
+    """Return the serial a command ran against, falling back to the only known device.
+
+    The fallback is only used once the hot-plug watcher has confirmed the
+    inventory; a restored or unpolled inventory may name a device that is no
+    longer attached. Use resolve_target_serial() to ask ykman instead.
+    """
+    if serial_number is not None:
+        return serial_number
+    confirmed = hotplug_watcher is not None and hotplug_watcher.confirmed
+    if confirmed and len(device_state_cache.inventory) == 1:
+        return next(iter(device_state_cache.inventory))
+    return None
+
+
+def record_device_info(serial_number: int | None, info_text: str) -> None:
+    """Cache `ykman info` output (and the derived application table) for a device."""
+    serial = resolve_cached_serial(serial_number)
+    if serial is not None:
+        device_state_cache.set(serial, "info", info_text)
+        device_state_cache.set(serial, "applications", parse_applications(info_text))
+
+
+def cached_capabilities(serial_number: int | None) -> capabilities.Capabilities | None:
+    """Capabilities from the cached `ykman info` of a device, or None if it was never read.
+
+    Stale entries are still used: model, firmware and available applications
+    don't change when a write tool modifies the device.
+    """
+    serial = resolve_cached_serial(serial_number)
+    cached = device_state_cache.get(serial, "info") if serial is not None else None
+    if cached is None:
+        return None
+    return capabilities.capabilities_from_info(cached.value)
+
+
+def invalidate_device_state(serial_number: int | None, kinds: tuple[device_state.StateKind, ...] = device_state.STATE_KINDS) -> None:
+    """Mark cached state stale after a write so subscribers re-read it."""
+    serial = resolve_cached_serial(serial_number)
+    if serial is not None:
+        device_state_cache.invalidate(serial, kinds)
+
+
+# ============================================================================
+# Credentials
+# ============================================================================
+
+# PINs obtained through elicitation, reused by later calls in this session
+credential_cache = credentials.CredentialCache()
+_elicitation_lock = asyncio.Lock()
+
+
+def _purge_removed_device_credentials(change: device_state.StateChange) -> None:
+    for serial in change.removed:
+        credential_cache.purge(serial)
+
+
+device_state_cache.add_listener(_purge_removed_device_credentials)
+
+
+def is_pin_rejection(error: Exception) -> bool:
+    """True if a failed command reports a wrong or blocked PIN (ykman explains why in stderr)."""
+    return "PIN" in f"{error} {getattr(error, 'stderr', None) or ''}"
+
+
+async def resolve_credential(
+    ctx: Context,
+    serial_number: int | None,
+    pin_type: credentials.PinType,
+    provided: str | None = None
+) -> str:
+    """Return a PIN from the argument, the session cache, or by asking the user.
+
+    Elicited PINs are cached per serial (or for every device if the user chooses),
+    so subsequent calls - including batch operations - don't prompt again.
+
+    Raises:
+        ValueError: If the user declines to provide the PIN
+    """
+    if provided:
+        return provided
+
+    serial = resolve_cached_serial(serial_number)
+    cached = credential_cache.get(serial, pin_type)
+    if cached is not None:
+        return cached
+
+    # One prompt at a time; a concurrent call may have cached the PIN while we waited
+    async with _elicitation_lock:
+        cached = credential_cache.get(serial, pin_type)
+        if cached is not None:
+            return cached
+
+        label = credentials.PIN_TYPE_LABELS[pin_type]
+        device = f" for YubiKey (Serial: {serial})" if serial is not None else ""
+        elicit_result = await ctx.elicit(
+            message=f"Please enter the {label}{device}:",
+            schema=PinSchema
+        )
+
+        if elicit_result.action != "accept" or not elicit_result.data:
+            raise ValueError(f"{label} was not provided. Operation cancelled.")
+
+        if elicit_result.data.remember_for_all_devices:
+            credential_cache.put(None, pin_type, elicit_result.data.pin)
+        elif serial is not None:
+            credential_cache.put(serial, pin_type, elicit_result.data.pin)
+        return elicit_result.data.pin
+
+
 # ============================================================================
 # MCP Tools
 # ============================================================================
@@ -254,10 +623,12 @@ async def list_yubikeys() -> YubiKeyResponse:
             - data.count: Number of devices found (if successful)
     """
     try:
-        result = run_ykman_command(["list"])
+        async with await admission_control.acquire(None):
+            result = await asyncio.to_thread(run_ykman_command, ["list"])
 
         # Parse output - each non-empty line is a device
         devices = [line for line in result.stdout.strip().split('\n') if line]
+        device_state_cache.update_inventory(devices)
 
         if not devices:
             return build_response(
@@ -326,6 +697,8 @@ async def get_yubikey_info(
                 info=None
             )
 
+        record_device_info(actual_serial, info_text)
+
         return build_response(
             "success",
             "Successfully retrieved YubiKey information",
@@ -342,6 +715,39 @@ async def get_yubikey_info(
         return build_response("error", str(e), info=None)
 
 
+@mcp.tool()
+async def list_device_agents() -> YubiKeyResponse:
+    """List the device agents this server aggregates and the YubiKeys on each host.
+
+    Only applies when the server runs in aggregator mode (YUBIKEY_AGENTS is set);
+    tool calls are then routed to the host that owns the target serial number.
+
+    Returns:
+        YubiKeyResponse with:
+            - status: "success", "error", or "no_devices"
+            - message: Human-readable status message
+            - data.agents: List of {agent, address, reachable, devices, error}
+    """
+    if agent_aggregator is None:
+        return build_response(
+            "error",
+            "Server is not running in aggregator mode",
+            suggested_next_action="Set YUBIKEY_AGENTS=host:port,... (and YUBIKEY_AGENT_TOKEN) to aggregate device agents",
+            agents=[]
+        )
+
+    agents = await asyncio.to_thread(agent_aggregator.status)
+    reachable = sum(1 for agent in agents if agent["reachable"])
+    devices = sum(len(agent["devices"]) for agent in agents)
+
+    return build_response(
+        "success" if devices else "no_devices",
+        f"{reachable} of {len(agents)} agent(s) reachable, {devices} YubiKey(s) in total",
+        suggested_next_action="Use 'list_yubikeys' for the merged inventory; tools route to the owning host automatically" if devices else None,
+        agents=agents
+    )
+
+
 @mcp.tool()
 async def hello_yubikey() -> str:
     """Say hello and check YubiKey availability."""
@@ -363,11 +769,12 @@ async def hello_yubikey() -> str:
 # ============================================================================
 
 @mcp.tool()
+@audited
 async def configure_yubikey_applications(
     ctx: Context,
-    transport: str,
-    enable_applications: list[str] | None = None,
-    disable_applications: list[str] | None = None,
+    transport: capabilities.TransportInput,
+    enable_applications: list[capabilities.ApplicationInput] | None = None,
+    disable_applications: list[capabilities.ApplicationInput] | None = None,
     serial_number: int | None = None
 ) -> YubiKeyResponse:
     """Enable or disable YubiKey applications over USB or NFC.
@@ -393,11 +800,9 @@ async def configure_yubikey_applications(
         # Disable OTP over USB
         configure_yubikey_applications(transport="usb", disable_applications=["OATH", "PIV", "FIDO2", "OTP", "U2F", "OPENPGP", "HSMAUTH"])
     """
-    if transport.lower() not in ["usb", "nfc"]:
-        return build_response(
-            "error",
-            f"Invalid transport: {transport}. Must be 'usb' or 'nfc'."
-        )
+    # Argument validation accepts any case ("USB", "oath") and normalizes it to what ykman expects
+    enable_applications = list(enable_applications or [])
+    disable_applications = list(disable_applications or [])
 
     if not enable_applications and not disable_applications:
         return build_response(
@@ -405,25 +810,37 @@ async def configure_yubikey_applications(
             "Must specify at least one application to enable or disable"
         )
 
+    device_capabilities = cached_capabilities(serial_number)
+    if device_capabilities is not None:
+        reason = capabilities.check_configure(
+            device_capabilities, transport, enable_applications + disable_applications
+        )
+        if reason:
+            return build_response(
+                "error",
+                reason,
+                suggested_next_action="Use 'get_yubikey_capabilities' to see what this YubiKey supports",
+                serial_number=resolve_cached_serial(serial_number)
+            )
+
     try:
         force="--force"
-        args = ["config", transport.lower()]
+        args = ["config", transport]
 
         # Add enable flags - each app needs its own --enable flag
-        if enable_applications:
-            for app in enable_applications:
-                args.append("--enable")
-                args.append(app.upper())
+        for app in enable_applications:
+            args.append("--enable")
+            args.append(app)
 
         # Add disable flags - each app needs its own --disable flag
-        if disable_applications:
-            for app in disable_applications:
-                args.append("--disable")
-                args.append(app.upper())
+        for app in disable_applications:
+            args.append("--disable")
+            args.append(app)
 
         args.append(force)
 
         result, command, actual_serial = await run_ykman_with_device_selection(ctx, args, serial_number)
+        invalidate_device_state(actual_serial, ("info", "applications"))
 
         enabled_msg = f"enabled {', '.join(enable_applications)}" if enable_applications else ""
         disabled_msg = f"disabled {', '.join(disable_applications)}" if disable_applications else ""
@@ -475,41 +892,8 @@ async def list_yubikey_applications(
                 applications=None
             )
 
-        # Parse the info output to extract application status
-        # The info output contains a table like:
-        # Applications    USB             NFC
-        # Yubico OTP      Enabled         Enabled
-        # FIDO U2F        Enabled         Enabled
-        # ...
-
-        applications = {"usb": {}, "nfc": {}}
-        in_app_section = False
-
-        for line in info_text.split('\n'):
-            line = line.strip()
-
-            # Detect the applications table header
-            if line.startswith("Applications"):
-                in_app_section = True
-                continue
-
-            # Skip empty lines
-            if not line:
-                in_app_section = False
-                continue
-
-            # Parse application status lines
-            if in_app_section and line:
-                parts = line.split()
-                if len(parts) >= 3:
-                    # Handle multi-word app names (e.g., "Yubico OTP", "FIDO U2F")
-                    # The last two parts are USB and NFC status
-                    nfc_status = parts[-1]
-                    usb_status = parts[-2]
-                    app_name = " ".join(parts[:-2])
-
-                    applications["usb"][app_name] = usb_status
-                    applications["nfc"][app_name] = nfc_status
+        applications = parse_applications(info_text)
+        record_device_info(actual_serial, info_text)
 
         return build_response(
             "success",
@@ -525,11 +909,97 @@ async def list_yubikey_applications(
         return build_response("error", str(e), applications=None)
 
 
+@mcp.tool()
+async def get_yubikey_capabilities(
+    ctx: Context,
+    serial_number: int | None = None
+) -> YubiKeyResponse:
+    """Show which applications, OpenPGP touch slots and touch policies a YubiKey supports.
+
+    Derived from the model, firmware version and form factor in `ykman info`.
+    Uses the cached device information when available, so it does not touch
+    the device again. Config and OpenPGP tools check these capabilities before
+    running ykman and reject unsupported requests with the reason shown here.
+
+    Args:
+        serial_number: Optional serial number of the YubiKey to query. If not provided
+                      and only one YubiKey is connected, that device will be used.
+
+    Returns:
+        YubiKeyResponse with:
+            - data.capabilities: model, firmware, form_factor, nfc, applications per transport,
+              openpgp_touch_slots, openpgp_touch_policies, and unsupported (feature -> reason)
+    """
+    device_capabilities = cached_capabilities(serial_number)
+    command = None
+    actual_serial = resolve_cached_serial(serial_number)
+
+    if device_capabilities is None:
+        try:
+            result, command, actual_serial = await run_ykman_with_device_selection(ctx, ["info"], serial_number)
+        except (ValueError, subprocess.CalledProcessError, FileNotFoundError) as e:
+            return build_response("error", str(e), capabilities=None)
+        record_device_info(actual_serial, result.stdout.strip())
+        device_capabilities = capabilities.capabilities_from_info(result.stdout.strip())
+
+    return build_response(
+        "success",
+        f"Capabilities of {device_capabilities.profile.model}",
+        suggested_next_action="Use 'configure_yubikey_applications' or 'set_openpgp_touch_policy' with one of the supported options",
+        command_executed=command,
+        serial_number=actual_serial,
+        capabilities=device_capabilities.to_dict()
+    )
+
+
 # ============================================================================
 # OpenPGP Tools
 # ============================================================================
 
+def gpg_card_serial(card_status: str) -> int | None:
+    """Serial number of the card in `gpg --card-status` / `--card-edit` output (YubiKeys report their device serial)."""
+    match = re.search(r"^Serial number\s*\.*:\s*(\d+)\s*$", card_status or "", re.MULTILINE)
+    return int(match.group(1)) if match else None
+
+
+def list_local_serials() -> list[int]:
+    """Serials of the YubiKeys attached to this host; in aggregator mode, not the fleet (GPG only sees local cards)."""
+    if agent_aggregator is None:
+        result = run_ykman_command(["list", "--serials"])
+    else:
+        result = device_agent.run_local_ykman(["list", "--serials"])
+    return [int(line) for line in result.stdout.split() if line.strip().isdigit()]
+
+
+async def ensure_gpg_card(card_status: str, serial_number: int | None) -> None:
+    """Check that gpg selected the intended YubiKey before changing anything on the card.
+
+    Raises:
+        ValueError: If gpg selected another card, or the card cannot be identified
+                    while more than one YubiKey is attached
+    """
+    card_serial = gpg_card_serial(card_status)
+    if card_serial is not None and serial_number is not None:
+        if card_serial != serial_number:
+            raise ValueError(
+                f"GPG selected the card with serial {card_serial}, not YubiKey {serial_number}; "
+                "unplug the other YubiKeys or run the operation again"
+            )
+        return
+
+    # Runs under the caller's gpg slot, which already covers this device (or, serial-less, every device)
+    serials = await asyncio.to_thread(list_local_serials)
+    if len(serials) != 1:
+        raise ValueError(
+            f"Could not confirm which card GPG selected and {len(serials)} YubiKeys are attached; "
+            "attach only the target YubiKey"
+        )
+    if serial_number is not None and serials[0] != serial_number:
+        raise ValueError(f"The attached YubiKey is {serials[0]}, not {serial_number}")
+
+
 @mcp.tool()
+@audited
 async def generate_openpgp_key(
     ctx: Context,
     name: str,
@@ -538,7 +1008,7 @@ async def generate_openpgp_key(
     comment: str | None = None,
     expiry_days: int = 0,
     admin_pin: str = "12345678",
-    pin: str = "123456",
+    pin: str | None = None,
     serial_number: int | None = None
 ) -> YubiKeyResponse:
     """Generate an OpenPGP key pair on the YubiKey.
@@ -557,7 +1027,8 @@ async def generate_openpgp_key(
         comment: Optional comment for the key
         expiry_days: Number of days until key expires (0 = no expiration, default)
         admin_pin: Admin PIN for OpenPGP (default is "12345678" for factory reset keys)
-        pin: User PIN for OpenPGP (default is "123456" for factory reset keys)
+        pin: User PIN for OpenPGP (if not provided, uses the session PIN cache or asks the user;
+             the factory default is "123456")
         serial_number: Optional serial number of the YubiKey to use
 
     Returns:
@@ -589,6 +1060,10 @@ async def generate_openpgp_key(
             "Both 'name' and 'email' are required for key generation"
         )
 
+    gpg_slot: admission.Slot | None = None
+    child = None
+    pin_from_cache = False
+    actual_serial = None
     try:
         # First, verify the YubiKey is accessible
         result, ykman_cmd, actual_serial = await run_ykman_with_device_selection(
@@ -596,6 +1071,16 @@ async def generate_openpgp_key(
         )
 
         await ctx.info(f"YubiKey detected (serial: {actual_serial})")
+        if agent_aggregator is not None and actual_serial not in await asyncio.to_thread(list_local_serials):
+            return build_response(
+                "error",
+                f"YubiKey {actual_serial} is not attached to this host; OpenPGP key generation uses the local GPG "
+                "and cannot be routed to a device agent",
+                suggested_next_action="Generate the key on the host the YubiKey is attached to",
+                serial_number=actual_serial
+            )
+        pin_from_cache = pin is None
+        pin = await resolve_credential(ctx, actual_serial, "openpgp_pin", pin)
         await ctx.info(f"Starting key generation for {key_type}...")
         await ctx.info("⚠️  This process may take 1-2 minutes. Please be patient and don't remove the YubiKey.")
 
@@ -610,42 +1095,43 @@ async def generate_openpgp_key(
         # Start GPG card-edit session
         await ctx.info("Starting GPG card-edit session...")
 
-        # Build GPG command with card selection if we have a serial
+        # gpg --card-edit cannot select a card by serial; scdaemon picks one, so check it below
         gpg_cmd = "gpg --card-edit"
-        if actual_serial:
-            # GPG uses serial in hex format with "D2760001240" prefix
-            gpg_cmd = f"gpg --card-edit"  # Note: GPG auto-selects if only one card
 
-        child = pexpect.spawn(gpg_cmd, timeout=180, encoding='utf-8')
+        # The GPG session holds the card for its whole dialogue
+        gpg_slot = await admission_control.acquire(resolve_cached_serial(actual_serial))
+        child = spawn_gpg(gpg_cmd, timeout=180, encoding='utf-8')
         child.logfile_read = None  # We'll log manually for security
+        # Expect with async_=True so the event loop keeps serving other calls while GPG waits on the card
 
         await ctx.info(f"Executing: {gpg_cmd}")
 
-        # Wait for the gpg/card> prompt
-        child.expect('gpg/card>')
+        # Wait for the gpg/card> prompt; the card status printed before it names the selected card
+        await child.expect('gpg/card>', async_=True)
+        await ensure_gpg_card(child.before, actual_serial)
         await ctx.info("Connected to card")
 
         # Enter admin mode
         child.sendline('admin')
-        child.expect('gpg/card>')
+        await child.expect('gpg/card>', async_=True)
         await ctx.info("Entered admin mode")
 
         # Start key generation
         child.sendline('generate')
 
         # Handle "make off-card backup" prompt
-        idx = child.expect(['Make off-card backup', 'gpg/card>', pexpect.TIMEOUT])
+        idx = await child.expect(['Make off-card backup', 'gpg/card>', pexpect.TIMEOUT], async_=True)
         if idx == 0:
             child.sendline('n')  # No backup
             await ctx.info("Declined off-card backup (keys stay on YubiKey only)")
 
         # Wait for "overwrite existing keys" or continue
-        idx = child.expect(['Do you want to overwrite', 'Please specify how long', 'Please enter the PIN', pexpect.TIMEOUT])
+        idx = await child.expect(['Do you want to overwrite', 'Please specify how long', 'Please enter the PIN', pexpect.TIMEOUT], async_=True)
 
         if idx == 0:
             # Keys already exist
             child.sendline('n')
-            child.expect('gpg/card>')
+            await child.expect('gpg/card>', async_=True)
             child.sendline('quit')
             child.close()
 
@@ -660,29 +1146,29 @@ async def generate_openpgp_key(
         if idx == 2 or child.buffer.find('Please enter the PIN') >= 0:
             child.sendline(pin)
             await ctx.info("Sent user PIN")
-            child.expect(['Please specify how long', 'Invalid PIN'])
+            await child.expect(['Please specify how long', 'Invalid PIN'], async_=True)
 
         # Key expiry
         child.sendline(expiry_str)
         await ctx.info(f"Set key expiry: {'no expiration' if expiry_days == 0 else f'{expiry_days} days'}")
 
         # Real name
-        child.expect('Real name:')
+        await child.expect('Real name:', async_=True)
         child.sendline(name)
         await ctx.info(f"Set name: {name}")
 
         # Email
-        child.expect('Email address:')
+        await child.expect('Email address:', async_=True)
         child.sendline(email)
         await ctx.info(f"Set email: {email}")
 
         # Comment
-        child.expect('Comment:')
+        await child.expect('Comment:', async_=True)
         child.sendline(comment or '')
         await ctx.info(f"Set comment: {comment or '(none)'}")
 
         # Confirm
-        idx = child.expect(['Change \\(N\\)ame', 'Okay', pexpect.TIMEOUT])
+        idx = await child.expect(['Change \\(N\\)ame', 'Okay', pexpect.TIMEOUT], async_=True)
         if idx == 0:
             child.sendline('O')  # Okay
 
@@ -690,19 +1176,24 @@ async def generate_openpgp_key(
         await ctx.info("🔑 Generating keys on YubiKey... This will take 1-2 minutes.")
         await ctx.info("💡 You may need to touch your YubiKey if touch policy is enabled.")
 
-        child.expect('gpg/card>', timeout=180)  # Key generation can take a while
+        await child.expect('gpg/card>', timeout=180, async_=True)  # Key generation can take a while
 
         await ctx.info("✅ Key generation complete!")
 
         # Quit GPG
         child.sendline('quit')
         child.close()
+        gpg_slot.release()
 
         # Get the new key info
         result, info_cmd, _ = await run_ykman_with_device_selection(
             ctx, ["openpgp", "info"], actual_serial
         )
         key_info = result.stdout.strip()
+        invalidate_device_state(actual_serial, ("openpgp",))
+        serial = resolve_cached_serial(actual_serial)
+        if serial is not None:
+            device_state_cache.set(serial, "openpgp", key_info)
 
         return build_response(
             "success",
@@ -716,19 +1207,27 @@ async def generate_openpgp_key(
         )
 
     except pexpect.TIMEOUT as e:
+        if pin_from_cache and actual_serial is not None:
+            # A wrong cached PIN stalls the GPG dialogue; don't reuse it
+            credential_cache.discard(actual_serial, "openpgp_pin")
         return build_response(
             "error",
             f"GPG command timed out. The key generation process may have stalled. Last output: {e.value if hasattr(e, 'value') else 'N/A'}",
-            serial_number=actual_serial if 'actual_serial' in locals() else None
+            serial_number=actual_serial
         )
     except pexpect.EOF:
         return build_response(
             "error",
             "GPG session ended unexpectedly. Make sure gnupg is installed and the YubiKey is connected.",
-            serial_number=actual_serial if 'actual_serial' in locals() else None
+            serial_number=actual_serial
         )
     except (ValueError, subprocess.CalledProcessError, FileNotFoundError) as e:
         return build_response("error", str(e))
+    finally:
+        if child is not None:
+            child.close()
+        if gpg_slot is not None:
+            gpg_slot.release()
 
 
 @mcp.tool()
@@ -765,6 +1264,10 @@ async def get_openpgp_info(
                 info=None
             )
 
+        serial = resolve_cached_serial(actual_serial)
+        if serial is not None:
+            device_state_cache.set(serial, "openpgp", info_text)
+
         return build_response(
             "success",
             "Successfully retrieved OpenPGP application information",
@@ -779,10 +1282,11 @@ async def get_openpgp_info(
 
 
 @mcp.tool()
+@audited
 async def set_openpgp_touch_policy(
     ctx: Context,
-    key_slot: str,
-    policy: str,
+    key_slot: capabilities.TouchSlotInput,
+    policy: capabilities.TouchPolicyInput,
     admin_pin: str | None = None,
     serial_number: int | None = None
 ) -> YubiKeyResponse:
@@ -801,7 +1305,8 @@ async def set_openpgp_touch_policy(
                - "fixed": Touch required, cannot be disabled without deleting key
                - "cached": Touch required, cached for 15s after use
                - "cached-fixed": Touch required, cached for 15s, cannot be disabled
-        admin_pin: Admin PIN for OpenPGP (if not provided, will be prompted)
+        admin_pin: Admin PIN for OpenPGP (if not provided, uses the session PIN cache
+                   or asks the user)
         serial_number: Optional serial number of the YubiKey to configure
 
     Returns:
@@ -817,31 +1322,28 @@ async def set_openpgp_touch_policy(
         # Set fixed touch policy (cannot be undone without deleting key)
         set_openpgp_touch_policy(key_slot="enc", policy="fixed", admin_pin="12345678")
     """
-    # Validate key slot
-    valid_slots = ["sig", "enc", "aut", "att"]
-    if key_slot.lower() not in valid_slots:
-        return build_response(
-            "error",
-            f"Invalid key slot: {key_slot}. Must be one of: {', '.join(valid_slots)}"
-        )
-
-    # Validate policy
-    valid_policies = ["on", "off", "fixed", "cached", "cached-fixed"]
-    if policy.lower() not in valid_policies:
-        return build_response(
-            "error",
-            f"Invalid policy: {policy}. Must be one of: {', '.join(valid_policies)}"
-        )
+    device_capabilities = cached_capabilities(serial_number)
+    if device_capabilities is not None:
+        reason = capabilities.check_touch_policy(device_capabilities, key_slot, policy)
+        if reason:
+            return build_response(
+                "error",
+                reason,
+                suggested_next_action="Use 'get_yubikey_capabilities' to see what this YubiKey supports",
+                serial_number=resolve_cached_serial(serial_number)
+            )
 
+    admin_pin_from_cache = admin_pin is None
+    serial = None
     try:
-        args = ["openpgp", "keys", "set-touch", key_slot.lower(), policy.lower(), "--force"]
-
-        # Add admin PIN if provided
-        if admin_pin:
-            args.extend(["--admin-pin", admin_pin])
+        serial = await resolve_target_serial(ctx, serial_number)
+        admin_pin = await resolve_credential(ctx, serial, "openpgp_admin_pin", admin_pin)
+        args = ["openpgp", "keys", "set-touch", key_slot, policy, "--force"]
+        args.extend(["--admin-pin", admin_pin])
 
         args.append("--force")
-        result, command, actual_serial = await run_ykman_with_device_selection(ctx, args, serial_number)
+        result, command, actual_serial = await run_ykman_with_device_selection(ctx, args, serial)
+        invalidate_device_state(actual_serial, ("openpgp",))
 
         return build_response(
             "success",
@@ -852,11 +1354,16 @@ async def set_openpgp_touch_policy(
             output=result.stdout.strip() if result.stdout else None
         )
 
-    except (ValueError, subprocess.CalledProcessError, FileNotFoundError) as e:
-        return build_response("error", str(e))
+    except subprocess.CalledProcessError as e:
+        if admin_pin_from_cache and serial is not None and is_pin_rejection(e):
+            credential_cache.discard(serial, "openpgp_admin_pin")
+        return build_response("error", str(e), serial_number=serial)
+    except (ValueError, FileNotFoundError) as e:
+        return build_response("error", str(e), serial_number=serial)
 
 
 @mcp.tool()
+@audited
 async def set_openpgp_pin_retries(
     ctx: Context,
     pin_retries: int,
@@ -875,7 +1382,7 @@ async def set_openpgp_pin_retries(
         pin_retries: Number of retry attempts for the User PIN (1-127)
         reset_code_retries: Number of retry attempts for the Reset Code (1-127)
         admin_pin_retries: Number of retry attempts for the Admin PIN (1-127)
-        admin_pin: Current Admin PIN (if not provided, will be prompted)
+        admin_pin: Current Admin PIN (if not provided, uses the session PIN cache or asks the user)
         serial_number: Optional serial number of the YubiKey to configure
 
     Returns:
@@ -901,7 +1408,17 @@ async def set_openpgp_pin_retries(
     if not (1 <= admin_pin_retries <= 127):
         return build_response("error", f"Admin PIN retries must be between 1 and 127, got {admin_pin_retries}")
 
+    device_capabilities = cached_capabilities(serial_number)
+    if device_capabilities is not None:
+        reason = capabilities.check_pin_retries(device_capabilities)
+        if reason:
+            return build_response("error", reason, serial_number=resolve_cached_serial(serial_number))
+
+    admin_pin_from_cache = admin_pin is None
+    serial = None
     try:
+        serial = await resolve_target_serial(ctx, serial_number)
+        admin_pin = await resolve_credential(ctx, serial, "openpgp_admin_pin", admin_pin)
         args = [
             "openpgp", "access", "set-retries",
             str(pin_retries),
@@ -909,13 +1426,11 @@ async def set_openpgp_pin_retries(
             str(admin_pin_retries),
             "--force"
         ]
-
-        # Add admin PIN if provided
-        if admin_pin:
-            args.extend(["--admin-pin", admin_pin])
+        args.extend(["--admin-pin", admin_pin])
 
         args.append("--force")
-        result, command, actual_serial = await run_ykman_with_device_selection(ctx, args, serial_number)
+        result, command, actual_serial = await run_ykman_with_device_selection(ctx, args, serial)
+        invalidate_device_state(actual_serial, ("openpgp",))
 
         return build_response(
             "success",
@@ -926,8 +1441,931 @@ async def set_openpgp_pin_retries(
             output=result.stdout.strip() if result.stdout else None
         )
 
+    except subprocess.CalledProcessError as e:
+        if admin_pin_from_cache and serial is not None and is_pin_rejection(e):
+            credential_cache.discard(serial, "openpgp_admin_pin")
+        return build_response("error", str(e), serial_number=serial)
+    except (ValueError, FileNotFoundError) as e:
+        return build_response("error", str(e), serial_number=serial)
+
+
+# ============================================================================
+# FIDO2 Tools
+# ============================================================================
+
+# Discoverable credential listings per serial, behind a PIN token session (YUBIKEY_FIDO_CACHE_TTL seconds)
+fido_credential_cache = fido_credentials.FidoCredentialCache(
+    ttl=float(os.environ.get("YUBIKEY_FIDO_CACHE_TTL", "300"))
+)
+
+
+def _drop_removed_device_fido_listings(change: device_state.StateChange) -> None:
+    for serial in change.removed:
+        fido_credential_cache.drop(serial)
+
+
+device_state_cache.add_listener(_drop_removed_device_fido_listings)
+
+
+async def resolve_target_serial(ctx: Context, serial_number: int | None) -> int:
+    """Serial of the device a command should target, prompting if several are attached.
+
+    Uses the watcher-confirmed inventory when possible, otherwise `ykman list --serials`.
+
+    Raises:
+        ValueError: If no YubiKey is attached or the user cancels the selection
+    """
+    serial = resolve_cached_serial(serial_number)
+    if serial is not None:
+        return serial
+
+    async with await admission_control.acquire(None):
+        result = await asyncio.to_thread(run_ykman_command, ["list", "--serials"])
+    serials = [int(line) for line in result.stdout.split() if line.strip().isdigit()]
+    if len(serials) == 1:
+        return serials[0]
+    if not serials:
+        raise ValueError("No YubiKey with a serial number detected")
+    selected = await prompt_for_device_selection(ctx)
+    if selected is None:
+        raise ValueError("Operation cancelled or no device selected")
+    return selected
+
+
+def _fido_credential_source(serial: int, pin: str) -> fido_credentials.CredentialSource:
+    """Stream over CTAP2 locally; fall back to the ykman CLI (and device agents in aggregator mode).
+
+    Session traces capture ykman commands only, so recording and replay also use the CLI.
+    """
+    tracing = session_recorder is not None or session_replay is not None
+    if fido_credentials.list_all_devices is not None and agent_aggregator is None and not tracing:
+        return fido_credentials.CtapCredentialSource(serial, pin)
+    return fido_credentials.CliCredentialSource(run_ykman_command, serial, pin)
+
+
+@mcp.tool()
+async def list_fido2_credentials(
+    ctx: Context,
+    cursor: str | None = None,
+    page_size: int = fido_credentials.DEFAULT_PAGE_SIZE,
+    refresh: bool = False,
+    pin: str | None = None,
+    serial_number: int | None = None
+) -> YubiKeyResponse:
+    """List discoverable (resident) FIDO2 credentials (passkeys), one page at a time.
+
+    The first call authenticates with the FIDO2 PIN and starts enumerating the
+    credentials; each page only reads as many credentials from the YubiKey as it
+    returns. The enumeration is cached per YubiKey, so following pages (and
+    repeated listings) don't rescan the key. Pass next_cursor from the previous
+    response to get the next page.
+
+    Args:
+        cursor: next_cursor from the previous page (omit for the first page)
+        page_size: Credentials per page (1-100, default 20)
+        refresh: Discard the cached enumeration and start over from the device
+        pin: FIDO2 PIN (if not provided, uses the session PIN cache or asks the user)
+        serial_number: Optional serial number of the YubiKey to query
+
+    Returns:
+        YubiKeyResponse with:
+            - data.credentials: credential_id, rp_id, user_name, user_display_name, user_id
+            - data.next_cursor: Cursor for the next page, or null on the last page
+            - data.total: Number of credentials on the key (null until known)
+            - data.complete: Whether the whole key has been enumerated
+
+    Example:
+        page = list_fido2_credentials(page_size=25)
+        next_page = list_fido2_credentials(cursor=page.data["next_cursor"], page_size=25)
+    """
+    if not 1 <= page_size <= fido_credentials.MAX_PAGE_SIZE:
+        return build_response("error", f"page_size must be between 1 and {fido_credentials.MAX_PAGE_SIZE}, got {page_size}")
+
+    if refresh:
+        cursor = None
+
+    pin_from_cache = pin is None
+    serial = None
+    try:
+        serial = await resolve_target_serial(ctx, serial_number)
+        listing = None if refresh else fido_credential_cache.get(serial)
+        if listing is None:
+            if cursor is not None and not refresh:
+                return build_response(
+                    "error",
+                    "The cached credential listing expired; start again without a cursor",
+                    serial_number=serial
+                )
+            pin = await resolve_credential(ctx, serial, "fido2_pin", pin)
+            listing = fido_credential_cache.put(serial, _fido_credential_source(serial, pin))
+
+        async with await admission_control.acquire(serial):
+            page = await asyncio.to_thread(listing.page, cursor, page_size)
+
+    except fido_credentials.CredentialListingError as e:
+        if serial is not None:
+            fido_credential_cache.drop(serial)
+            if pin_from_cache and is_pin_rejection(e):
+                credential_cache.discard(serial, "fido2_pin")
+        return build_response("error", str(e), serial_number=serial)
     except (ValueError, subprocess.CalledProcessError, FileNotFoundError) as e:
-        return build_response("error", str(e))
+        return build_response("error", str(e), serial_number=serial)
+
+    return build_response(
+        "success",
+        f"Returned {len(page.credentials)} credential(s)" + (f" of {page.total}" if page.total is not None else ""),
+        suggested_next_action=(
+            "Call list_fido2_credentials again with cursor=next_cursor for more" if page.next_cursor
+            else "Use 'delete_fido2_credential' with a credential_id to remove a passkey"
+        ),
+        serial_number=serial,
+        credentials=[credential.to_dict() for credential in page.credentials],
+        next_cursor=page.next_cursor,
+        total=page.total,
+        complete=page.complete
+    )
+
+
+@mcp.tool()
+@audited
+async def delete_fido2_credential(
+    ctx: Context,
+    credential_id: str,
+    pin: str | None = None,
+    serial_number: int | None = None
+) -> YubiKeyResponse:
+    """Delete a discoverable (resident) FIDO2 credential.
+
+    Uses the cached listing (and its PIN token session) when one exists, so the
+    listing stays valid without a rescan; otherwise deletes through ykman.
+
+    Args:
+        credential_id: Credential ID from list_fido2_credentials (a unique prefix is enough)
+        pin: FIDO2 PIN (if not provided, uses the session PIN cache or asks the user)
+        serial_number: Optional serial number of the YubiKey
+
+    Returns:
+        YubiKeyResponse with data.deleted (the full credential ID and its relying party)
+    """
+    pin_from_cache = pin is None
+    serial = None
+    try:
+        serial = await resolve_target_serial(ctx, serial_number)
+        listing = fido_credential_cache.get(serial)
+        matches = listing.find(credential_id) if listing is not None else []
+
+        if len(matches) > 1:
+            return build_response(
+                "error",
+                f"Multiple credentials match '{credential_id}'; use a longer credential ID",
+                serial_number=serial
+            )
+
+        if len(matches) == 1:
+            async with await admission_control.acquire(serial):
+                await asyncio.to_thread(listing.delete, matches[0].credential_id)
+            record_operation(serial, f"fido credentials delete {matches[0].credential_id}", "success")
+            return build_response(
+                "success",
+                f"Deleted credential for {matches[0].rp_id} ({matches[0].user_name})",
+                suggested_next_action="Use 'list_fido2_credentials' to see the remaining credentials",
+                serial_number=serial,
+                deleted=matches[0].to_dict()
+            )
+
+        pin = await resolve_credential(ctx, serial, "fido2_pin", pin)
+        result, command, _ = await run_ykman_with_device_selection(
+            ctx, ["fido", "credentials", "delete", credential_id, "--pin", pin, "--force"], serial
+        )
+        fido_credential_cache.drop(serial)  # Listing (if any) didn't know this credential
+        return build_response(
+            "success",
+            f"Deleted credential {credential_id}",
+            suggested_next_action="Use 'list_fido2_credentials' to see the remaining credentials",
+            command_executed=command,
+            serial_number=serial,
+            deleted={"credential_id": credential_id},
+            output=result.stdout.strip() if result.stdout else None
+        )
+
+    except fido_credentials.CredentialListingError as e:
+        return build_response("error", str(e), serial_number=serial)
+    except subprocess.CalledProcessError as e:
+        if pin_from_cache and serial is not None and is_pin_rejection(e):
+            credential_cache.discard(serial, "fido2_pin")
+        return build_response("error", str(e), serial_number=serial)
+    except (ValueError, FileNotFoundError) as e:
+        return build_response("error", str(e), serial_number=serial)
+
+
+# ============================================================================
+# OTP Tools
+# ============================================================================
+
+def _otp_uses_hid() -> bool:
+    """Hold an OTP (HID) connection locally; fall back to the ykman CLI (device agents, session traces)."""
+    tracing = session_recorder is not None or session_replay is not None
+    return otp_challenge.list_all_devices is not None and agent_aggregator is None and not tracing
+
+
+def _otp_challenge_backend(serial: int) -> otp_challenge.ChallengeBackend:
+    if _otp_uses_hid():
+        return otp_challenge.HidChallengeBackend(serial)
+    return otp_challenge.CliChallengeBackend(run_ykman_command, serial)
+
+
+# One challenge-response worker per serial, closed after YUBIKEY_OTP_IDLE_TIMEOUT seconds unused
+otp_challenge_pool = otp_challenge.ChallengeResponsePool(
+    _otp_challenge_backend, idle_timeout=float(os.environ.get("YUBIKEY_OTP_IDLE_TIMEOUT", "60"))
+)
+
+
+def _drop_removed_device_otp_workers(change: device_state.StateChange) -> None:
+    for serial in change.removed:
+        otp_challenge_pool.drop(serial)
+
+
+device_state_cache.add_listener(_drop_removed_device_otp_workers)
+
+
+@mcp.tool()
+async def calculate_hmac_challenges(
+    ctx: Context,
+    challenges: list[str],
+    slot: Literal[1, 2] = 2,
+    touch_timeout: float = otp_challenge.DEFAULT_TOUCH_TIMEOUT,
+    serial_number: int | None = None
+) -> YubiKeyResponse:
+    """Answer a batch of HMAC-SHA1 challenges with an OTP challenge-response slot.
+
+    The YubiKey's OTP connection stays open between calls and the whole batch
+    is queued to the key at once, so challenges are answered back to back
+    without starting ykman for each one. If the slot requires touch, the user is
+    asked to touch the key; calls for other YubiKeys keep running meanwhile.
+
+    Args:
+        challenges: Hex-encoded challenges (1-64 bytes each, up to 256 per call)
+        slot: OTP slot programmed for HMAC-SHA1 challenge-response (1 or 2)
+        touch_timeout: Seconds to wait for a touch per challenge, if the slot requires touch
+        serial_number: Optional serial number of the YubiKey
+
+    Returns:
+        YubiKeyResponse with:
+            - data.results: Per challenge, in order: challenge, response (hex, null on error),
+              latency_ms (from submission), device_ms (time on the key), touched, error
+            - data.succeeded / data.failed: Counts
+            - data.elapsed_ms: Time for the whole batch
+
+    Example:
+        calculate_hmac_challenges(challenges=["0011223344", "5566778899"], slot=2)
+    """
+    serial = None
+    try:
+        decoded = otp_challenge.parse_challenges(challenges)
+        serial = await resolve_target_serial(ctx, serial_number)
+
+        loop = asyncio.get_running_loop()
+        prompted = False
+
+        def on_touch() -> None:
+            nonlocal prompted
+            if not prompted:
+                prompted = True
+                loop.call_soon_threadsafe(
+                    lambda: asyncio.ensure_future(ctx.info(f"Touch YubiKey {serial} to answer the challenge"))
+                )
+
+        # In-process HID work doesn't need a global process slot; touch waits then only hold this device
+        started = time.perf_counter()
+        async with await admission_control.acquire(serial, global_slot=not _otp_uses_hid()):
+            results = await otp_challenge_pool.calculate(serial, slot, decoded, touch_timeout, on_touch)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+    except (ValueError, subprocess.CalledProcessError, FileNotFoundError, otp_challenge.ChallengeResponseError) as e:
+        return build_response("error", str(e), serial_number=serial)
+
+    failed = sum(1 for result in results if result.error is not None)
+    record_operation(
+        serial, f"otp calculate {slot} ({len(results)} challenges)", "error" if failed else "success",
+        f"{failed} failed" if failed else None, started
+    )
+    return build_response(
+        "success" if failed < len(results) else "error",
+        f"Answered {len(results) - failed} of {len(results)} challenge(s) in {elapsed_ms:.0f} ms",
+        suggested_next_action=(
+            f"Check that slot {slot} is programmed for HMAC-SHA1 challenge-response" if failed else None
+        ),
+        serial_number=serial,
+        results=[result.to_dict() for result in results],
+        succeeded=len(results) - failed,
+        failed=failed,
+        elapsed_ms=round(elapsed_ms, 1)
+    )
+
+
+# ============================================================================
+# Credential Tools
+# ============================================================================
+
+@mcp.tool()
+async def clear_credential_cache(serial_number: int | None = None) -> YubiKeyResponse:
+    """Zeroize and forget PINs cached in this session.
+
+    PINs entered through prompts are cached in memory (per YubiKey and PIN type)
+    so multi-step workflows don't ask again. They expire automatically after a
+    TTL or number of uses, and when the YubiKey is unplugged.
+
+    Args:
+        serial_number: Only clear PINs for this YubiKey. If not provided, clears all cached PINs.
+
+    Returns:
+        YubiKeyResponse with:
+            - status: "success"
+            - data.cleared: Number of cached PINs removed
+            - data.remaining: Remaining cache entries (PIN type, expiry, uses left - never the PIN itself)
+    """
+    cleared = credential_cache.purge(serial_number)
+    target = f"YubiKey (Serial: {serial_number})" if serial_number is not None else "all YubiKeys"
+    return build_response(
+        "success",
+        f"Cleared {cleared} cached PIN(s) for {target}",
+        serial_number=serial_number,
+        cleared=cleared,
+        remaining=credential_cache.summary()
+    )
+
+
+# ============================================================================
+# Attestation Tools
+# ============================================================================
+
+@mcp.tool()
+async def verify_fleet_attestation(
+    ctx: Context,
+    serial_numbers: list[int] | None = None,
+    piv_slots: list[str] | None = None,
+    openpgp_keys: list[str] | None = None,
+    openpgp_pin: str | None = None,
+    ca_directory: str | None = None
+) -> YubiKeyResponse:
+    """Verify that PIV and OpenPGP keys across many YubiKeys were generated on-device.
+
+    Collects attestation certificates from every selected YubiKey, then verifies
+    each chain (attestation cert -> device attestation CA -> Yubico CAs) against
+    a cached set of trusted CA certificates. Verification runs in parallel.
+
+    Args:
+        serial_numbers: YubiKeys to check. Defaults to every connected YubiKey.
+        piv_slots: PIV slots to attest (default: ["9a", "9c", "9d", "9e"])
+        openpgp_keys: OpenPGP keys to attest (default: ["sig", "enc", "aut"] when
+                      openpgp_pin is given, otherwise none)
+        openpgp_pin: User PIN, required by ykman to attest OpenPGP keys
+        ca_directory: Directory holding trusted Yubico root/intermediate CA certificates.
+                      Defaults to $YUBIKEY_ATTESTATION_CA_DIR or ./attestation_ca
+
+    Returns:
+        YubiKeyResponse with:
+            - status: "error" if keys failed to verify and none verified, "no_devices", otherwise "success"
+            - message: Summary of verified, failed and keyless devices
+            - data.report: Per-serial results ({serial: {"verified": bool | None, "keys": [...],
+              "not_present": ["piv:9e", ...]}}); empty slots are listed, not failed, and
+              "verified" is None for a device with no key in any requested slot
+            - data.verified_count / data.failed_count: Number of devices passing/failing
+            - data.without_keys_serials: Devices with none of the requested keys
+
+    Example:
+        # Attest PIV signature key on every connected YubiKey
+        verify_fleet_attestation(piv_slots=["9c"], openpgp_keys=[])
+    """
+    piv_slots = ["9a", "9c", "9d", "9e"] if piv_slots is None else piv_slots
+    if openpgp_keys is None:
+        openpgp_keys = ["sig", "enc", "aut"] if openpgp_pin else []
+
+    targets = [("piv", slot.lower()) for slot in piv_slots]
+    targets += [("openpgp", key.lower()) for key in openpgp_keys]
+    if not targets:
+        return build_response("error", "Must specify at least one PIV slot or OpenPGP key to attest")
+
+    try:
+        verifier = attestation.get_verifier(ca_directory)
+    except (FileNotFoundError, ValueError) as e:
+        return build_response(
+            "error",
+            f"Could not load trusted CA certificates: {e}",
+            suggested_next_action="Download the Yubico attestation CA certificates from https://developers.yubico.com/PKI/ into the CA directory"
+        )
+
+    try:
+        if serial_numbers is None:
+            async with await admission_control.acquire(None):
+                result = await asyncio.to_thread(run_ykman_command, ["list", "--serials"])
+            serial_numbers = [int(line) for line in result.stdout.split() if line.strip()]
+
+        if not serial_numbers:
+            return build_response("no_devices", "No YubiKeys detected", report={})
+
+        await ctx.info(f"Collecting attestations from {len(serial_numbers)} YubiKey(s)...")
+        records = await attestation.collect_fleet_attestations(
+            run_ykman_command, serial_numbers, targets, openpgp_pin,
+            admit=admission_control.acquire, max_parallel=admission_control.global_limit
+        )
+
+        await ctx.info(f"Verifying {len(records)} attestation chain(s)...")
+        results = await verifier.verify(records)
+        report = attestation.build_report(results)
+
+        verified = sorted(serial for serial, entry in report.items() if entry["verified"] is True)
+        failed = sorted(serial for serial, entry in report.items() if entry["verified"] is False)
+        without_keys = sorted(serial for serial, entry in report.items() if entry["verified"] is None)
+
+        message = f"Attestation verified for {len(verified)} of {len(report)} YubiKey(s)"
+        if failed:
+            message += f", failed for {len(failed)}"
+        if without_keys:
+            message += f"; {len(without_keys)} had no key in the requested slots"
+        return build_response(
+            "error" if failed and not verified else "success",
+            message,
+            suggested_next_action="Inspect data.report for the reason each failed key did not verify" if failed else None,
+            report=report,
+            verified_serials=verified,
+            failed_serials=failed,
+            without_keys_serials=without_keys,
+            verified_count=len(verified),
+            failed_count=len(failed)
+        )
+
+    except (ValueError, subprocess.CalledProcessError, FileNotFoundError) as e:
+        return build_response("error", str(e), report={})
+
+
+
+# ============================================================================
+# Provisioning Tools
+# ============================================================================
+
+def _require_success(response: YubiKeyResponse) -> str:
+    """Turn a tool response into a stage result, raising StageError on failure."""
+    if response.status != "success":
+        raise provisioning.StageError(response.message)
+    return response.message
+
+
+def build_provisioning_stages(ctx: Context) -> list[provisioning.Stage]:
+    """Map manifest fields onto the existing configuration tools, in execution order."""
+
+    async def usb_applications(entry: provisioning.ManifestEntry) -> str:
+        return _require_success(await configure_yubikey_applications(
+            ctx, "usb", entry.usb_enable or None, entry.usb_disable or None, entry.serial
+        ))
+
+    async def nfc_applications(entry: provisioning.ManifestEntry) -> str:
+        return _require_success(await configure_yubikey_applications(
+            ctx, "nfc", entry.nfc_enable or None, entry.nfc_disable or None, entry.serial
+        ))
+
+    async def pin_retries(entry: provisioning.ManifestEntry) -> str:
+        return _require_success(await set_openpgp_pin_retries(
+            ctx, entry.pin_retries, entry.reset_code_retries, entry.admin_pin_retries,
+            admin_pin=entry.admin_pin, serial_number=entry.serial
+        ))
+
+    async def openpgp_key(entry: provisioning.ManifestEntry) -> str:
+        return _require_success(await generate_openpgp_key(
+            ctx, entry.openpgp_name, entry.openpgp_email,
+            key_type=entry.openpgp_key_type,
+            comment=entry.openpgp_comment,
+            expiry_days=entry.openpgp_expiry_days,
+            admin_pin=entry.admin_pin or "12345678",
+            pin=entry.pin,
+            serial_number=entry.serial
+        ))
+
+    async def touch_policies(entry: provisioning.ManifestEntry) -> str:
+        for slot, policy in entry.touch_policies.items():
+            _require_success(await set_openpgp_touch_policy(
+                ctx, slot, policy, admin_pin=entry.admin_pin, serial_number=entry.serial
+            ))
+        return f"Set touch policies: {entry.touch_policies}"
+
+    return [
+        provisioning.Stage("usb_applications", lambda e: bool(e.usb_enable or e.usb_disable), usb_applications),
+        provisioning.Stage("nfc_applications", lambda e: bool(e.nfc_enable or e.nfc_disable), nfc_applications),
+        provisioning.Stage("openpgp_pin_retries", lambda e: e.pin_retries is not None, pin_retries),
+        # GPG card-edit cannot select a card by serial: key generation runs one device at a time and
+        # generate_openpgp_key refuses to continue if gpg picked a card other than entry.serial
+        provisioning.Stage("openpgp_key", lambda e: bool(e.openpgp_name and e.openpgp_email), openpgp_key, exclusive=True),
+        provisioning.Stage("openpgp_touch", lambda e: bool(e.touch_policies), touch_policies),
+    ]
+
+
+@mcp.tool()
+async def provision_batch(
+    ctx: Context,
+    manifest_path: str,
+    batch_id: str | None = None,
+    concurrency: int = 4,
+    checkpoint_path: str | None = None
+) -> YubiKeyResponse:
+    """Provision many YubiKeys from a manifest, resuming from checkpoints.
+
+    Streams a CSV or JSONL manifest mapping serial numbers to desired configuration
+    and provisions every attached YubiKey listed in it. Devices are processed
+    concurrently; stages for one device run in order (USB apps, NFC apps, PIN
+    retries, OpenPGP key, touch policies). Each completed stage is checkpointed,
+    so re-running the same batch after a crash or unplug skips finished work.
+
+    Args:
+        manifest_path: Path to a .csv or .jsonl manifest. Fields: serial, usb_enable,
+                       usb_disable, nfc_enable, nfc_disable, openpgp_name, openpgp_email,
+                       openpgp_comment, openpgp_key_type, openpgp_expiry_days,
+                       touch_policies (CSV: touch_sig/touch_enc/touch_aut/touch_att),
+                       pin_retries, reset_code_retries, admin_pin_retries, admin_pin, pin
+        batch_id: Checkpoint namespace (default: manifest file name without extension)
+        concurrency: Maximum number of devices provisioned at once (default 4)
+        checkpoint_path: SQLite checkpoint file (default: ~/.yubikey-mcp/provisioning.db)
+
+    Returns:
+        YubiKeyResponse with:
+            - status: "success", "error", or "no_devices"
+            - message: Summary of the run
+            - data.completed / data.failed / data.not_attached / data.already_done: Serials by outcome
+            - data.keys_per_hour: Throughput of this run
+
+    Example:
+        # manifest.jsonl: {"serial": 16021303, "usb_disable": ["OTP"], "touch_policies": {"sig": "on"}}
+        provision_batch(manifest_path="/path/to/manifest.jsonl")
+    """
+    batch_id = batch_id or Path(manifest_path).stem
+
+    try:
+        async with await admission_control.acquire(None):
+            result = await asyncio.to_thread(run_ykman_command, ["list", "--serials"])
+        attached = {int(line) for line in result.stdout.split() if line.strip()}
+        if not attached:
+            return build_response("no_devices", "No YubiKeys detected", batch_id=batch_id)
+
+        checkpoints = provisioning.CheckpointStore(checkpoint_path or provisioning.DEFAULT_CHECKPOINT_PATH)
+        try:
+            pipeline = provisioning.ProvisioningPipeline(
+                build_provisioning_stages(ctx), checkpoints, concurrency
+            )
+            await ctx.info(f"Provisioning batch '{batch_id}' across {len(attached)} attached YubiKey(s)...")
+            summary = await pipeline.run(batch_id, provisioning.read_manifest(manifest_path), attached)
+        finally:
+            checkpoints.close()
+
+        if summary.failed:
+            next_action = "Fix the failed devices and re-run provision_batch with the same batch_id to resume"
+        elif summary.not_attached:
+            next_action = "Attach the remaining devices and re-run provision_batch with the same batch_id"
+        else:
+            next_action = None
+
+        return build_response(
+            "success",
+            f"Batch '{batch_id}': {len(summary.completed)} provisioned, {len(summary.failed)} failed, "
+            f"{len(summary.not_attached)} not attached ({summary.keys_per_hour:.1f} keys/hour)",
+            suggested_next_action=next_action,
+            **summary.to_dict()
+        )
+
+    except (ValueError, subprocess.CalledProcessError, FileNotFoundError, sqlite3.Error) as e:
+        return build_response("error", str(e), batch_id=batch_id)
+
+
+# ============================================================================
+# Diagnostics Tools
+# ============================================================================
+
+# Opt-in sampling profiler for tool calls (YUBIKEY_PROFILE_TOOLS=* or a comma-separated list)
+tool_profiler = profiling.ToolProfiler.from_env(provisioning.STATE_DIRECTORY / "profiles")
+
+
+# Hash-chained audit log of AUDITED_TOOLS calls (YUBIKEY_AUDIT_DIR); opened by the server lifespan
+audit_trail: audit_log.AuditLog | None = None
+
+
+def open_audit_log() -> audit_log.AuditLog | None:
+    """Open the audit log (YUBIKEY_AUDIT_DIR, empty to disable; YUBIKEY_AUDIT_KEY keys the hash chain)."""
+    directory = os.environ.get("YUBIKEY_AUDIT_DIR", str(provisioning.STATE_DIRECTORY / "audit"))
+    if not directory:
+        return None
+    key = os.environ.get("YUBIKEY_AUDIT_KEY")
+    try:
+        return audit_log.AuditLog(
+            directory,
+            max_segment_bytes=int(os.environ.get("YUBIKEY_AUDIT_MAX_BYTES", str(audit_log.DEFAULT_MAX_SEGMENT_BYTES))),
+            key=key.encode() if key else None
+        )
+    except (OSError, ValueError) as e:
+        logger.warning("Audit log unavailable (%s), state-changing calls will not be audited", e)
+        return None
+
+
+def audit_tool_call(
+    name: str,
+    arguments: dict[str, Any],
+    status: str,
+    serial_number: int | None,
+    message: str | None,
+    started: float
+) -> None:
+    """Enqueue an audit event for a state-changing tool call (no I/O here)."""
+    if audit_trail is None:
+        return
+    audit_trail.record(
+        name,
+        status,
+        arguments,
+        serial_number=serial_number or arguments.get("serial_number"),
+        message=message,
+        duration_ms=(time.perf_counter() - started) * 1000
+    )
+
+
+@mcp.tool()
+async def verify_audit_log() -> YubiKeyResponse:
+    """Verify the hash chain of the audit log of state-changing calls.
+
+    Every call of configure_yubikey_applications, generate_openpgp_key,
+    set_openpgp_touch_policy, set_openpgp_pin_retries and delete_fido2_credential
+    is appended to a hash-chained log (PINs masked). This checks that no record
+    was modified, removed (including from the end) or reordered.
+
+    Returns:
+        YubiKeyResponse with:
+            - data.verification: valid, records, segments, torn_records, last_seq, last_hash,
+              anchored_seq and error (segment, line and reason of the first broken record)
+            - data.writer: Queue and group-commit statistics of the running writer
+    """
+    if audit_trail is None:
+        return build_response("error", "The audit log is disabled (YUBIKEY_AUDIT_DIR is empty or unwritable)")
+
+    await asyncio.to_thread(audit_trail.flush)
+    result = await asyncio.to_thread(audit_log.verify, audit_trail.directory, audit_trail.key)
+    return build_response(
+        "success" if result["valid"] else "error",
+        f"Audit log intact: {result['records']} record(s) in {result['segments']} segment(s)" if result["valid"]
+        else f"Audit log chain broken at {result['error']['segment']} line {result['error']['line']}: {result['error']['reason']}",
+        verification=result,
+        writer=audit_trail.status()
+    )
+
+
+@mcp.tool()
+async def configure_profiling(
+    tools: list[str] | None = None,
+    calls_per_file: int | None = None,
+    interval_ms: float | None = None,
+    flush: bool = False
+) -> YubiKeyResponse:
+    """Turn the sampling profiler on or off for tool calls, and list recent profiles.
+
+    While enabled, each call of a selected tool is sampled every interval_ms and
+    written as a folded-stack file (render with flamegraph.pl, speedscope or inferno).
+    Call without arguments to see the current settings.
+
+    Args:
+        tools: Tool names to profile, ["*"] for every tool, or [] to disable profiling
+        calls_per_file: Aggregate this many calls of a tool into each file (1 = one file per call)
+        interval_ms: Sampling interval in milliseconds (default 5)
+        flush: Write out profiles that have not yet reached calls_per_file
+
+    Returns:
+        YubiKeyResponse with:
+            - data.profiling: enabled, tools, calls_per_file, interval_ms, output_dir,
+              pending_calls and recent_files
+            - data.flushed: Files written by flush (if requested)
+
+    Example:
+        # Profile every call of two slow tools, one flame graph per 10 calls
+        configure_profiling(tools=["get_openpgp_info", "set_openpgp_touch_policy"], calls_per_file=10)
+    """
+    try:
+        # Both may write profile files (disabling flushes partial profiles); keep that off the event loop
+        await asyncio.to_thread(tool_profiler.configure, tools, calls_per_file, interval_ms)
+    except ValueError as e:
+        return build_response("error", str(e), profiling=tool_profiler.status())
+
+    flushed = await asyncio.to_thread(tool_profiler.flush) if flush else []
+    status = tool_profiler.status()
+    return build_response(
+        "success",
+        f"Profiling {'enabled for ' + ', '.join(status['tools']) if status['enabled'] else 'disabled'}",
+        suggested_next_action="Render a .folded file with flamegraph.pl or open it in speedscope" if status["recent_files"] else None,
+        profiling=status,
+        flushed=flushed
+    )
+
+
+@mcp.tool()
+async def get_admission_status() -> YubiKeyResponse:
+    """Show concurrency limits, queue depths and wait times for YubiKey access.
+
+    Every ykman and gpg invocation takes a per-device and a global slot. Calls
+    that find a full queue, or wait longer than the deadline, get a "busy"
+    response with retry_after_ms.
+
+    Returns:
+        YubiKeyResponse with:
+            - data.limits: global, per_device, max_queue, max_wait_seconds
+            - data.global / data.devices: in_flight, queued, max_queued, admitted,
+              rejected_queue_full, rejected_timeout, wait_ms_avg, wait_ms_p95, hold_ms_avg
+    """
+    status = admission_control.status()
+    queued = status["global"]["queued"] + sum(gate["queued"] for gate in status["devices"].values())
+    return build_response(
+        "success",
+        f"{status['global']['in_flight']} operation(s) running, {queued} queued",
+        **status
+    )
+
+
+@mcp.tool()
+async def get_operation_history(
+    serial_number: int | None = None,
+    status: Literal["success", "error"] | None = None,
+    since_minutes: float | None = None,
+    limit: int = 50
+) -> YubiKeyResponse:
+    """Query the persistent history of ykman operations, newest first.
+
+    History survives server restarts (stored with the cached device state in
+    YUBIKEY_STATE_DB). Commands are recorded with PINs and keys masked.
+
+    Args:
+        serial_number: Only operations on this YubiKey
+        status: Only successful ("success") or failed ("error") operations
+        since_minutes: Only operations from the last N minutes
+        limit: Maximum number of operations to return (default 50)
+
+    Returns:
+        YubiKeyResponse with:
+            - data.operations: serial_number, command, status, detail, duration_ms, at (Unix time)
+            - data.known_devices: Every YubiKey seen by this server, attached or not
+    """
+    store = device_state_cache.store
+    if store is None:
+        return build_response("error", "Operation history is disabled (YUBIKEY_STATE_DB is empty or the store could not be opened)")
+
+    since = time.time() - since_minutes * 60 if since_minutes is not None else None
+    operations = await asyncio.to_thread(store.history, serial_number, since, status, max(1, limit))
+    known_devices = await asyncio.to_thread(store.known_devices) if serial_number is None else None
+    return build_response(
+        "success",
+        f"Found {len(operations)} operation(s)",
+        serial_number=serial_number,
+        operations=operations,
+        known_devices=known_devices
+    )
+
+
+# ============================================================================
+# MCP Resources
+# ============================================================================
+
+_revalidating: set[tuple[int, device_state.StateKind]] = set()
+
+
+async def _revalidate_device_state(serial: int, kind: device_state.StateKind) -> None:
+    try:
+        await refresh_device_state(serial, kind, allow_restored=False)
+    except (subprocess.CalledProcessError, FileNotFoundError, admission.BusyError) as e:
+        # The entry stays restored, so the next read schedules another attempt
+        logger.debug("Could not revalidate %s for YubiKey %s: %s", kind, serial, e)
+    finally:
+        _revalidating.discard((serial, kind))
+
+
+async def refresh_device_state(
+    serial: int,
+    kind: device_state.StateKind,
+    allow_restored: bool = True
+) -> device_state.CachedValue:
+    """Return cached state for a device, re-reading it with ykman if missing or stale.
+
+    State restored from the previous run is returned immediately and
+    revalidated in the background; subscribers are notified if it changed.
+    """
+    cached = device_state_cache.get(serial, kind)
+    if cached is not None and not cached.stale:
+        return cached
+
+    if allow_restored and cached is not None and cached.restored:
+        if (serial, kind) not in _revalidating:
+            _revalidating.add((serial, kind))
+            task = asyncio.create_task(_revalidate_device_state(serial, kind))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        return cached
+
+    args = ["openpgp", "info"] if kind == "openpgp" else ["info"]
+    async with await admission_control.acquire(serial):
+        result = await asyncio.to_thread(run_ykman_command, ["--device", str(serial)] + args)
+    if kind == "openpgp":
+        device_state_cache.set(serial, "openpgp", result.stdout.strip())
+    else:
+        record_device_info(serial, result.stdout.strip())
+
+    return device_state_cache.get(serial, kind)
+
+
+async def read_device_resource(serial: str, kind: device_state.StateKind) -> str:
+    try:
+        cached = await refresh_device_state(int(serial), kind)
+    except subprocess.CalledProcessError as e:
+        error_msg = e.stderr.strip() if e.stderr else str(e)
+        raise ValueError(f"Could not read {kind} for YubiKey {serial}: {error_msg}") from e
+
+    return json.dumps({
+        "serial_number": int(serial),
+        "updated_at": cached.updated_at,
+        "stale": cached.stale,
+        kind: cached.value,
+    })
+
+
+@mcp.resource(device_state.DEVICES_URI, mime_type="application/json")
+async def devices_resource() -> str:
+    """Connected YubiKeys, kept current by the hot-plug watcher."""
+    if device_state_cache.inventory_updated_at is None:
+        async with await admission_control.acquire(None):
+            result = await asyncio.to_thread(run_ykman_command, ["list"])
+        device_state_cache.update_inventory([line for line in result.stdout.strip().split('\n') if line])
+
+    return json.dumps({
+        "devices": device_state_cache.inventory_lines,
+        "serial_numbers": sorted(device_state_cache.inventory),
+        "updated_at": device_state_cache.inventory_updated_at,
+    })
+
+
+@mcp.resource("yubikey://{serial}/info", mime_type="application/json")
+async def device_info_resource(serial: str) -> str:
+    """`ykman info` output for one YubiKey."""
+    return await read_device_resource(serial, "info")
+
+
+@mcp.resource("yubikey://{serial}/applications", mime_type="application/json")
+async def device_applications_resource(serial: str) -> str:
+    """Enabled/disabled status of each application over USB and NFC."""
+    return await read_device_resource(serial, "applications")
+
+
+@mcp.resource("yubikey://{serial}/openpgp", mime_type="application/json")
+async def device_openpgp_resource(serial: str) -> str:
+    """OpenPGP application status: PIN retry counters, key slots, touch policies."""
+    return await read_device_resource(serial, "openpgp")
+
+
+@mcp._mcp_server.subscribe_resource()
+async def subscribe_resource(uri: AnyUrl) -> None:
+    resource_subscriptions.subscribe(str(uri), mcp._mcp_server.request_context.session)
+
+
+@mcp._mcp_server.unsubscribe_resource()
+async def unsubscribe_resource(uri: AnyUrl) -> None:
+    resource_subscriptions.unsubscribe(str(uri), mcp._mcp_server.request_context.session)
+
+
+_get_capabilities = mcp._mcp_server.get_capabilities
+
+
+def _get_capabilities_with_subscriptions(*args: Any, **kwargs: Any):
+    """Advertise resources/subscribe and list_changed, which the SDK reports as unsupported by default."""
+    capabilities = _get_capabilities(*args, **kwargs)
+    if capabilities.resources is not None:
+        capabilities.resources.subscribe = True
+        capabilities.resources.listChanged = True
+    return capabilities
+
+
+mcp._mcp_server.get_capabilities = _get_capabilities_with_subscriptions
+
+
+@mcp._mcp_server.call_tool(validate_input=False)
+async def call_tool_with_profiling(name: str, arguments: dict[str, Any]):
+    """FastMCP's tool dispatch, sampled by tool_profiler when profiling is enabled for the tool.
+
+    A call rejected by admission control returns a "busy" YubiKeyResponse with
+    retry_after_ms instead of a generic tool error. (Auditing happens in the
+    @audited tools themselves.)
+    """
+    async with tool_profiler.profile(name):
+        try:
+            return await mcp.call_tool(name, arguments)
+        except ToolError as e:
+            tool = mcp._tool_manager.get_tool(name)
+            if not isinstance(e.__cause__, admission.BusyError) or tool is None or tool.fn_metadata.output_model is not YubiKeyResponse:
+                raise
+            response = build_response(
+                "busy",
+                str(e.__cause__),
+                suggested_next_action=f"Retry the same call after {e.__cause__.retry_after_ms} ms",
+                retry_after_ms=e.__cause__.retry_after_ms
+            )
+            return tool.fn_metadata.convert_result(response)
 
 
 def main():
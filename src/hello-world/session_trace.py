@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+YubiKey Session Traces - Record real device sessions and replay them offline.
+
+Recording (YUBIKEY_TRACE_RECORD=path) captures every backend interaction of a
+server session to a gzip-compressed NDJSON file:
+
+- ykman commands: arguments, return code, stdout/stderr, start offset and duration
+- GPG card-edit dialogues: each expect() with the matched prompt, the output
+  before it and how long the card took, and each send (length only)
+
+Replaying (YUBIKEY_TRACE_REPLAY=path) substitutes a backend that answers the
+same commands from the trace, sleeping for the recorded durations scaled by
+YUBIKEY_TRACE_SPEED (2 = twice as fast, 0 = no delays). Touch waits, key
+generation, USB re-enumeration after config writes and gpg prompt pacing are
+reproduced without hardware, so scheduling and concurrency changes can be
+measured against realistic timing.
+
+PIN, key and password arguments are masked (also where echoed in output)
+before anything is written, and sent GPG input is never recorded. Other
+output is kept verbatim, so treat traces of provisioning sessions as sensitive.
+
+Usage:
+    python session_trace.py summary TRACE
+    python session_trace.py drive TRACE [--speed 1.0]
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import re
+import subprocess
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Callable
+
+import pexpect
+
+TRACE_VERSION = 1
+MIN_MASKED_INPUT = 4  # Shorter GPG input (menu choices, y/n) is left readable in echoed output; PINs are 6+
+SECRET_OPTIONS = {"--pin", "--admin-pin", "--new-pin", "--management-key", "--password"}
+
+
+def mask_args(args: list[str]) -> list[str]:
+    """Replace the value following a secret option with ****."""
+    return ["****" if i > 0 and args[i - 1] in SECRET_OPTIONS else arg for i, arg in enumerate(args)]
+
+
+def scrub_output(text: str, args: list[str]) -> str:
+    """Mask secret argument values wherever they are echoed in command output."""
+    for i, arg in enumerate(args[1:], start=1):
+        if args[i - 1] in SECRET_OPTIONS and arg:
+            text = text.replace(arg, "****")
+    return text
+
+
+def read_trace(path: str | Path) -> list[dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    if not events or events[0].get("type") != "header":
+        raise ValueError(f"{path} is not a session trace")
+    if events[0].get("version") != TRACE_VERSION:
+        raise ValueError(f"Unsupported trace version {events[0].get('version')} in {path}")
+    return events[1:]
+
+
+# ============================================================================
+# Recording
+# ============================================================================
+
+class SessionRecorder:
+    """Appends backend interactions to a trace file (thread-safe)."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._write({"type": "header", "version": TRACE_VERSION, "started_at": time.time()})
+
+    def _write(self, event: dict[str, Any]) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(json.dumps(event, separators=(",", ":")) + "\n")
+            self._file.flush()  # Sync-flush so a crashed session still leaves a readable trace
+
+    def offset(self) -> float:
+        return time.monotonic() - self._started
+
+    def run(self, run_command: Callable[[list[str]], subprocess.CompletedProcess], args: list[str]) -> subprocess.CompletedProcess:
+        """Run a ykman command through run_command and record the exchange."""
+        started = self.offset()
+        try:
+            result = run_command(args)
+        except subprocess.CalledProcessError as e:
+            self._record_command(args, started, e.returncode, e.output, e.stderr)
+            raise
+        self._record_command(args, started, 0, result.stdout, result.stderr)
+        return result
+
+    def _record_command(self, args: list[str], started: float, returncode: int, stdout: str | None, stderr: str | None) -> None:
+        self._write({
+            "type": "ykman", "t": round(started, 4), "duration": round(self.offset() - started, 4),
+            "args": mask_args(args), "returncode": returncode,
+            "stdout": scrub_output(stdout or "", args), "stderr": scrub_output(stderr or "", args),
+        })
+
+    def spawn(self, command: str, **kwargs: Any) -> "RecordingSpawn":
+        return RecordingSpawn(self, command, pexpect.spawn(command, **kwargs))
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class RecordingSpawn:
+    """pexpect.spawn wrapper that records the dialogue when closed."""
+
+    def __init__(self, recorder: SessionRecorder, command: str, child: pexpect.spawn):
+        self._recorder = recorder
+        self._child = child
+        self._event = {"type": "spawn", "t": round(recorder.offset(), 4), "command": command, "steps": []}
+        self._sent: list[str] = []  # Kept in memory only, for masking echoed input
+        self._closed = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._child, name)
+
+    def _before(self) -> str:
+        # The terminal echoes input back, so sent text (possibly a PIN) must be masked in recorded output
+        text = self._child.before if isinstance(self._child.before, str) else ""
+        for sent in self._sent:
+            text = text.replace(sent, "****")
+        return text
+
+    def _step_result(self, started: float, index: int) -> int:
+        self._event["steps"].append(["expect", round(time.monotonic() - started, 4), index, self._before()])
+        return index
+
+    def _step_error(self, started: float, error: Exception) -> None:
+        self._event["steps"].append(["expect", round(time.monotonic() - started, 4), type(error).__name__, self._before()])
+
+    def expect(self, pattern: Any, timeout: float = -1, async_: bool = False, **kwargs: Any) -> Any:
+        started = time.monotonic()
+        if async_:
+            async def expect_async() -> int:
+                try:
+                    index = await self._child.expect(pattern, timeout=timeout, async_=True, **kwargs)
+                except (pexpect.TIMEOUT, pexpect.EOF) as e:
+                    self._step_error(started, e)
+                    raise
+                return self._step_result(started, index)
+            return expect_async()
+
+        try:
+            index = self._child.expect(pattern, timeout=timeout, **kwargs)
+        except (pexpect.TIMEOUT, pexpect.EOF) as e:
+            self._step_error(started, e)
+            raise
+        return self._step_result(started, index)
+
+    def send(self, s: str) -> int:
+        if len(s.strip()) >= MIN_MASKED_INPUT:
+            self._sent.append(s.strip())
+        self._event["steps"].append(["send", len(s)])
+        return self._child.send(s)
+
+    def sendline(self, s: str = "") -> int:
+        if len(s.strip()) >= MIN_MASKED_INPUT:
+            self._sent.append(s.strip())
+        self._event["steps"].append(["send", len(s) + 1])
+        return self._child.sendline(s)
+
+    def close(self, force: bool = True) -> None:
+        try:
+            self._child.close(force=force)
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._event["duration"] = round(self._recorder.offset() - self._event["t"], 4)
+                self._recorder._write(self._event)
+
+
+# ============================================================================
+# Replay
+# ============================================================================
+
+class SessionReplay:
+    """Backend that answers ykman commands and GPG dialogues from a recorded trace.
+
+    Commands are matched by their (masked) arguments, in recorded order per
+    argument list; once the recorded answers for a command are used up, the
+    last one is repeated (e.g. for `ykman list` polling).
+    """
+
+    def __init__(self, path: str | Path, speed: float = 1.0):
+        self.path = Path(path)
+        self.speed = speed
+        self.events = read_trace(path)
+        self._commands: dict[tuple[str, ...], deque] = defaultdict(deque)
+        self._last: dict[tuple[str, ...], dict[str, Any]] = {}
+        self._spawns: dict[str, deque] = defaultdict(deque)
+        self._lock = threading.Lock()
+        for event in self.events:
+            if event["type"] == "ykman":
+                self._commands[tuple(event["args"])].append(event)
+            elif event["type"] == "spawn":
+                self._spawns[event["command"]].append(event)
+
+    def delay(self, seconds: float) -> float:
+        return seconds / self.speed if self.speed > 0 else 0.0
+
+    def run(self, args: list[str]) -> subprocess.CompletedProcess:
+        """Mirrors subprocess.run(["ykman", *args], capture_output=True, text=True, check=True)."""
+        key = tuple(mask_args(args))
+        with self._lock:
+            queue = self._commands.get(key)
+            event = queue.popleft() if queue else self._last.get(key)
+            if event is not None:
+                self._last[key] = event
+
+        cmd = ["ykman"] + args
+        if event is None:
+            raise subprocess.CalledProcessError(
+                1, cmd, output="", stderr=f"Error: command not in trace {self.path.name}: {' '.join(key)}"
+            )
+        time.sleep(self.delay(event["duration"]))
+        if event["returncode"] != 0:
+            raise subprocess.CalledProcessError(event["returncode"], cmd, output=event["stdout"], stderr=event["stderr"])
+        return subprocess.CompletedProcess(cmd, 0, event["stdout"], event["stderr"])
+
+    def spawn(self, command: str, **kwargs: Any) -> "ReplaySpawn":
+        with self._lock:
+            queue = self._spawns.get(command)
+            event = queue.popleft() if queue else None
+        if event is None:
+            raise pexpect.EOF(f"No recorded session for '{command}' in trace {self.path.name}")
+        return ReplaySpawn(self, event)
+
+
+class ReplaySpawn:
+    """Stands in for pexpect.spawn, replaying recorded expect() results and timing."""
+
+    def __init__(self, replay: SessionReplay, event: dict[str, Any]):
+        self._replay = replay
+        self._steps = deque(step for step in event["steps"] if step[0] == "expect")
+        self.before = ""
+        self.after = ""
+        self.logfile_read = None
+
+    def _next(self) -> tuple[float, Any, str]:
+        if not self._steps:
+            raise pexpect.EOF("Recorded GPG session ended")
+        _, duration, index, before = self._steps.popleft()
+        return duration, index, before
+
+    def _result(self, index: Any, before: str) -> int:
+        self.before = before
+        if index == "TIMEOUT":
+            raise pexpect.TIMEOUT(before)
+        if index == "EOF":
+            raise pexpect.EOF(before)
+        return index
+
+    def expect(self, pattern: Any, timeout: float = -1, async_: bool = False, **kwargs: Any) -> Any:
+        duration, index, before = self._next()
+        if async_:
+            async def expect_async() -> int:
+                await asyncio.sleep(self._replay.delay(duration))
+                return self._result(index, before)
+            return expect_async()
+        time.sleep(self._replay.delay(duration))
+        return self._result(index, before)
+
+    def send(self, s: str) -> int:
+        return len(s)
+
+    def sendline(self, s: str = "") -> int:
+        return len(s) + 1
+
+    def close(self, force: bool = True) -> None:
+        self._steps.clear()
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def summarize(events: list[dict[str, Any]]) -> dict[str, Any]:
+    """Per-command counts and durations, keyed by the ykman subcommand (serial removed)."""
+    commands: dict[str, list[float]] = defaultdict(list)
+    for event in events:
+        if event["type"] == "ykman":
+            args = event["args"][2:] if event["args"][:1] == ["--device"] else event["args"]
+            name = " ".join(arg for arg in args[:3] if not arg.startswith("-") and not re.fullmatch(r"\d+|\*+", arg))
+            commands[f"ykman {name}"].append(event["duration"])
+        elif event["type"] == "spawn":
+            commands[event["command"]].append(event.get("duration", 0.0))
+    return {
+        name: {"count": len(durations), "total_s": round(sum(durations), 3), "max_s": round(max(durations), 3)}
+        for name, durations in sorted(commands.items())
+    }
+
+
+async def drive(events: list[dict[str, Any]], run_command: Callable[[list[str]], Any], speed: float = 1.0) -> list[float]:
+    """Re-issue the recorded ykman commands at their recorded (scaled) start times, concurrently.
+
+    Returns:
+        Observed latency in seconds for each command
+    """
+    scale = 1 / speed if speed > 0 else 0.0
+    started = time.monotonic()
+
+    async def issue(event: dict[str, Any]) -> float:
+        await asyncio.sleep(max(0.0, event["t"] * scale - (time.monotonic() - started)))
+        issued = time.monotonic()
+        try:
+            await asyncio.to_thread(run_command, event["args"])
+        except subprocess.CalledProcessError:
+            pass
+        return time.monotonic() - issued
+
+    return await asyncio.gather(*(issue(event) for event in events if event["type"] == "ykman"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay a recorded YubiKey session trace")
+    subcommands = parser.add_subparsers(dest="action", required=True)
+    summary_parser = subcommands.add_parser("summary", help="Per-command counts and durations")
+    summary_parser.add_argument("trace")
+    drive_parser = subcommands.add_parser("drive", help="Replay the session's commands at recorded pacing")
+    drive_parser.add_argument("trace")
+    drive_parser.add_argument("--speed", type=float, default=1.0, help="Timing scale (2 = twice as fast, 0 = no delays)")
+    args = parser.parse_args()
+
+    events = read_trace(args.trace)
+    if args.action == "summary":
+        print(json.dumps(summarize(events), indent=2))
+        return
+
+    replay = SessionReplay(args.trace, speed=args.speed)
+    started = time.monotonic()
+    latencies = asyncio.run(drive(events, replay.run, args.speed))
+    latencies.sort()
+    print(json.dumps({
+        "commands": len(latencies),
+        "wall_time_s": round(time.monotonic() - started, 3),
+        "latency_p50_s": round(latencies[len(latencies) // 2], 4) if latencies else None,
+        "latency_max_s": round(latencies[-1], 4) if latencies else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
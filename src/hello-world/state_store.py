@@ -0,0 +1,269 @@
+"""
+YubiKey State Store - SQLite persistence for device state and operation history.
+
+Persists the device inventory, last-known per-device state (ykman info,
+application table, OpenPGP status) and a history of ykman operations keyed by
+serial, so a restarted server starts warm: cached state is loaded as stale and
+revalidated lazily instead of re-enumerating every device up front.
+
+Writes are queued to a single writer thread that commits them in batches, so
+callers on the event loop never wait for SQLite. Reads first wait for the
+writes queued before them.
+"""
+
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+MAX_HISTORY_ROWS = 100_000  # Oldest operations are pruned beyond this
+MAX_BATCH_WRITES = 500
+
+_STOP = object()
+
+
+@dataclass
+class StoredState:
+    """Everything loaded from the store at start-up.
+
+    Attributes:
+        inventory_lines: `ykman list` lines of the devices attached when the server last ran
+        inventory_updated_at: When that inventory was recorded
+        entries: {serial: {kind: (value, updated_at)}}
+    """
+    inventory_lines: list[str]
+    inventory_updated_at: float | None
+    entries: dict[int, dict[str, tuple[Any, float]]]
+
+
+class StateStore:
+    """SQLite-backed device state and operation history (thread-safe).
+
+    save_inventory(), save_state() and record_operation() only enqueue; the
+    writer thread applies them in order. close() writes out what is queued.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # Cached state can be re-read; losing the tail on power loss is fine
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS devices (
+                serial INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                attached INTEGER NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS device_state (
+                serial INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (serial, kind)
+            );
+            CREATE TABLE IF NOT EXISTS operations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                serial INTEGER,
+                command TEXT NOT NULL,
+                status TEXT NOT NULL,
+                detail TEXT,
+                duration_ms REAL NOT NULL,
+                at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS operations_by_serial ON operations (serial, at);"""
+        )
+        self._conn.commit()
+        self._operations_since_prune = 0
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._done = threading.Condition()
+        self.enqueued = 0
+        self.written = 0
+        self.write_errors = 0
+        self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # Writes (queued)
+    # ------------------------------------------------------------------
+
+    def _enqueue(self, write, *args: Any) -> None:
+        with self._done:
+            self.enqueued += 1
+        self._queue.put((write, args))
+
+    def save_inventory(self, lines: list[str], devices: dict[int, str], updated_at: float) -> None:
+        """Record the attached devices; previously seen devices are kept as detached."""
+        self._enqueue(self._write_inventory, dict(devices), updated_at)
+
+    def save_state(self, serial: int, kind: str, value: Any, updated_at: float) -> None:
+        # Serialized here, so a value mutated after the call is stored as it was
+        self._enqueue(self._write_state, serial, kind, json.dumps(value), updated_at)
+
+    def record_operation(
+        self,
+        serial: int | None,
+        command: str,
+        status: str,
+        detail: str | None = None,
+        duration_ms: float = 0.0
+    ) -> None:
+        """Append to the operation history (command must already have secrets masked)."""
+        self._enqueue(self._write_operation, serial, command, status, detail, duration_ms, time.time())
+
+    def _write_inventory(self, devices: dict[int, str], updated_at: float) -> None:
+        self._conn.execute("UPDATE devices SET attached = 0 WHERE attached = 1")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO devices VALUES (?, ?, 1, ?)",
+            [(serial, description, updated_at) for serial, description in devices.items()],
+        )
+
+    def _write_state(self, serial: int, kind: str, value: str, updated_at: float) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO device_state VALUES (?, ?, ?, ?)", (serial, kind, value, updated_at))
+
+    def _write_operation(
+        self,
+        serial: int | None,
+        command: str,
+        status: str,
+        detail: str | None,
+        duration_ms: float,
+        at: float
+    ) -> None:
+        self._conn.execute(
+            "INSERT INTO operations (serial, command, status, detail, duration_ms, at) VALUES (?, ?, ?, ?, ?, ?)",
+            (serial, command, status, detail, duration_ms, at),
+        )
+        self._operations_since_prune += 1
+        if self._operations_since_prune >= 1000:
+            self._operations_since_prune = 0
+            self._conn.execute(
+                "DELETE FROM operations WHERE id <= (SELECT MAX(id) FROM operations) - ?",
+                (MAX_HISTORY_ROWS,),
+            )
+
+    def _run(self) -> None:
+        # The writer owns closing the connection, so close() never races a batch in progress
+        try:
+            self._drain()
+        finally:
+            with self._lock:
+                self._conn.close()
+
+    def _drain(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < MAX_BATCH_WRITES:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in batch)
+            writes = [item for item in batch if item is not _STOP]
+            with self._lock:
+                for write, args in writes:
+                    try:
+                        write(*args)
+                    except sqlite3.Error as e:
+                        # Cached state is re-read from the device; drop the write rather than stall the queue
+                        self.write_errors += 1
+                        logger.warning("State store write failed: %s", e)
+                try:
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    self.write_errors += 1
+                    logger.warning("State store commit failed: %s", e)
+            with self._done:
+                self.written += len(writes)
+                self._done.notify_all()
+            if stop:
+                return
+
+    def flush(self, timeout: float | None = 5.0) -> bool:
+        """Wait until every write enqueued so far is applied; returns False on timeout."""
+        with self._done:
+            target = self.enqueued
+            return self._done.wait_for(lambda: self.written >= target, timeout)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def load(self) -> StoredState:
+        self.flush()
+        with self._lock:
+            devices = self._conn.execute(
+                "SELECT description, last_seen FROM devices WHERE attached = 1 ORDER BY serial"
+            ).fetchall()
+            rows = self._conn.execute("SELECT serial, kind, value, updated_at FROM device_state").fetchall()
+
+        entries: dict[int, dict[str, tuple[Any, float]]] = {}
+        for serial, kind, value, updated_at in rows:
+            entries.setdefault(serial, {})[kind] = (json.loads(value), updated_at)
+        return StoredState(
+            inventory_lines=[description for description, _ in devices],
+            inventory_updated_at=max((last_seen for _, last_seen in devices), default=None),
+            entries=entries,
+        )
+
+    def history(
+        self,
+        serial: int | None = None,
+        since: float | None = None,
+        status: str | None = None,
+        limit: int = 50
+    ) -> list[dict[str, Any]]:
+        """Most recent operations first, optionally filtered by serial, time and status."""
+        clauses, params = [], []
+        if serial is not None:
+            clauses.append("serial = ?")
+            params.append(serial)
+        if since is not None:
+            clauses.append("at >= ?")
+            params.append(since)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT serial, command, status, detail, duration_ms, at FROM operations {where} "
+                "ORDER BY id DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [
+            {"serial_number": serial, "command": command, "status": status, "detail": detail,
+             "duration_ms": round(duration_ms, 1), "at": at}
+            for serial, command, status, detail, duration_ms, at in rows
+        ]
+
+    def known_devices(self) -> list[dict[str, Any]]:
+        """Every device the server has seen, attached or not."""
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT serial, description, attached, last_seen FROM devices ORDER BY last_seen DESC"
+            ).fetchall()
+        return [
+            {"serial_number": serial, "description": description, "attached": bool(attached), "last_seen": last_seen}
+            for serial, description, attached, last_seen in rows
+        ]
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Write out queued writes and stop the writer, which closes the database on exit."""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("State store writer still busy after %.1fs; it will close the database when done", timeout)
@@ -0,0 +1,133 @@
+"""FIFO order, queue bounds and retry hints of admission control, and the watcher going through it."""
+
+import asyncio
+import subprocess
+import time
+
+import pytest
+
+import device_state
+from admission import AdmissionController, BusyError, _Gate
+
+
+def far_deadline():
+    return time.monotonic() + 5
+
+
+def test_gate_admits_waiters_in_fifo_order():
+    async def scenario():
+        gate = _Gate("YubiKey 1", limit=1, max_queue=8)
+        await gate.acquire(far_deadline())
+        order = []
+
+        async def waiter(number):
+            await gate.acquire(far_deadline())
+            order.append(number)
+            gate.release(1.0)
+
+        tasks = []
+        for number in range(5):
+            tasks.append(asyncio.create_task(waiter(number)))
+            await asyncio.sleep(0)  # Queue them in a known order
+        assert gate.queued == 5
+        gate.release(1.0)
+        await asyncio.gather(*tasks)
+        return gate, order
+
+    gate, order = asyncio.run(scenario())
+    assert order == [0, 1, 2, 3, 4]
+    assert gate.in_flight == 0
+    assert gate.stats.admitted == 6
+    assert gate.stats.max_queued == 5
+
+
+def test_gate_rejects_when_the_queue_is_full():
+    async def scenario():
+        gate = _Gate("YubiKey 1", limit=1, max_queue=2)
+        await gate.acquire(far_deadline())
+        gate.release(400.0)  # hold_ms average becomes 400
+        await gate.acquire(far_deadline())
+        waiters = [asyncio.create_task(gate.acquire(far_deadline())) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(BusyError) as busy:
+            await gate.acquire(far_deadline())
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return gate, busy.value
+
+    gate, error = asyncio.run(scenario())
+    assert gate.stats.rejected_full == 1
+    assert gate.queued == 0
+    # Two queued ahead of us plus our own turn, 400 ms each, one slot
+    assert error.retry_after_ms == 1200
+    assert "1 running, 2 queued" in str(error)
+
+
+def test_retry_after_scales_with_limit_and_has_a_floor():
+    gate = _Gate("The server", limit=4, max_queue=0)
+    assert gate.retry_after_ms() == 25  # Default 100 ms hold, one turn, four slots
+    gate.hold_ms = 1.0
+    assert gate.retry_after_ms() == 10
+
+
+def test_gate_times_out_waiters_at_the_deadline():
+    async def scenario():
+        gate = _Gate("YubiKey 1", limit=1, max_queue=4)
+        await gate.acquire(far_deadline())
+        with pytest.raises(BusyError) as busy:
+            await gate.acquire(time.monotonic() + 0.05)
+        return gate, busy.value
+
+    gate, error = asyncio.run(scenario())
+    assert gate.stats.rejected_timeout == 1
+    assert gate.queued == 0
+    assert gate.in_flight == 1
+    assert error.retry_after_ms >= 10
+
+
+def test_serial_less_acquire_holds_every_device():
+    async def scenario():
+        controller = AdmissionController(global_limit=4, device_limit=1, max_queue=4, attached_serials=lambda: [1, 2])
+        enumeration = await controller.acquire(None)
+        with pytest.raises(BusyError):
+            await controller.acquire(2, max_wait=0.05)
+        enumeration.release()
+        async with await controller.acquire(2, max_wait=0.05):
+            pass
+        return controller.status()
+
+    status = asyncio.run(scenario())
+    assert status["devices"]["2"]["rejected_timeout"] == 1
+    assert status["global"]["in_flight"] == 0
+
+
+class FakeList:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, args):
+        self.calls += 1
+        return subprocess.CompletedProcess(["ykman"] + args, 0, "YubiKey 5 NFC (5.4.3) [OTP+FIDO+CCID] Serial: 1\n", "")
+
+
+def test_watcher_enumerates_through_admission():
+    async def scenario():
+        controller = AdmissionController(max_queue=4, max_wait=0.05)
+        cache = device_state.DeviceStateCache()
+        command = FakeList()
+        watcher = device_state.HotplugWatcher(cache, command, use_scan=False, admit=controller.acquire)
+
+        async with await controller.acquire(1):
+            with pytest.raises(BusyError):
+                await watcher.refresh_inventory()
+        assert command.calls == 0
+
+        await watcher.refresh_inventory()
+        return cache, command, controller.status()
+
+    cache, command, status = asyncio.run(scenario())
+    assert command.calls == 1
+    assert list(cache.inventory) == [1]
+    assert status["devices"]["1"]["rejected_timeout"] == 1
+    assert status["global"]["in_flight"] == 0
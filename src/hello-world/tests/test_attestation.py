@@ -0,0 +1,228 @@
+"""Attestation chain verification against locally generated CA hierarchies."""
+
+import asyncio
+import datetime
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+import attestation
+
+SERIAL = 16021303
+
+
+def _der_integer(value: int) -> bytes:
+    body = value.to_bytes((value.bit_length() + 8) // 8, "big")
+    return bytes([0x02, len(body)]) + body
+
+
+def _certificate(subject: str, key, issuer_name: str, issuer_key, extensions=(), ca: bool = True) -> x509.Certificate:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)]))
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer_name)]))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+    )
+    for extension in extensions:
+        builder = builder.add_extension(extension, critical=False)
+    return builder.sign(issuer_key, hashes.SHA256())
+
+
+def _der(cert: x509.Certificate) -> bytes:
+    return cert.public_bytes(serialization.Encoding.DER)
+
+
+class Hierarchy:
+    """Root CA -> intermediate -> device attestation CA -> attestation leaf."""
+
+    def __init__(self, root_name: str = "Test Root CA"):
+        self.root_key = ec.generate_private_key(ec.SECP256R1())
+        self.root = _certificate(root_name, self.root_key, root_name, self.root_key)
+        self.intermediate_key = ec.generate_private_key(ec.SECP256R1())
+        self.intermediate = _certificate(f"{root_name} Intermediate", self.intermediate_key, root_name, self.root_key)
+        self.device_ca_key = ec.generate_private_key(ec.SECP256R1())
+        self.device_ca = _certificate(
+            "Yubico PIV Attestation", self.device_ca_key, f"{root_name} Intermediate", self.intermediate_key
+        )
+
+    def leaf(self, serial: int | None = SERIAL, signer=None, oid=attestation.PIV_SERIAL_OID) -> x509.Certificate:
+        extensions = [x509.UnrecognizedExtension(attestation.PIV_FIRMWARE_OID, bytes([5, 4, 3]))]
+        if serial is not None:
+            extensions.append(x509.UnrecognizedExtension(oid, _der_integer(serial)))
+        key = ec.generate_private_key(ec.SECP256R1())
+        return _certificate(
+            "YubiKey PIV Attestation 9a", key, "Yubico PIV Attestation", signer or self.device_ca_key,
+            extensions, ca=False
+        )
+
+    def record(self, leaf: x509.Certificate, serial: int = SERIAL) -> attestation.AttestationRecord:
+        return attestation.AttestationRecord(
+            serial=serial, application="piv", slot="9a", leaf_der=_der(leaf), device_ca_der=_der(self.device_ca)
+        )
+
+    def store(self) -> attestation.TrustStore:
+        return attestation.TrustStore([self.root, self.intermediate])
+
+
+@pytest.fixture(scope="module")
+def hierarchy() -> Hierarchy:
+    return Hierarchy()
+
+
+def test_valid_chain_verifies(hierarchy):
+    result = attestation.verify_record(hierarchy.record(hierarchy.leaf()), hierarchy.store())
+    assert result.verified, result.reason
+    assert result.attested_serial == SERIAL
+    assert result.firmware_version == "5.4.3"
+    assert len(result.chain) == 4
+
+
+def test_trust_store_loads_pem_bundle(hierarchy):
+    pem = b"".join(cert.public_bytes(serialization.Encoding.PEM) for cert in (hierarchy.root, hierarchy.intermediate))
+    store = attestation.TrustStore.from_pem_bytes(pem)
+    assert attestation.verify_record(hierarchy.record(hierarchy.leaf()), store).verified
+
+
+def test_serial_mismatch_fails(hierarchy):
+    result = attestation.verify_record(hierarchy.record(hierarchy.leaf(serial=SERIAL + 1)), hierarchy.store())
+    assert not result.verified
+    assert "does not match" in result.reason
+
+
+def test_missing_serial_extension_fails(hierarchy):
+    result = attestation.verify_record(hierarchy.record(hierarchy.leaf(serial=None)), hierarchy.store())
+    assert not result.verified
+    assert "no serial number extension" in result.reason
+
+
+def test_serial_under_other_application_oid_fails(hierarchy):
+    leaf = hierarchy.leaf(oid=attestation.OPENPGP_SERIAL_OID)
+    assert not attestation.verify_record(hierarchy.record(leaf), hierarchy.store()).verified
+
+
+def test_leaf_not_signed_by_device_ca_fails(hierarchy):
+    leaf = hierarchy.leaf(signer=ec.generate_private_key(ec.SECP256R1()))
+    result = attestation.verify_record(hierarchy.record(leaf), hierarchy.store())
+    assert not result.verified
+    assert "not signed by the device attestation CA" in result.reason
+
+
+def test_untrusted_root_fails(hierarchy):
+    other = Hierarchy(root_name="Test Root CA")  # Same names, different keys
+    result = attestation.verify_record(hierarchy.record(hierarchy.leaf()), other.store())
+    assert not result.verified
+    assert "does not chain to a trusted root" in result.reason
+
+
+def test_missing_intermediate_fails(hierarchy):
+    result = attestation.verify_record(hierarchy.record(hierarchy.leaf()), attestation.TrustStore([hierarchy.root]))
+    assert not result.verified
+
+
+def test_collection_error_is_reported(hierarchy):
+    record = attestation.AttestationRecord(serial=SERIAL, application="piv", slot="9a", error="Attestation failed: slot empty")
+    result = attestation.verify_record(record, hierarchy.store())
+    assert not result.verified
+    assert result.reason == "Attestation failed: slot empty"
+
+
+def test_parallel_verification_matches_in_process(hierarchy):
+    records = [hierarchy.record(hierarchy.leaf())] * attestation.PARALLEL_THRESHOLD
+    records.append(hierarchy.record(hierarchy.leaf(serial=None)))
+    verifier = attestation.AttestationVerifier(hierarchy.store(), max_workers=2)
+    try:
+        results = asyncio.run(verifier.verify(records))
+    finally:
+        verifier.shutdown()
+    assert [result.verified for result in results] == [True] * attestation.PARALLEL_THRESHOLD + [False]
+
+    report = attestation.build_report(results)
+    assert report[SERIAL]["verified"] is False
+    assert len(report[SERIAL]["keys"]) == len(records)
+
+
+class AttestingDevice:
+    """Fake ykman for collect_device_attestations: 9a attests, 9c is empty, 9d holds an imported key."""
+
+    def __init__(self, hierarchy: Hierarchy):
+        self.pem = {
+            "f9": hierarchy.device_ca.public_bytes(serialization.Encoding.PEM).decode(),
+            "9a": hierarchy.leaf().public_bytes(serialization.Encoding.PEM).decode(),
+        }
+
+    def __call__(self, args: list[str]) -> subprocess.CompletedProcess:
+        command = args[2:]
+        if command[:3] == ["piv", "certificates", "export"] or command[:3] == ["piv", "keys", "attest"]:
+            if command[3] in self.pem:
+                return subprocess.CompletedProcess(args, 0, self.pem[command[3]], "")
+            raise subprocess.CalledProcessError(1, args, "", "Error: Attestation failed.\n")
+        if command[:3] == ["piv", "keys", "info"]:
+            if command[3] == "9c":
+                raise subprocess.CalledProcessError(1, args, "", "Error: No key stored in slot 9c.\n")
+            return subprocess.CompletedProcess(args, 0, f"Key slot: {command[3]}\nOrigin: IMPORTED\n", "")
+        raise AssertionError(f"Unexpected command {args}")
+
+
+def test_empty_slots_are_reported_as_not_present(hierarchy):
+    run_command = AttestingDevice(hierarchy)
+    targets = [("piv", "9a"), ("piv", "9c"), ("piv", "9d")]
+    records = attestation.collect_device_attestations(run_command, SERIAL, targets)
+    assert [record.present for record in records] == [True, False, True]
+    assert records[1].error is None
+    assert records[2].error == "Attestation failed: Error: Attestation failed."
+
+    report = attestation.build_report([attestation.verify_record(record, hierarchy.store()) for record in records])
+    assert report[SERIAL]["not_present"] == ["piv:9c"]
+    assert [key["slot"] for key in report[SERIAL]["keys"]] == ["9a", "9d"]
+    assert report[SERIAL]["verified"] is False  # 9d holds a key that does not attest
+
+    records = attestation.collect_device_attestations(run_command, SERIAL, [("piv", "9a"), ("piv", "9c")])
+    report = attestation.build_report([attestation.verify_record(record, hierarchy.store()) for record in records])
+    assert report[SERIAL]["verified"] is True
+
+    records = attestation.collect_device_attestations(run_command, SERIAL, [("piv", "9c")])
+    report = attestation.build_report([attestation.verify_record(record, hierarchy.store()) for record in records])
+    assert report[SERIAL] == {"verified": None, "keys": [], "not_present": ["piv:9c"]}
+
+
+def test_pool_workers_do_not_rerun_the_main_module(tmp_path):
+    # A server-like __main__ that records every time it is executed
+    marker = tmp_path / "imports.txt"
+    script = tmp_path / "main.py"
+    script.write_text(textwrap.dedent(f"""
+        import asyncio
+        import multiprocessing
+
+        import attestation
+
+        with open({str(marker)!r}, "a") as f:
+            f.write(__name__ + "\\n")
+
+        if __name__ == "__main__":
+            records = [
+                attestation.AttestationRecord(serial=1, application="piv", slot="9a", error="Not collected")
+                for _ in range(attestation.PARALLEL_THRESHOLD)
+            ]
+            verifier = attestation.AttestationVerifier(attestation.TrustStore([]), max_workers=2)
+            results = asyncio.run(verifier.verify(records))
+            assert all(result.reason == "Not collected" for result in results)
+            assert verifier._executor._mp_context.get_start_method() == "spawn"
+            verifier.shutdown()
+    """))
+    environment = dict(os.environ, PYTHONPATH=str(Path(attestation.__file__).parent))
+    completed = subprocess.run([sys.executable, str(script)], env=environment, capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    assert marker.read_text().splitlines() == ["__main__"]
@@ -0,0 +1,179 @@
+"""Hash chain, anchor and group commit of the audit log, and auditing of provisioning stages."""
+
+import asyncio
+import json
+
+import pytest
+
+import audit_log
+import provisioning
+import server
+from audit_log import AuditLog, verify
+from device_agent import SimulatedYkman
+
+KEY = b"audit-key"
+
+
+def write_log(directory, events=5, key=None, max_segment_bytes=audit_log.DEFAULT_MAX_SEGMENT_BYTES):
+    log = AuditLog(directory, max_segment_bytes=max_segment_bytes, key=key)
+    for number in range(events):
+        log.record("set_openpgp_touch_policy", "success", {"key_slot": "sig", "admin_pin": "12345678"}, 1000 + number)
+    log.close()
+    return log
+
+
+def read_lines(path):
+    return path.read_text().splitlines(keepends=True)
+
+
+@pytest.mark.parametrize("key", [None, KEY])
+def test_clean_log_verifies(tmp_path, key):
+    write_log(tmp_path, key=key)
+    result = verify(tmp_path, key)
+    assert result["valid"], result["error"]
+    assert result["records"] == result["last_seq"] == result["anchored_seq"] == 5
+    assert '"admin_pin":"****"' in (tmp_path / "audit-000001.jsonl").read_text()
+
+
+def test_edited_record_is_detected(tmp_path):
+    write_log(tmp_path, key=KEY)
+    segment = tmp_path / "audit-000001.jsonl"
+    lines = read_lines(segment)
+    record = json.loads(lines[2])
+    record["status"] = "error"
+    lines[2] = json.dumps(record, separators=(",", ":")) + "\n"
+    segment.write_text("".join(lines))
+
+    result = verify(tmp_path, KEY)
+    assert not result["valid"]
+    assert result["error"]["line"] == 3
+    assert "record modified" in result["error"]["reason"]
+
+
+def test_removed_record_is_detected(tmp_path):
+    write_log(tmp_path)
+    segment = tmp_path / "audit-000001.jsonl"
+    lines = read_lines(segment)
+    segment.write_text("".join(lines[:1] + lines[2:]))
+
+    result = verify(tmp_path)
+    assert not result["valid"]
+    assert "Expected sequence 2, found 3" in result["error"]["reason"]
+
+
+def test_removed_tail_is_detected_by_the_anchor(tmp_path):
+    write_log(tmp_path)
+    segment = tmp_path / "audit-000001.jsonl"
+    segment.write_text("".join(read_lines(segment)[:-1]))
+
+    result = verify(tmp_path)
+    assert not result["valid"]
+    assert result["error"]["segment"] == audit_log.ANCHOR_FILE
+    assert "records removed" in result["error"]["reason"]
+
+
+def test_reordered_records_are_detected(tmp_path):
+    write_log(tmp_path)
+    segment = tmp_path / "audit-000001.jsonl"
+    lines = read_lines(segment)
+    lines[1], lines[2] = lines[2], lines[1]
+    segment.write_text("".join(lines))
+
+    result = verify(tmp_path)
+    assert not result["valid"]
+    assert result["error"]["line"] == 2
+    assert "removed or reordered" in result["error"]["reason"]
+
+
+def test_anchor_not_matching_the_chain_head_is_detected(tmp_path):
+    write_log(tmp_path)
+    anchor_path = tmp_path / audit_log.ANCHOR_FILE
+    anchor = json.loads(anchor_path.read_text())
+    anchor["hash"] = "f" * 64
+    anchor_path.write_text(json.dumps(anchor))
+
+    result = verify(tmp_path)
+    assert not result["valid"]
+    assert "does not match the anchored hash" in result["error"]["reason"]
+
+
+def test_keyed_anchor_mac_is_checked(tmp_path):
+    write_log(tmp_path, key=KEY)
+    anchor_path = tmp_path / audit_log.ANCHOR_FILE
+    anchor = json.loads(anchor_path.read_text())
+    anchor["seq"] = 4
+    anchor_path.write_text(json.dumps(anchor))
+
+    assert "Anchor MAC mismatch" in verify(tmp_path, KEY)["error"]["reason"]
+    assert "needs the audit key" in verify(tmp_path)["error"]["reason"]
+
+
+def test_close_flushes_queued_events(tmp_path):
+    log = AuditLog(tmp_path)
+    for number in range(200):
+        log.record("delete_fido2_credential", "success", {"credential_id": str(number)})
+    log.close()
+
+    assert log.written == 200
+    assert not log._thread.is_alive()
+    assert log._file.closed
+    assert verify(tmp_path)["records"] == 200
+
+
+def test_chain_continues_across_segment_rollover_and_reopen(tmp_path):
+    # Segments rotate between group commits, never inside one
+    log = AuditLog(tmp_path, max_segment_bytes=2048)
+    for _ in range(4):
+        for number in range(10):
+            log.record("set_openpgp_touch_policy", "success", {"key_slot": "sig"}, 1000 + number)
+        assert log.flush()
+    log.close()
+    first = verify(tmp_path)
+    assert first["valid"], first["error"]
+    assert first["records"] == 40
+    assert first["segments"] > 1
+
+    reopened = AuditLog(tmp_path, max_segment_bytes=2048)
+    for _ in range(3):
+        reopened.record("set_openpgp_pin_retries", "success", {})
+    reopened.close()
+
+    result = verify(tmp_path)
+    assert result["valid"], result["error"]
+    assert result["records"] == result["anchored_seq"] == 43
+    assert result["segments"] > first["segments"]
+
+
+class QuietContext:
+    """Stands in for an MCP Context in a provisioning run."""
+
+    async def info(self, message):
+        pass
+
+    async def report_progress(self, *args, **kwargs):
+        pass
+
+
+def test_provisioning_stage_is_audited(tmp_path, monkeypatch):
+    simulated = SimulatedYkman([1001])
+    monkeypatch.setattr(server, "_run_ykman_backend", simulated)
+    monkeypatch.setattr(server, "audit_trail", AuditLog(tmp_path))
+
+    async def run_stage():
+        stage = next(s for s in server.build_provisioning_stages(QuietContext()) if s.name == "usb_applications")
+        await stage.run(provisioning.ManifestEntry(serial=1001, usb_disable=["OATH"]))
+        return await server.verify_audit_log()
+
+    try:
+        response = asyncio.run(run_stage())
+    finally:
+        server.audit_trail.close()
+
+    assert simulated.devices[1001]["usb"]["OATH"] == "Disabled"
+    assert response.status == "success"
+    assert response.data["verification"]["records"] == 1
+    record = json.loads((tmp_path / "audit-000001.jsonl").read_text())
+    assert record["tool"] == "configure_yubikey_applications"
+    assert record["serial_number"] == 1001
+    assert record["status"] == "success"
+    assert record["arguments"]["disable_applications"] == ["OATH"]
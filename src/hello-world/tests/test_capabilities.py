@@ -0,0 +1,157 @@
+"""Parsing `ykman info` into a capability matrix, the tool prechecks and case-insensitive arguments."""
+
+import asyncio
+
+import pytest
+from pydantic import TypeAdapter, ValidationError
+
+import capabilities
+import provisioning
+import server
+from device_agent import SimulatedYkman
+
+YUBIKEY_5_NFC = """Device type: YubiKey 5 NFC
+Serial number: 16021303
+Firmware version: 5.4.3
+Form factor: Keychain (USB-A)
+Enabled USB interfaces: OTP, FIDO, CCID
+NFC transport is enabled
+
+Applications\tUSB\tNFC
+Yubico OTP  \tEnabled \tEnabled
+FIDO U2F    \tEnabled \tEnabled
+FIDO2       \tEnabled \tDisabled
+OATH        \tEnabled \tEnabled
+PIV         \tEnabled \tEnabled
+OpenPGP     \tEnabled \tEnabled
+YubiHSM Auth\tEnabled \tNot available
+"""
+
+YUBIKEY_4 = """Device type: YubiKey 4
+Serial number: 5000000
+Firmware version: 4.3.7
+Form factor: Keychain (USB-A)
+
+Applications
+OTP                 Enabled
+FIDO U2F            Enabled
+OATH                Enabled
+PIV                 Enabled
+OpenPGP             Enabled
+YubiHSM Auth        Not available
+"""
+
+
+def test_parse_application_table_usb_and_nfc():
+    table = capabilities.parse_application_table(YUBIKEY_5_NFC)
+    assert table["usb"]["FIDO2"] == "Enabled"
+    assert table["nfc"]["FIDO2"] == "Disabled"
+    assert table["nfc"]["YubiHSM Auth"] == "Not available"
+    assert len(table["usb"]) == len(table["nfc"]) == 7
+
+
+def test_parse_application_table_usb_only():
+    table = capabilities.parse_application_table(YUBIKEY_4)
+    assert table["nfc"] == {}
+    assert table["usb"]["OpenPGP"] == "Enabled"
+    assert table["usb"]["YubiHSM Auth"] == "Not available"
+
+
+def test_capability_matrix_follows_firmware_and_form_factor():
+    modern = capabilities.capabilities_from_info(YUBIKEY_5_NFC)
+    assert modern.profile.firmware == (5, 4, 3)
+    assert "HSMAUTH" in modern.applications["usb"]
+    assert "HSMAUTH" not in modern.applications["nfc"]
+    assert modern.touch_slots == ("sig", "enc", "aut", "att")
+    assert "cached" in modern.touch_policies
+
+    legacy = capabilities.capabilities_from_info(YUBIKEY_4)
+    assert legacy.applications == {"usb": (), "nfc": ()}
+    assert "5.0.0" in legacy.unsupported["config"]
+    assert legacy.touch_slots == ("sig", "enc", "aut")
+    assert legacy.touch_policies == ("on", "off", "fixed")
+
+
+def test_check_configure():
+    modern = capabilities.capabilities_from_info(YUBIKEY_5_NFC)
+    assert capabilities.check_configure(modern, "usb", ["OATH", "PIV"]) is None
+    assert capabilities.check_configure(modern, "USB", ["oath", "piv"]) is None
+    assert "not available over NFC" in capabilities.check_configure(modern, "nfc", ["HSMAUTH"])
+
+    legacy = capabilities.capabilities_from_info(YUBIKEY_4)
+    assert "requires YubiKey 5.0.0" in capabilities.check_configure(legacy, "usb", ["OATH"])
+
+
+def test_check_touch_policy():
+    modern = capabilities.capabilities_from_info(YUBIKEY_5_NFC)
+    assert capabilities.check_touch_policy(modern, "att", "cached-fixed") is None
+    assert capabilities.check_touch_policy(modern, "SIG", "ON") is None
+
+    legacy = capabilities.capabilities_from_info(YUBIKEY_4)
+    assert "attestation key (att) requires YubiKey 5.2.1" in capabilities.check_touch_policy(legacy, "ATT", "on")
+    assert "Cached touch policies require" in capabilities.check_touch_policy(legacy, "sig", "Cached")
+    assert capabilities.check_touch_policy(legacy, "Sig", "Fixed") is None
+
+
+def test_check_pin_retries():
+    assert capabilities.check_pin_retries(capabilities.capabilities_from_info(YUBIKEY_4)) is None
+    older = YUBIKEY_4.replace("4.3.7", "4.2.0")
+    assert "4.3.1" in capabilities.check_pin_retries(capabilities.capabilities_from_info(older))
+
+
+@pytest.mark.parametrize("alias, raw, expected", [
+    (capabilities.TransportInput, "NFC", "nfc"),
+    (capabilities.ApplicationInput, "oath", "OATH"),
+    (capabilities.ApplicationInput, "OpenPgp", "OPENPGP"),
+    (capabilities.TouchSlotInput, "SIG", "sig"),
+    (capabilities.TouchPolicyInput, "Cached-Fixed", "cached-fixed"),
+])
+def test_inputs_accept_any_case(alias, raw, expected):
+    assert TypeAdapter(alias).validate_python(raw) == expected
+
+
+@pytest.mark.parametrize("alias, raw", [
+    (capabilities.TransportInput, "bluetooth"),
+    (capabilities.ApplicationInput, "ssh"),
+    (capabilities.TouchSlotInput, 1),
+])
+def test_inputs_reject_unknown_values(alias, raw):
+    with pytest.raises(ValidationError):
+        TypeAdapter(alias).validate_python(raw)
+
+
+def test_tool_schemas_keep_the_options():
+    tools = server.mcp._tool_manager
+    configure = tools.get_tool("configure_yubikey_applications").parameters["properties"]
+    assert configure["transport"]["enum"] == ["usb", "nfc"]
+    touch = tools.get_tool("set_openpgp_touch_policy").parameters["properties"]
+    assert touch["key_slot"]["enum"] == list(capabilities.TOUCH_SLOTS)
+    assert touch["policy"]["enum"] == list(capabilities.TOUCH_POLICIES)
+
+
+def test_manifest_entries_are_normalized():
+    entry = provisioning.ManifestEntry(serial=1, usb_disable="otp;Oath", touch_policies={"SIG": "ON"})
+    assert entry.usb_disable == ["OTP", "OATH"]
+    assert entry.touch_policies == {"sig": "on"}
+    with pytest.raises(ValidationError):
+        provisioning.ManifestEntry(serial=1, touch_policies={"xyz": "on"})
+
+
+class QuietContext:
+    async def info(self, message):
+        pass
+
+
+def test_tool_call_accepts_upper_case_touch_arguments(monkeypatch):
+    simulated = SimulatedYkman([1001])
+    monkeypatch.setattr(server, "_run_ykman_backend", simulated)
+    monkeypatch.setattr(server, "audit_trail", None)
+
+    async def call():
+        tool = server.mcp._tool_manager.get_tool("set_openpgp_touch_policy")
+        return await tool.run({"key_slot": "SIG", "policy": "ON", "admin_pin": "12345678", "serial_number": 1001},
+                              context=QuietContext())
+
+    response = asyncio.run(call())
+    assert response.status == "success", response.message
+    assert simulated.devices[1001]["touch"]["sig"] == "On"
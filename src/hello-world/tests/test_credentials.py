@@ -0,0 +1,128 @@
+"""TTL, use counts, zeroization and rejection handling of the session PIN cache."""
+
+import asyncio
+import subprocess
+
+import credentials
+import server
+from credentials import ANY_DEVICE, CredentialCache
+from device_agent import SimulatedYkman
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(credentials.time, "monotonic", clock)
+    cache = CredentialCache(ttl=60, max_uses=10)
+    cache.put(1001, "openpgp_pin", "123456")
+
+    clock.now += 59
+    assert cache.get(1001, "openpgp_pin") == "123456"
+    clock.now += 1
+    assert cache.get(1001, "openpgp_pin") is None
+    assert cache.summary() == []
+
+
+def test_expired_entries_are_zeroized_on_any_lookup(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(credentials.time, "monotonic", clock)
+    cache = CredentialCache(ttl=60, max_uses=10)
+    cache.put(1001, "openpgp_pin", "123456")
+    secret = cache._entries[(1001, "openpgp_pin")].secret
+    cache.put(1002, "fido2_pin", "654321", ttl=600)
+
+    clock.now += 61
+    assert cache.get(1002, "fido2_pin") == "654321"  # A lookup for another device
+    assert (1001, "openpgp_pin") not in cache._entries
+    assert secret == bytearray(len("123456"))
+
+
+def test_use_count_is_consumed_and_entry_zeroized():
+    cache = CredentialCache(ttl=60, max_uses=2)
+    cache.put(1001, "piv_pin", "123456")
+    secret = cache._entries[(1001, "piv_pin")].secret
+
+    assert cache.get(1001, "piv_pin") == "123456"
+    assert cache.summary()[0]["uses_left"] == 1
+    assert cache.get(1001, "piv_pin") == "123456"
+    assert cache.get(1001, "piv_pin") is None
+    assert secret == bytearray(6)
+
+
+def test_disabled_cache_stores_nothing():
+    cache = CredentialCache(ttl=0)
+    cache.put(1001, "piv_pin", "123456")
+    assert cache.get(1001, "piv_pin") is None
+
+
+def test_device_entry_takes_precedence_and_purge_zeroizes():
+    cache = CredentialCache(ttl=60, max_uses=10)
+    cache.put(None, "openpgp_admin_pin", "12345678")
+    cache.put(1001, "openpgp_admin_pin", "87654321")
+    assert cache.get(1001, "openpgp_admin_pin") == "87654321"
+    assert cache.get(1002, "openpgp_admin_pin") == "12345678"
+    assert cache.get(None, "openpgp_admin_pin") == "12345678"
+
+    device_secret = cache._entries[(1001, "openpgp_admin_pin")].secret
+    assert cache.purge(1001) == 1
+    assert device_secret == bytearray(8)
+    assert cache.get(1001, "openpgp_admin_pin") == "12345678"
+
+
+def test_discard_keeps_the_shared_entry_for_other_devices():
+    cache = CredentialCache(ttl=60, max_uses=10)
+    cache.put(None, "openpgp_admin_pin", "12345678")
+    cache.put(1002, "openpgp_admin_pin", "87654321")
+
+    cache.discard(1001, "openpgp_admin_pin")  # 1001 rejected the shared PIN
+    assert cache.get(1001, "openpgp_admin_pin") is None
+    assert cache.get(1003, "openpgp_admin_pin") == "12345678"
+
+    cache.discard(1002, "openpgp_admin_pin")  # Drops only 1002's own entry
+    assert cache.get(1002, "openpgp_admin_pin") == "12345678"
+
+    cache.discard(None, "openpgp_admin_pin")
+    assert (ANY_DEVICE, "openpgp_admin_pin") not in cache._entries
+
+
+class FailingYkman(SimulatedYkman):
+    """Simulated device whose set-touch fails with a given stderr."""
+
+    def __init__(self, serials, stderr):
+        super().__init__(serials)
+        self.stderr = stderr
+
+    def __call__(self, args):
+        if "set-touch" in args:
+            raise subprocess.CalledProcessError(1, ["ykman"] + args, "", self.stderr)
+        return super().__call__(args)
+
+
+class QuietContext:
+    async def info(self, message):
+        pass
+
+
+def test_openpgp_tools_only_discard_cached_pins_the_device_rejected(monkeypatch):
+    cache = CredentialCache(ttl=60, max_uses=10)
+    monkeypatch.setattr(server, "credential_cache", cache)
+    monkeypatch.setattr(server, "audit_trail", None)
+
+    def set_touch(stderr):
+        monkeypatch.setattr(server, "_run_ykman_backend", FailingYkman([1001], stderr))
+        cache.put(1001, "openpgp_admin_pin", "12345678")
+        response = asyncio.run(server.set_openpgp_touch_policy(QuietContext(), "sig", "on", serial_number=1001))
+        assert response.status == "error"
+
+    set_touch("Error: Failed to connect to YubiKey.\n")
+    assert cache.get(1001, "openpgp_admin_pin") == "12345678"
+
+    set_touch("Error: Invalid PIN/PUK, 2 remaining\n")
+    assert cache.get(1001, "openpgp_admin_pin") is None
@@ -0,0 +1,198 @@
+"""Aggregator routing across device agents serving simulated YubiKeys on localhost."""
+
+import asyncio
+import datetime
+import ipaddress
+import ssl
+import subprocess
+import threading
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from aggregator import AgentClient, AgentError, Aggregator, client_ssl_context
+from device_agent import DeviceAgent, SimulatedYkman, server_ssl_context
+
+TOKEN = "secret"
+
+
+class AgentHost:
+    """Runs DeviceAgents on ephemeral loopback ports in a background event loop."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.servers: list[asyncio.Server] = []
+
+    def start(self, agent: DeviceAgent, ssl_context: ssl.SSLContext | None = None) -> str:
+        async def start_server() -> asyncio.Server:
+            return await asyncio.start_server(agent.handle_connection, "127.0.0.1", 0, ssl=ssl_context)
+
+        server = asyncio.run_coroutine_threadsafe(start_server(), self.loop).result(timeout=5)
+        self.servers.append(server)
+        return f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+    def close(self) -> None:
+        async def stop() -> None:
+            for server in self.servers:
+                server.close()
+                await server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+
+
+@pytest.fixture
+def fleet():
+    host = AgentHost()
+    bench_a = SimulatedYkman([1001, 1002])
+    bench_b = SimulatedYkman([2001])
+    addresses = [
+        host.start(DeviceAgent(bench_a, TOKEN, "bench-a")),
+        host.start(DeviceAgent(bench_b, TOKEN, "bench-b")),
+    ]
+    clients = [AgentClient(address, TOKEN, timeout=5) for address in addresses]
+    try:
+        yield Aggregator(clients), bench_a, bench_b, addresses
+    finally:
+        for client in clients:
+            client.close()
+        host.close()
+
+
+def test_route_dispatches_by_device(fleet):
+    aggregator, bench_a, bench_b, _ = fleet
+
+    serials = aggregator.run(["list", "--serials"]).stdout.split()
+    assert sorted(serials) == ["1001", "1002", "2001"]
+    assert aggregator.route(1002).name == "bench-a"
+    assert aggregator.route(2001).name == "bench-b"
+
+    info = aggregator.run(["--device", "2001", "info"])
+    assert "Serial number: 2001" in info.stdout
+
+    aggregator.run(["--device", "2001", "config", "usb", "--disable", "OATH", "--force"])
+    assert bench_b.devices[2001]["usb"]["OATH"] == "Disabled"
+    assert all(device["usb"]["OATH"] == "Enabled" for device in bench_a.devices.values())
+
+
+def test_route_refreshes_inventory_on_miss(fleet):
+    aggregator, _, bench_b, _ = fleet
+    aggregator.inventory()
+    assert 2002 not in aggregator._routes
+
+    bench_b.devices[2002] = SimulatedYkman([2002]).devices[2002]  # Plugged in after the last refresh
+    assert aggregator.route(2002).name == "bench-b"
+    assert "Serial number: 2002" in aggregator.run(["--device", "2002", "info"]).stdout
+
+    assert aggregator.route(9999) is None
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        aggregator.run(["--device", "9999", "info"])
+    assert "No agent has a YubiKey with serial 9999" in error.value.stderr
+
+
+def test_bad_token_is_rejected(fleet):
+    _, _, _, addresses = fleet
+    client = AgentClient(addresses[0], "wrong", timeout=5)
+    with pytest.raises(AgentError, match="Authentication failed"):
+        client.call("list")
+
+    aggregator = Aggregator([client])
+    assert "Authentication failed" in aggregator.inventory()[client]
+    with pytest.raises(subprocess.CalledProcessError):
+        aggregator.run(["--device", "1001", "info"])
+
+
+def test_token_required_on_non_loopback_address():
+    agent = DeviceAgent(SimulatedYkman([1001]), token=None)
+    with pytest.raises(ValueError, match="token is required"):
+        asyncio.run(agent.serve("0.0.0.0", 0))
+
+
+def test_non_ascii_token_is_rejected_without_crashing(fleet):
+    _, _, _, addresses = fleet
+    client = AgentClient(addresses[0], "sécret", timeout=5)
+    with pytest.raises(AgentError, match="Authentication failed"):
+        client.call("list")
+
+    host = AgentHost()
+    try:
+        address = host.start(DeviceAgent(SimulatedYkman([1001]), "sécret"))
+        assert AgentClient(address, "sécret", timeout=5).call("ping") == "pong"
+    finally:
+        host.close()
+
+
+def test_tls_required_on_non_loopback_address():
+    agent = DeviceAgent(SimulatedYkman([1001]), token=TOKEN)
+    with pytest.raises(ValueError, match="TLS is required"):
+        asyncio.run(agent.serve("0.0.0.0", 0))
+
+
+def test_client_refuses_cleartext_to_remote_agents():
+    client = AgentClient("192.0.2.1:7391", TOKEN, timeout=1)
+    with pytest.raises(AgentError, match="YUBIKEY_AGENT_TLS_CA"):
+        client.call("list")
+
+
+def _write_certificate(directory, name: str) -> tuple[str, str]:
+    """Self-signed certificate for 127.0.0.1 (it is its own CA)."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_file, key_file = directory / f"{name}.pem", directory / f"{name}-key.pem"
+    cert_file.write_bytes(certificate.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return str(cert_file), str(key_file)
+
+
+def test_agent_over_mutual_tls(tmp_path):
+    agent_cert, agent_key = _write_certificate(tmp_path, "agent")
+    aggregator_cert, aggregator_key = _write_certificate(tmp_path, "aggregator")
+    stranger_cert, stranger_key = _write_certificate(tmp_path, "stranger")
+
+    host = AgentHost()
+    try:
+        address = host.start(
+            DeviceAgent(SimulatedYkman([1001]), TOKEN, "bench-tls"),
+            server_ssl_context(agent_cert, agent_key, client_ca_file=aggregator_cert),
+        )
+        client = AgentClient(address, TOKEN, timeout=5,
+                             ssl_context=client_ssl_context(agent_cert, aggregator_cert, aggregator_key))
+        assert "Serial: 1001" in client.call("list")[0]
+        assert client.name == "bench-tls"
+        client.close()
+
+        untrusted = AgentClient(address, TOKEN, timeout=5, ssl_context=client_ssl_context(stranger_cert))
+        with pytest.raises(AgentError, match="unreachable"):
+            untrusted.call("list")
+
+        no_client_certificate = AgentClient(address, TOKEN, timeout=5, ssl_context=client_ssl_context(agent_cert))
+        with pytest.raises(AgentError):
+            no_client_certificate.call("list")
+
+        cleartext = AgentClient(address, TOKEN, timeout=5)
+        with pytest.raises(AgentError):
+            cleartext.call("list")
+    finally:
+        host.close()
@@ -0,0 +1,96 @@
+"""Hot-plug watcher confirmation and the single-device fallback that depends on it."""
+
+import asyncio
+import subprocess
+
+import device_state
+import server
+
+LIST_OUTPUT = "YubiKey 5 NFC (5.4.3) [OTP+FIDO+CCID] Serial: 1001\n"
+
+
+class ScriptedList:
+    """`ykman list` that fails or succeeds according to a script, then keeps succeeding."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, args):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return subprocess.CompletedProcess(["ykman"] + args, 0, LIST_OUTPUT, "")
+
+
+async def wait_for(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.005)
+
+
+def watcher_for(command, cache=None):
+    return device_state.HotplugWatcher(
+        cache or device_state.DeviceStateCache(), command, cli_interval=0.01, use_scan=False
+    )
+
+
+def test_watcher_survives_unexpected_errors():
+    async def scenario():
+        command = ScriptedList(RuntimeError("unexpected output"), subprocess.CalledProcessError(1, ["ykman"]))
+        watcher = watcher_for(command)
+        assert not watcher.confirmed
+        watcher.start()
+        await wait_for(lambda: command.calls >= 3 and watcher.confirmed)
+        assert not watcher._task.done()
+        await watcher.stop()
+        return watcher
+
+    watcher = asyncio.run(scenario())
+    assert not watcher.confirmed
+    assert list(watcher.cache.inventory) == [1001]
+
+
+def test_failed_poll_clears_confirmation():
+    async def scenario():
+        command = ScriptedList("ok")
+        watcher = watcher_for(command)
+        watcher.start()
+        await wait_for(lambda: watcher.confirmed)
+        command.outcomes = [FileNotFoundError("ykman")] * 1000
+        await wait_for(lambda: not watcher.confirmed)
+        await watcher.stop()
+
+    asyncio.run(scenario())
+
+
+def test_watcher_exit_resets_confirmation_and_marks_state_stale():
+    async def scenario():
+        cache = device_state.DeviceStateCache()
+        watcher = watcher_for(ScriptedList(), cache)
+        watcher.start()
+        await wait_for(lambda: watcher.confirmed)
+        cache.set(1001, "info", "Device type: YubiKey 5 NFC")
+
+        watcher._task.cancel()  # Exits without going through stop()
+        await asyncio.gather(watcher._task, return_exceptions=True)
+        return watcher, cache
+
+    watcher, cache = asyncio.run(scenario())
+    assert not watcher.confirmed
+    assert cache.get(1001, "info").stale
+
+
+def test_single_device_fallback_needs_a_confirmed_inventory(monkeypatch):
+    cache = device_state.DeviceStateCache()
+    cache.update_inventory([LIST_OUTPUT.strip()])
+    watcher = watcher_for(ScriptedList(), cache)
+    monkeypatch.setattr(server, "device_state_cache", cache)
+    monkeypatch.setattr(server, "hotplug_watcher", watcher)
+
+    assert server.resolve_cached_serial(None) is None
+    watcher.confirmed = True
+    assert server.resolve_cached_serial(None) == 1001
+    assert server.resolve_cached_serial(2002) == 2002
@@ -0,0 +1,51 @@
+"""The private FastMCP/lowlevel server attributes server.py hooks into.
+
+server.py reaches past the public FastMCP API (the lowlevel server behind
+mcp._mcp_server, its call_tool and get_capabilities, and the tool manager's
+fn_metadata). These tests fail when an SDK upgrade moves any of them.
+"""
+
+import asyncio
+import inspect
+
+from mcp import types
+from mcp.server.fastmcp.exceptions import ToolError
+from mcp.server.lowlevel.server import Server
+
+import admission
+import server
+from server import YubiKeyResponse
+
+
+def test_lowlevel_server_is_reachable():
+    assert isinstance(server.mcp._mcp_server, Server)
+    assert "validate_input" in inspect.signature(Server.call_tool).parameters
+
+
+def test_busy_tool_call_is_answered_through_the_lowlevel_handler(monkeypatch):
+    async def busy(name, arguments):
+        raise ToolError("YubiKey 1001 is busy") from admission.BusyError("YubiKey 1001 is busy", 250)
+
+    monkeypatch.setattr(server.mcp, "call_tool", busy)
+    handler = server.mcp._mcp_server.request_handlers[types.CallToolRequest]
+    request = types.CallToolRequest(
+        method="tools/call", params=types.CallToolRequestParams(name="set_openpgp_touch_policy", arguments={})
+    )
+    result = asyncio.run(handler(request)).root
+    assert not result.isError
+    assert result.structuredContent["status"] == "busy"
+    assert result.structuredContent["data"] == {"retry_after_ms": 250}
+
+
+def test_tool_metadata_exposes_the_output_model():
+    tool = server.mcp._tool_manager.get_tool("set_openpgp_touch_policy")
+    assert tool.fn_metadata.output_model is YubiKeyResponse
+    converted = tool.fn_metadata.convert_result(server.build_response("busy", "wait", retry_after_ms=25))
+    assert converted is not None
+
+
+def test_capabilities_advertise_resource_subscriptions():
+    assert server.mcp._mcp_server.get_capabilities is server._get_capabilities_with_subscriptions
+    options = server.mcp._mcp_server.create_initialization_options()
+    assert options.capabilities.resources.subscribe is True
+    assert options.capabilities.resources.listChanged is True
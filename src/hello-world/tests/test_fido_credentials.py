@@ -0,0 +1,116 @@
+"""Cursor stability of paginated FIDO2 credential listings across deletes."""
+
+import subprocess
+
+import pytest
+
+from fido_credentials import (
+    CliCredentialSource, CredentialListing, CredentialListingError, ResidentCredential, encode_cursor
+)
+
+
+def credential(number: int) -> ResidentCredential:
+    return ResidentCredential(
+        credential_id=f"{number:02x}" * 16,
+        rp_id=f"rp{number}.example.com",
+        user_name=f"user{number}",
+        user_display_name=f"User {number}",
+        user_id=f"{number:02x}",
+    )
+
+
+class ListSource:
+    """In-memory source that hands out credentials in order and records deletes."""
+
+    def __init__(self, count: int):
+        self.credentials = [credential(number) for number in range(1, count + 1)]
+        self.position = 0
+        self.deleted: list[str] = []
+
+    @property
+    def total(self) -> int:
+        return len(self.credentials)
+
+    def fetch(self, count: int) -> list[ResidentCredential]:
+        batch = self.credentials[self.position:self.position + count]
+        self.position += len(batch)
+        return batch
+
+    def delete(self, credential_id: str) -> None:
+        self.deleted.append(credential_id)
+
+    def close(self) -> None:
+        pass
+
+
+def rp_ids(page) -> list[str]:
+    return [c.rp_id.split(".")[0] for c in page.credentials]
+
+
+def test_pages_cover_every_credential_once():
+    listing = CredentialListing(ListSource(5), ttl=60)
+    first = listing.page(None, 2)
+    second = listing.page(first.next_cursor, 2)
+    third = listing.page(second.next_cursor, 2)
+    assert rp_ids(first) + rp_ids(second) + rp_ids(third) == ["rp1", "rp2", "rp3", "rp4", "rp5"]
+    assert third.next_cursor is None
+    assert third.complete and third.total == 5
+
+
+def test_deleting_the_cursor_credential_does_not_skip_the_next_one():
+    listing = CredentialListing(ListSource(5), ttl=60)
+    first = listing.page(None, 2)
+    listing.delete(first.credentials[-1].credential_id)  # rp2, which the cursor names
+
+    second = listing.page(first.next_cursor, 2)
+    assert rp_ids(second) == ["rp3", "rp4"]
+
+
+def test_deleting_an_earlier_credential_does_not_repeat_one():
+    listing = CredentialListing(ListSource(5), ttl=60)
+    first = listing.page(None, 2)
+    listing.delete(first.credentials[0].credential_id)  # rp1
+
+    second = listing.page(first.next_cursor, 2)
+    assert rp_ids(second) == ["rp3", "rp4"]
+    third = listing.page(second.next_cursor, 2)
+    assert rp_ids(third) == ["rp5"]
+    assert third.total == 4
+
+
+def test_cursor_resumes_on_a_fresh_listing():
+    first = CredentialListing(ListSource(5), ttl=60).page(None, 2)
+    # The cached listing expired and the device is enumerated again
+    second = CredentialListing(ListSource(5), ttl=60).page(first.next_cursor, 2)
+    assert rp_ids(second) == ["rp3", "rp4"]
+
+
+def test_offset_only_cursor_and_invalid_cursor():
+    listing = CredentialListing(ListSource(3), ttl=60)
+    assert rp_ids(listing.page(encode_cursor(1, None), 5)) == ["rp2", "rp3"]
+    with pytest.raises(CredentialListingError, match="Invalid cursor"):
+        listing.page("not-a-cursor", 5)
+
+
+def test_cli_source_pages_the_csv_listing_and_hides_the_pin():
+    csv = "credential_id,rp_id,user_name,user_display_name,user_id\n" + "".join(
+        f"{c.credential_id},{c.rp_id},{c.user_name},{c.user_display_name},{c.user_id}\n"
+        for c in map(credential, range(1, 4))
+    )
+    calls = []
+
+    def run_command(args):
+        calls.append(args)
+        if "delete" in args:
+            raise subprocess.CalledProcessError(1, ["ykman"] + args, "", "Error: Wrong PIN.\n")
+        return subprocess.CompletedProcess(["ykman"] + args, 0, csv, "")
+
+    listing = CredentialListing(CliCredentialSource(run_command, 1001, "123456"), ttl=60)
+    first = listing.page(None, 2)
+    assert rp_ids(listing.page(first.next_cursor, 2)) == ["rp3"]
+    assert len(calls) == 1
+
+    with pytest.raises(CredentialListingError) as error:
+        listing.delete(first.credentials[0].credential_id)
+    assert str(error.value) == "Error: Wrong PIN."
+    assert "123456" not in str(error.value)
@@ -0,0 +1,126 @@
+"""Challenge parsing, per-item error isolation and per-device ordering of the OTP challenge pool."""
+
+import asyncio
+import hashlib
+import hmac
+import subprocess
+import threading
+import time
+
+import pytest
+
+from otp_challenge import (
+    MAX_BATCH_SIZE, ChallengeResponseError, ChallengeResponsePool, ChallengeTimeoutError, CliChallengeBackend,
+    parse_challenges
+)
+
+SECRET = b"\x01" * 20
+
+
+def test_parse_challenges_decodes_hex():
+    assert parse_challenges(["00", "DEADbeef", "ab" * 64]) == [b"\x00", b"\xde\xad\xbe\xef", b"\xab" * 64]
+
+
+@pytest.mark.parametrize("challenges, message", [
+    ([], "At least one challenge"),
+    (["00"] * (MAX_BATCH_SIZE + 1), f"At most {MAX_BATCH_SIZE}"),
+    (["zz"], "not valid hex: zz"),
+    (["abc"], "not valid hex: abc"),
+    ([""], "1-64 bytes, got 0"),
+    (["ab" * 65], "1-64 bytes, got 65"),
+])
+def test_parse_challenges_rejects(challenges, message):
+    with pytest.raises(ValueError, match=message):
+        parse_challenges(challenges)
+
+
+class ScriptedBackend:
+    """HMAC-SHA1 backend; b"touch" waits for a touch that never comes, b"fail" raises, b"crash" breaks."""
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.seen: list[bytes] = []
+        self.threads: set[str] = set()
+        self.closed = False
+
+    def calculate(self, slot, challenge, touch_timeout, on_touch):
+        self.seen.append(challenge)
+        self.threads.add(threading.current_thread().name)
+        if challenge == b"touch":
+            on_touch()
+            raise ChallengeTimeoutError("cancelled")
+        if challenge == b"fail":
+            raise ChallengeResponseError("Slot 2 is not configured for challenge-response")
+        if challenge == b"crash":
+            raise OSError()
+        return hmac.new(SECRET, challenge, hashlib.sha1).digest()
+
+    def close(self):
+        self.closed = True
+
+
+def test_one_failing_challenge_does_not_fail_the_batch():
+    backends = {}
+
+    def factory(serial):
+        backends[serial] = ScriptedBackend(serial)
+        return backends[serial]
+
+    pool = ChallengeResponsePool(factory)
+    touches = []
+    challenges = [b"one", b"touch", b"fail", b"crash", b"two"]
+    results = asyncio.run(pool.calculate(1001, 2, challenges, touch_timeout=3, on_touch=lambda: touches.append(1)))
+    pool.close_all()
+
+    assert [result.challenge for result in results] == [c.hex() for c in challenges]
+    assert results[0].response == hmac.new(SECRET, b"one", hashlib.sha1).hexdigest()
+    assert results[4].response == hmac.new(SECRET, b"two", hashlib.sha1).hexdigest()
+    assert results[1].error == "No touch within 3s" and results[1].touched
+    assert results[2].error == "Slot 2 is not configured for challenge-response"
+    assert results[3].error == "OSError"
+    assert [result.response is None for result in results] == [False, True, True, True, False]
+    assert touches == [1]
+
+    backend = backends[1001]
+    assert backend.seen == challenges  # Submission order on the device
+    assert len(backend.threads) == 1
+
+
+def test_devices_get_their_own_workers_and_are_closed_when_dropped():
+    backends = {}
+
+    def factory(serial):
+        backends[serial] = ScriptedBackend(serial)
+        return backends[serial]
+
+    async def scenario(pool):
+        return await asyncio.gather(pool.calculate(1001, 2, [b"a"]), pool.calculate(1002, 2, [b"b"]))
+
+    pool = ChallengeResponsePool(factory)
+    first, second = asyncio.run(scenario(pool))
+    assert first[0].error is None and second[0].error is None
+    assert backends[1001].threads != backends[1002].threads
+
+    pool.drop(1001)
+    pool.close_all()
+    deadline = time.monotonic() + 2
+    while not all(backend.closed for backend in backends.values()):  # Closed on each worker thread
+        assert time.monotonic() < deadline, "workers did not close their backends"
+        time.sleep(0.01)
+
+
+def test_cli_backend_maps_ykman_errors():
+    def run_command(args):
+        challenge = args[-1]
+        if challenge == "01":
+            raise subprocess.CalledProcessError(1, ["ykman"] + args, "", "Error: Touch timed out\n")
+        if challenge == "02":
+            raise subprocess.CalledProcessError(2, ["ykman"] + args, "", "")
+        return subprocess.CompletedProcess(["ykman"] + args, 0, "abcd\n", "")
+
+    backend = CliChallengeBackend(run_command, 1001)
+    assert backend.calculate(2, b"\x00", 15, lambda: None) == b"\xab\xcd"
+    with pytest.raises(ChallengeTimeoutError, match="Touch timed out"):
+        backend.calculate(2, b"\x01", 15, lambda: None)
+    with pytest.raises(ChallengeResponseError, match="ykman exited with 2"):
+        backend.calculate(2, b"\x02", 15, lambda: None)
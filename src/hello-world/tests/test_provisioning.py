@@ -0,0 +1,108 @@
+"""Checkpoint/resume of the provisioning pipeline, and OpenPGP stages staying on local devices."""
+
+import asyncio
+
+import pytest
+
+import device_agent
+import provisioning
+import server
+from device_agent import SimulatedYkman
+from provisioning import CheckpointStore, ManifestEntry, ProvisioningPipeline, Stage
+
+
+class FlakyStages:
+    """Two stages; "second" fails for the serials in fail_second."""
+
+    def __init__(self, fail_second: set[int]):
+        self.fail_second = fail_second
+        self.calls: list[tuple[str, int]] = []
+
+    async def first(self, entry: ManifestEntry) -> str:
+        self.calls.append(("first", entry.serial))
+        return "first done"
+
+    async def second(self, entry: ManifestEntry) -> str:
+        self.calls.append(("second", entry.serial))
+        if entry.serial in self.fail_second:
+            raise provisioning.StageError("card removed")
+        return "second done"
+
+    def stages(self) -> list[Stage]:
+        return [Stage("first", lambda e: True, self.first), Stage("second", lambda e: True, self.second)]
+
+
+def run_batch(path, runner: FlakyStages, serials: list[int], attached: set[int]) -> provisioning.BatchSummary:
+    checkpoints = CheckpointStore(path)
+    try:
+        pipeline = ProvisioningPipeline(runner.stages(), checkpoints, concurrency=2)
+        entries = iter([ManifestEntry(serial=serial) for serial in serials])
+        return asyncio.run(pipeline.run("batch-1", entries, attached))
+    finally:
+        checkpoints.close()
+
+
+def test_resume_skips_done_stages_and_retries_failed_ones(tmp_path):
+    path = tmp_path / "provisioning.db"
+    serials = [1001, 1002, 1003]
+
+    first_run = FlakyStages(fail_second={1002})
+    summary = run_batch(path, first_run, serials, attached={1001, 1002})
+    assert sorted(summary.completed) == [1001]
+    assert summary.failed == {1002: "second: card removed"}
+    assert summary.not_attached == [1003]
+
+    checkpoints = CheckpointStore(path)
+    assert checkpoints.batch_status("batch-1") == {
+        1001: {"first": "done", "second": "done"},
+        1002: {"first": "done", "second": "failed"},
+    }
+    checkpoints.close()
+
+    # Interrupted batch resumed with the failure fixed and the missing device plugged in
+    second_run = FlakyStages(fail_second=set())
+    summary = run_batch(path, second_run, serials, attached={1001, 1002, 1003})
+    assert summary.already_done == [1001]
+    assert sorted(summary.completed) == [1002, 1003]
+    assert sorted(second_run.calls) == [("first", 1003), ("second", 1002), ("second", 1003)]
+
+
+def test_duplicate_serials_are_provisioned_once(tmp_path):
+    runner = FlakyStages(fail_second=set())
+    summary = run_batch(tmp_path / "provisioning.db", runner, [1001, 1001], attached={1001})
+    assert summary.completed == [1001]
+    assert summary.duplicates == [1001]
+    assert len(runner.calls) == 2
+
+
+class QuietContext:
+    async def info(self, message):
+        pass
+
+
+def test_openpgp_key_stage_refuses_remote_devices_in_aggregator_mode(monkeypatch):
+    fleet = SimulatedYkman([1001, 2001])
+    monkeypatch.setattr(server, "_run_ykman_backend", fleet)
+    monkeypatch.setattr(server, "agent_aggregator", object())
+    monkeypatch.setattr(server, "audit_trail", None)
+    monkeypatch.setattr(device_agent, "run_local_ykman", SimulatedYkman([1001]))
+
+    def no_gpg(*args, **kwargs):
+        raise AssertionError("GPG must not start for a device on another host")
+
+    monkeypatch.setattr(server, "spawn_gpg", no_gpg)
+
+    stage = next(s for s in server.build_provisioning_stages(QuietContext()) if s.name == "openpgp_key")
+    entry = ManifestEntry(serial=2001, openpgp_name="Bench", openpgp_email="bench@example.com", pin="123456")
+    with pytest.raises(provisioning.StageError, match="not attached to this host"):
+        asyncio.run(stage.run(entry))
+
+
+def test_gpg_card_check_only_counts_local_devices(monkeypatch):
+    monkeypatch.setattr(server, "_run_ykman_backend", SimulatedYkman([1001, 2001]))
+    monkeypatch.setattr(server, "agent_aggregator", object())
+    monkeypatch.setattr(device_agent, "run_local_ykman", SimulatedYkman([1001]))
+
+    asyncio.run(server.ensure_gpg_card("Reader ...........: Yubico YubiKey\n", 1001))
+    with pytest.raises(ValueError, match="The attached YubiKey is 1001, not 2001"):
+        asyncio.run(server.ensure_gpg_card("Reader ...........: Yubico YubiKey\n", 2001))
@@ -0,0 +1,133 @@
+"""Recording a session with SessionRecorder and replaying it with SessionReplay."""
+
+import asyncio
+import gzip
+import subprocess
+
+import pexpect
+import pytest
+
+import session_trace
+from session_trace import RecordingSpawn, SessionRecorder, SessionReplay
+
+
+class Backend:
+    """ykman stand-in: echoes the PIN on a wrong-PIN error and counts `list` calls."""
+
+    def __init__(self):
+        self.lists = 0
+
+    def __call__(self, args):
+        cmd = ["ykman"] + args
+        if args == ["list"]:
+            self.lists += 1
+            return subprocess.CompletedProcess(cmd, 0, f"YubiKey 5 NFC Serial: 100{self.lists}\n", "")
+        if "--pin" in args:
+            pin = args[args.index("--pin") + 1]
+            raise subprocess.CalledProcessError(1, cmd, "", f"Error: PIN {pin} rejected, 2 remaining\n")
+        return subprocess.CompletedProcess(cmd, 0, "Device type: YubiKey 5 NFC\n", "")
+
+
+class FakeChild:
+    """Scripted pexpect.spawn that echoes what was sent into `before`."""
+
+    def __init__(self):
+        self.before = ""
+        self.echo = ""
+
+    def expect(self, pattern, timeout=-1, **kwargs):
+        self.before, self.echo = f"{self.echo}Admin PIN: ", ""
+        if pattern == "never":
+            raise pexpect.TIMEOUT("timed out")
+        return 1
+
+    def sendline(self, s=""):
+        self.echo += s + "\n"
+        return len(s) + 1
+
+    def close(self, force=True):
+        pass
+
+
+def record(path):
+    recorder = SessionRecorder(path)
+    backend = Backend()
+    recorder.run(backend, ["list"])
+    recorder.run(backend, ["list"])
+    recorder.run(backend, ["--device", "1001", "info"])
+    with pytest.raises(subprocess.CalledProcessError):
+        recorder.run(backend, ["--device", "1001", "openpgp", "access", "verify-pin", "--pin", "12345678"])
+
+    child = RecordingSpawn(recorder, "gpg --card-edit", FakeChild())
+    assert child.expect(["a", "b"]) == 1
+    child.sendline("12345678")
+    assert child.expect(["a", "b"]) == 1
+    with pytest.raises(pexpect.TIMEOUT):
+        child.expect("never")
+    child.close()
+    recorder.close()
+
+
+def test_trace_never_contains_secrets(tmp_path):
+    path = tmp_path / "session.ndjson.gz"
+    record(path)
+    with gzip.open(path, "rt") as f:
+        text = f.read()
+    assert "12345678" not in text
+    assert text.count("****") >= 3  # Argument, echoed stderr, echoed GPG input
+
+
+def test_replay_answers_from_the_trace(tmp_path):
+    path = tmp_path / "session.ndjson.gz"
+    record(path)
+    replay = SessionReplay(path, speed=0)
+
+    assert replay.run(["list"]).stdout == "YubiKey 5 NFC Serial: 1001\n"
+    assert replay.run(["list"]).stdout == "YubiKey 5 NFC Serial: 1002\n"
+    assert replay.run(["list"]).stdout == "YubiKey 5 NFC Serial: 1002\n"  # Last answer repeats
+    assert replay.run(["--device", "1001", "info"]).stdout == "Device type: YubiKey 5 NFC\n"
+
+    # Matched by masked arguments, so any PIN replays the recorded failure
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        replay.run(["--device", "1001", "openpgp", "access", "verify-pin", "--pin", "00000000"])
+    assert error.value.stderr == "Error: PIN **** rejected, 2 remaining\n"
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        replay.run(["--device", "2002", "info"])
+    assert "command not in trace" in error.value.stderr
+
+
+def test_replayed_gpg_dialogue(tmp_path):
+    path = tmp_path / "session.ndjson.gz"
+    record(path)
+    replay = SessionReplay(path, speed=0)
+
+    child = replay.spawn("gpg --card-edit")
+    assert child.expect(["a", "b"]) == 1
+    assert child.before == "Admin PIN: "
+    child.sendline("00000000")
+    assert asyncio.run(child.expect(["a", "b"], async_=True)) == 1
+    assert child.before == "****\nAdmin PIN: "
+    with pytest.raises(pexpect.TIMEOUT):
+        child.expect(["a", "b"])
+    with pytest.raises(pexpect.EOF):
+        child.expect(["a", "b"])
+
+    with pytest.raises(pexpect.EOF, match="No recorded session"):
+        replay.spawn("gpg --card-edit")
+
+
+def test_summary_and_drive(tmp_path):
+    path = tmp_path / "session.ndjson.gz"
+    record(path)
+    events = session_trace.read_trace(path)
+
+    summary = session_trace.summarize(events)
+    assert summary["ykman list"]["count"] == 2
+    assert summary["ykman info"]["count"] == 1
+    assert summary["ykman openpgp access verify-pin"]["count"] == 1
+    assert summary["gpg --card-edit"]["count"] == 1
+
+    replay = SessionReplay(path, speed=0)
+    latencies = asyncio.run(session_trace.drive(events, replay.run, speed=0))
+    assert len(latencies) == 4
@@ -0,0 +1,65 @@
+"""Round trip of the SQLite state store through its writer thread, and warm restarts from it."""
+
+import threading
+
+import device_state
+from state_store import StateStore
+
+LIST_LINE = "YubiKey 5 NFC (5.4.3) [OTP+FIDO+CCID] Serial: 1001"
+
+
+def test_state_round_trips_across_a_reopen(tmp_path):
+    path = tmp_path / "state.db"
+    store = StateStore(path)
+    store.save_inventory([LIST_LINE], {1001: LIST_LINE}, 100.0)
+    store.save_state(1001, "info", "Device type: YubiKey 5 NFC", 101.0)
+    store.save_state(1001, "applications", {"usb": {"PIV": "Enabled"}}, 102.0)
+    store.save_state(1001, "info", "Device type: YubiKey 5 NFC\nSerial number: 1001", 103.0)
+    store.record_operation(1001, "ykman --device 1001 info", "success", duration_ms=12.34)
+    store.record_operation(None, "ykman list", "error", "ykman not found")
+    store.close()
+
+    store = StateStore(path)
+    stored = store.load()
+    assert stored.inventory_lines == [LIST_LINE]
+    assert stored.inventory_updated_at == 100.0
+    assert stored.entries == {1001: {
+        "info": ("Device type: YubiKey 5 NFC\nSerial number: 1001", 103.0),
+        "applications": ({"usb": {"PIV": "Enabled"}}, 102.0),
+    }}
+    history = store.history()
+    assert [(op["serial_number"], op["status"]) for op in history] == [(None, "error"), (1001, "success")]
+    assert history[1]["duration_ms"] == 12.3
+    assert store.history(serial=1001, status="error") == []
+    assert store.known_devices()[0]["attached"]
+    store.close()
+
+
+def test_writes_return_without_waiting_for_sqlite(tmp_path):
+    store = StateStore(tmp_path / "state.db")
+    with store._lock:  # Stalls the writer as a slow commit would
+        writer = threading.Thread(target=store.record_operation, args=(1001, "ykman info", "success"))
+        writer.start()
+        writer.join(1.0)
+        assert not writer.is_alive()
+        assert store.written == 0
+    assert store.flush()
+    assert store.written == 1
+    assert len(store.history()) == 1
+    store.close()
+
+
+def test_cache_restores_stale_state_from_the_store(tmp_path):
+    path = tmp_path / "state.db"
+    cache = device_state.DeviceStateCache()
+    cache.restore(StateStore(path))
+    cache.update_inventory([LIST_LINE])
+    cache.set(1001, "info", "Device type: YubiKey 5 NFC")
+    cache.store.close()
+
+    restarted = device_state.DeviceStateCache()
+    restarted.restore(StateStore(path))
+    assert list(restarted.inventory) == [1001]
+    assert restarted.get(1001, "info").value == "Device type: YubiKey 5 NFC"
+    assert restarted.get(1001, "info").stale
+    restarted.store.close()
@@ -0,0 +1,101 @@
+"""Timeout, crash and recycle handling of the warm ykman worker pool, against a stub ykman."""
+
+import subprocess
+import textwrap
+
+import pytest
+
+from ykman_workers import YkmanWorkerPool
+
+STUB_CLI = '''
+import os
+import sys
+import time
+
+
+def main():
+    command = sys.argv[1]
+    if command == "pid":
+        print(os.getpid())
+    elif command == "sleep":
+        time.sleep(30)
+    elif command == "crash":
+        os._exit(3)
+    elif command == "fail":
+        print("Error: No YubiKey detected!", file=sys.stderr)
+        sys.exit(2)
+'''
+
+
+@pytest.fixture
+def stub_ykman(tmp_path, monkeypatch):
+    """A `ykman._cli.__main__` on PYTHONPATH that the worker processes import instead of ykman."""
+    package = tmp_path / "ykman" / "_cli"
+    package.mkdir(parents=True)
+    (tmp_path / "ykman" / "__init__.py").write_text("")
+    (package / "__init__.py").write_text("")
+    (package / "__main__.py").write_text(textwrap.dedent(STUB_CLI))
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path))
+
+
+@pytest.fixture
+def pool(stub_ykman):
+    pool = YkmanWorkerPool(size=1, max_calls=3, call_timeout=2)
+    yield pool
+    pool.shutdown()
+
+
+def pid(pool):
+    return int(pool.run(["pid"]).stdout)
+
+
+def test_workers_are_reused_and_recycled_after_max_calls(pool):
+    first = pid(pool)
+    assert pid(pool) == first
+    assert pid(pool) == first
+    assert pid(pool) != first  # The fourth call runs in a fresh worker
+    assert pool.stats["spawned"] == 2
+    assert pool.stats["recycled"] == 1
+
+
+def test_failed_command_keeps_the_worker(pool):
+    first = pid(pool)
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        pool.run(["fail"])
+    assert error.value.returncode == 2
+    assert error.value.stderr == "Error: No YubiKey detected!\n"
+    assert pid(pool) == first
+
+
+def test_crashed_worker_is_replaced(pool):
+    first = pid(pool)
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        pool.run(["crash"])
+    assert error.value.returncode == 3
+    assert "worker crashed" in error.value.stderr
+    assert pid(pool) != first
+    assert pool.stats["crashed"] == 1
+
+
+def test_hung_worker_is_killed_after_the_call_timeout(stub_ykman):
+    pool = YkmanWorkerPool(size=1, call_timeout=0.5)
+    try:
+        first = pid(pool)
+        with pytest.raises(subprocess.CalledProcessError) as error:
+            pool.run(["sleep"])
+        assert error.value.returncode == -1
+        assert "did not finish within" in error.value.stderr
+        assert pid(pool) != first
+        assert pool.stats["timeouts"] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_missing_ykman_surfaces_as_file_not_found(tmp_path, monkeypatch):
+    (tmp_path / "ykman").mkdir()
+    (tmp_path / "ykman" / "__init__.py").write_text("")  # A ykman without the _cli package
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path))
+    pool = YkmanWorkerPool(size=1)
+    with pytest.raises(FileNotFoundError, match="could not import ykman"):
+        pool.run(["list"])
+    assert pool._spawned == 0
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+YubiKey Manager Worker - Entry point of one warm ykman worker process.
+
+Started by ykman_workers.YkmanWorkerPool as `python ykman_worker.py`. It is
+deliberately a small, standalone module: starting it imports only the
+standard library and ykman, never server.py, so a worker (re)start has no
+side effects on the server's state.
+
+Protocol: one JSON object per line. Requests arrive on stdin
+({"op": "run", "args": [...]}, {"op": "ping"} or {"op": "stop"}); replies go
+to the original stdout ({"op": "ready"|"import_error"|"result"|"pong", ...}).
+File descriptor 1 is pointed at stderr once the worker starts, so anything
+written directly to it cannot corrupt the reply stream.
+"""
+
+import io
+import json
+import logging
+import os
+import sys
+
+
+def _invoke_ykman(ykman_cli, args: list[str]) -> tuple[int, str, str]:
+    """Run one ykman CLI invocation in this process, capturing its output."""
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf-8", write_through=True)
+    stderr = io.TextIOWrapper(io.BytesIO(), encoding="utf-8", write_through=True)
+
+    saved = sys.argv, sys.stdin, sys.stdout, sys.stderr
+    root_logger = logging.getLogger()
+    saved_handlers, saved_level = list(root_logger.handlers), root_logger.level
+
+    sys.argv = ["ykman"] + list(args)
+    sys.stdin = io.StringIO("")  # Prompts fail fast instead of blocking, like a non-interactive subprocess
+    sys.stdout, sys.stderr = stdout, stderr
+    returncode = 0
+    try:
+        ykman_cli.main()
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            returncode = e.code
+        elif e.code is not None:
+            stderr.write(f"{e.code}\n")
+            returncode = 1
+    except BaseException as e:
+        stderr.write(f"Error: {e}\n")
+        returncode = 1
+    finally:
+        sys.argv, sys.stdin, sys.stdout, sys.stderr = saved
+        # ykman's main() installs a logging handler on every call
+        root_logger.handlers = saved_handlers
+        root_logger.setLevel(saved_level)
+
+    return (
+        returncode,
+        stdout.buffer.getvalue().decode("utf-8", errors="replace"),
+        stderr.buffer.getvalue().decode("utf-8", errors="replace"),
+    )
+
+
+def main() -> None:
+    """Import ykman once, then serve requests until stdin closes or "stop" arrives."""
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def reply(message: dict) -> None:
+        replies.write(json.dumps(message) + "\n")
+        replies.flush()
+
+    try:
+        from ykman._cli import __main__ as ykman_cli
+    except ImportError as e:
+        reply({"op": "import_error", "detail": str(e)})
+        return
+
+    reply({"op": "ready", "pid": os.getpid()})
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        op = request.get("op")
+        if op == "run":
+            returncode, stdout, stderr = _invoke_ykman(ykman_cli, request["args"])
+            reply({"op": "result", "returncode": returncode, "stdout": stdout, "stderr": stderr})
+        elif op == "ping":
+            reply({"op": "pong"})
+        elif op == "stop":
+            return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+YubiKey Manager Workers - Warm ykman processes for the CLI execution path.
+
+Each worker is a long-lived process (ykman_worker.py) that imports ykman once
+and then runs CLI invocations through ykman's own entry point, with
+stdin/stdout/stderr redirected per call. This keeps the isolation of running
+ykman out of process while avoiding the interpreter start-up and import cost
+of spawning `ykman` for every command.
+"""
+
+import atexit
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+# Defaults, overridable with environment variables
+DEFAULT_POOL_SIZE = int(os.environ.get("YKMAN_WORKER_POOL_SIZE", "0"))  # 0 = disabled, spawn ykman per call
+DEFAULT_MAX_CALLS = int(os.environ.get("YKMAN_WORKER_MAX_CALLS", "200"))
+DEFAULT_CALL_TIMEOUT = float(os.environ.get("YKMAN_WORKER_CALL_TIMEOUT", "60"))  # Long enough for a touch prompt
+DEFAULT_HEALTH_CHECK_INTERVAL = 30.0  # Ping workers idle for longer than this before reuse
+STARTUP_TIMEOUT = 30.0
+PING_TIMEOUT = 5.0
+
+# Standalone entry module: starting a worker never imports server.py
+WORKER_SCRIPT = Path(__file__).with_name("ykman_worker.py")
+
+
+class WorkerUnavailableError(Exception):
+    """Raised when a worker cannot be started (e.g. ykman is not importable)."""
+
+
+# ============================================================================
+# Pool
+# ============================================================================
+
+class YkmanWorker:
+    """Handle to one warm worker process, speaking JSON lines over its stdin/stdout."""
+
+    def __init__(self):
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, str(WORKER_SCRIPT)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                start_new_session=True,  # No controlling terminal, so getpass() cannot block on /dev/tty
+            )
+        except OSError as e:
+            raise WorkerUnavailableError(f"ykman worker failed to start: {e}") from e
+        self._replies: queue.Queue[dict[str, Any] | None] = queue.Queue()
+        self._reader = threading.Thread(target=self._read_replies, name="ykman-worker-reader", daemon=True)
+        self._reader.start()
+        self.calls = 0
+        self.last_used = time.monotonic()
+
+        try:
+            reply = self._receive(STARTUP_TIMEOUT)
+        except (EOFError, subprocess.TimeoutExpired) as e:
+            self.kill()
+            raise WorkerUnavailableError(f"ykman worker failed to start: {e}") from e
+        if reply.get("op") != "ready":
+            self.kill()
+            raise WorkerUnavailableError(f"ykman worker could not import ykman: {reply.get('detail')}")
+
+    def _read_replies(self) -> None:
+        for line in self.process.stdout:
+            try:
+                self._replies.put(json.loads(line))
+            except ValueError:
+                continue
+        self._replies.put(None)  # Worker exited
+
+    def _send(self, message: dict[str, Any]) -> None:
+        self.process.stdin.write(json.dumps(message) + "\n")
+        self.process.stdin.flush()
+
+    def _receive(self, timeout: float | None) -> dict[str, Any]:
+        try:
+            reply = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            raise subprocess.TimeoutExpired([str(WORKER_SCRIPT)], timeout) from None
+        if reply is None:
+            raise EOFError("ykman worker exited")
+        return reply
+
+    @property
+    def exitcode(self) -> int | None:
+        try:
+            return self.process.wait(timeout=0.5)  # Its stdout may close just before it is reaped
+        except subprocess.TimeoutExpired:
+            return None
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def ping(self) -> bool:
+        try:
+            self._send({"op": "ping"})
+            return self._receive(PING_TIMEOUT).get("op") == "pong"
+        except (EOFError, OSError, subprocess.TimeoutExpired):
+            return False
+
+    def run(self, args: list[str], timeout: float | None) -> tuple[int, str, str]:
+        """Execute a command in the worker.
+
+        Raises:
+            subprocess.TimeoutExpired: If the command does not finish within timeout
+            EOFError / OSError: If the worker died while running the command
+        """
+        self.calls += 1
+        self.last_used = time.monotonic()
+        self._send({"op": "run", "args": list(args)})
+        try:
+            reply = self._receive(timeout)
+        except subprocess.TimeoutExpired:
+            raise subprocess.TimeoutExpired(["ykman"] + args, timeout) from None
+        return reply["returncode"], reply["stdout"], reply["stderr"]
+
+    def stop(self) -> None:
+        try:
+            self._send({"op": "stop"})
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.kill()
+        self._close_pipes()
+
+    def kill(self) -> None:
+        self.process.kill()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+        self._close_pipes()
+
+    def _close_pipes(self) -> None:
+        for pipe in (self.process.stdin, self.process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+class YkmanWorkerPool:
+    """Pool of warm ykman worker processes.
+
+    - Workers are spawned lazily up to `size` and reused across calls.
+    - A worker is recycled after `max_calls` invocations to bound state/memory growth.
+    - Workers idle for longer than `health_check_interval` are pinged before reuse.
+    - A worker that crashes or does not answer within `call_timeout` is killed and
+      replaced on the next call; the failing call surfaces as a CalledProcessError
+      and never takes down the server or blocks its caller indefinitely.
+
+    run() is blocking and thread-safe, so it can be used from asyncio.to_thread.
+    """
+
+    def __init__(
+        self,
+        size: int = 4,
+        max_calls: int = DEFAULT_MAX_CALLS,
+        call_timeout: float | None = DEFAULT_CALL_TIMEOUT,
+        health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL
+    ):
+        self.size = max(1, size)
+        self.max_calls = max_calls
+        self.call_timeout = call_timeout
+        self.health_check_interval = health_check_interval
+        self._idle: queue.LifoQueue[YkmanWorker] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._spawned = 0
+        self._closed = False
+        self.stats = {"calls": 0, "spawned": 0, "recycled": 0, "crashed": 0, "timeouts": 0}
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _checkout(self) -> YkmanWorker:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_spawn = self._spawned < self.size
+                    if can_spawn:
+                        self._spawned += 1
+                if not can_spawn:
+                    # Wake up periodically in case a discarded worker freed a slot
+                    try:
+                        worker = self._idle.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                else:
+                    try:
+                        worker = YkmanWorker()
+                    except BaseException:
+                        with self._lock:
+                            self._spawned -= 1
+                        raise
+                    self._count("spawned")
+                    return worker
+
+            idle_for = time.monotonic() - worker.last_used
+            if worker.is_alive() and (idle_for < self.health_check_interval or worker.ping()):
+                return worker
+            self._discard(worker, "crashed")
+
+    def _checkin(self, worker: YkmanWorker) -> None:
+        if self._closed:
+            self._discard(worker)
+        elif worker.calls >= self.max_calls:
+            self._discard(worker, "recycled", graceful=True)
+        else:
+            self._idle.put(worker)
+
+    def _discard(self, worker: YkmanWorker, reason: str | None = None, graceful: bool = False) -> None:
+        if reason:
+            self._count(reason)
+        if graceful:
+            worker.stop()
+        else:
+            worker.kill()
+        with self._lock:
+            self._spawned -= 1
+
+    def run(self, args: list[str]) -> subprocess.CompletedProcess:
+        """Execute a ykman command in a warm worker.
+
+        Mirrors subprocess.run(["ykman", *args], capture_output=True, text=True, check=True).
+
+        Raises:
+            subprocess.CalledProcessError: If the command fails, the worker crashed, or
+                                           call_timeout elapsed (the worker is replaced)
+            FileNotFoundError: If ykman cannot be imported in the worker
+        """
+        if self._closed:
+            raise RuntimeError("ykman worker pool is shut down")
+
+        cmd = ["ykman"] + args
+        try:
+            worker = self._checkout()
+        except WorkerUnavailableError as e:
+            raise FileNotFoundError(str(e)) from e
+
+        self._count("calls")
+        try:
+            returncode, stdout, stderr = worker.run(args, self.call_timeout)
+        except subprocess.TimeoutExpired:
+            self._discard(worker, "timeouts")
+            raise subprocess.CalledProcessError(
+                -1, cmd, output="",
+                stderr=f"ykman did not finish within {self.call_timeout:.0f}s; its worker was restarted"
+            ) from None
+        except (EOFError, OSError):
+            exitcode = worker.exitcode
+            self._discard(worker, "crashed")
+            raise subprocess.CalledProcessError(
+                exitcode if exitcode is not None else -1, cmd,
+                output="", stderr=f"ykman worker crashed (exit code {exitcode})"
+            )
+
+        self._checkin(worker)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+        return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+    def shutdown(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait(), graceful=True)
+            except queue.Empty:
+                break
+
+
+_pool: YkmanWorkerPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> YkmanWorkerPool | None:
+    """Return the shared pool if enabled with YKMAN_WORKER_POOL_SIZE > 0, else None."""
+    global _pool
+    if DEFAULT_POOL_SIZE <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = YkmanWorkerPool(size=DEFAULT_POOL_SIZE)
+            atexit.register(_pool.shutdown)
+    return _pool